@@ -1,15 +1,204 @@
+import atexit
+import json
 import logging
-from datetime import datetime
+import queue
+import threading
+import time
+from bisect import bisect_left, bisect_right
 from collections import namedtuple, defaultdict
+from datetime import datetime
+from itertools import count
+
+# database drivers are imported where they are used,
+# keeping the import of this module cheap for short-lived tools only checking balances.
 
 
 class AccountNotFound(Exception): pass
 
+
+class TransactionWriter(object):
+    """Writes transaction records in batches on a background thread.
+
+    Records are written once batch_size of them are queued, or after interval seconds.
+    If max_pending records are waiting to be written, submitting blocks until there is room again.
+    All submitted records are written before the interpreter exits, or when close() is called.
+    """
+    _STOP = object()
+
+    def __init__(self, write_batch, batch_size=100, interval=1.0, max_pending=10000, on_error=None):
+        """Arguments:
+            write_batch: function writing a list of transaction dicts to storage.
+            batch_size: maximum number of records written at once.
+            interval: maximum seconds a record waits before its batch is written.
+            max_pending: maximum number of queued records.
+            on_error: function called with the exception and the failed batch if writing fails.
+                Failures are logged if it is None. Failed batches are not retried."""
+        self.log = logging.getLogger("bank")
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.interval = interval
+        self.on_error = on_error
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="TransactionWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, transaction, timeout=None):
+        """Queues a transaction dict to be written. Blocks while the queue is full,
+        raises queue.Full if that takes longer than timeout seconds."""
+        if self._closed:
+            raise RuntimeError("transaction writer is closed")
+        self._queue.put(transaction, timeout=timeout)
+
+    def flush(self):
+        """Blocks until all records submitted so far are written."""
+        self._queue.join()
+
+    def close(self):
+        """Writes all queued records and stops the background thread."""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    break
+                try:
+                    transaction = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if transaction is self._STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(transaction)
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        try:
+            self.write_batch(batch)
+        except Exception as e:
+            if self.on_error is None:
+                self.log.exception("failed to write %d transaction records", len(batch))
+            else:
+                try:
+                    self.on_error(e, batch)
+                except Exception:
+                    # the writer thread must keep running
+                    self.log.exception("error callback failed for %d transaction records", len(batch))
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+
 class BaseBank(object):
     def __init__(self):
         self.log = logging.getLogger("bank")
         # a list of functions that take a user and return reserved money
         self.reserved_money_checker_functions = set()
+        # if set, records transactions in the background instead of in make_transaction()
+        self.transaction_writer = None
+        # user -> (balance, expiry time) of balances prefetched in the background.
+        # only ever replaced as a whole or changed with single dict operations, so no locks needed.
+        self._prefetched = {}
+        # seconds prefetched balances are used for. only transactions made by this bank forget them earlier,
+        # so changes made by other processes aren't seen for up to that long
+        self.prefetch_ttl = 10.0
+        # sets of users whose balances changed during a running prefetch, by prefetch
+        self._prefetch_changes = {}
+        self.prefetch_stats = {"prefetched": 0, "hits": 0}
+        # name of the extra transaction field holding the auction a transaction belongs to
+        self.auction_id_field = "auction_id"
+
+    def prefetch(self, users):
+        """Loads the balances of the given users in a single bulk query on a background thread,
+        so that getting their money afterwards doesn't have to query the storage.
+        Useful for warming up the balances of users seen in chat before they bid.
+        Prefetched balances are used for up to prefetch_ttl seconds, and only forgotten earlier when this bank
+        makes a transaction for the user. Changes made by other processes aren't seen until then.
+
+        Arguments:
+            users:
+                iterable of ids of the users to prefetch the balances for.
+
+        Returns:
+            the started thread.
+        """
+        thread = threading.Thread(target=self._prefetch, args=(list(users),), name="BankPrefetch", daemon=True)
+        thread.start()
+        return thread
+
+    def get_prefetch_effectiveness(self):
+        """Returns how often a prefetched balance was used, per prefetched balance."""
+        prefetched = self.prefetch_stats["prefetched"]
+        return self.prefetch_stats["hits"] / prefetched if prefetched else 0.0
+
+    def _prefetch(self, users):
+        changes = set()
+        key = object()
+        self._prefetch_changes[key] = changes
+        try:
+            balances = self._get_stored_money_values(users)
+            expires_at = time.monotonic() + self.prefetch_ttl
+            for user, balance in balances.items():
+                # balances changed while querying might be outdated already.
+                # checked after storing, because a change may happen right in between
+                self._prefetched[user] = (balance, expires_at)
+                if user in changes:
+                    self._prefetched.pop(user, None)
+        except Exception:
+            self.log.exception("failed to prefetch %d balances", len(users))
+            return
+        finally:
+            # only stop tracking changes once no more balances are stored
+            del self._prefetch_changes[key]
+        self.prefetch_stats["prefetched"] += len(balances)
+
+    def _forget_prefetched(self, user):
+        """Call when a user's balance changed."""
+        # tell running prefetches first, so they can't store an outdated balance after it was forgotten
+        for changes in list(self._prefetch_changes.values()):
+            changes.add(user)
+        self._prefetched.pop(user, None)
+
+    def _get_stored_money_values(self, users):
+        """Returns a dict(user:balance) for those of the users that have an account.
+        Storages supporting bulk queries should override this."""
+        balances = {}
+        for user in users:
+            try:
+                balances[user] = self._get_stored_money_value(user)
+            except AccountNotFound:
+                pass
+        return balances
+
+    def start_transaction_writer(self, **kwargs):
+        """Records transactions in batches on a background thread from now on,
+        instead of synchronously in make_transaction().
+        Keyword arguments are passed on to TransactionWriter."""
+        if self.transaction_writer is None:
+            self.transaction_writer = TransactionWriter(self._record_transactions, **kwargs)
+        return self.transaction_writer
+
+    def stop_transaction_writer(self):
+        """Writes out all transactions queued in the background and records synchronously again."""
+        writer = self.transaction_writer
+        if writer is not None:
+            self.transaction_writer = None
+            writer.close()
 
     def get_reserved_money(self, user):
         """Determine the total amount of reserved money.
@@ -32,16 +221,27 @@ class BaseBank(object):
             reserved_money += reserved_money_checking_function(user)
         return reserved_money
 
-    def get_total_money(self, user):
+    def get_total_money(self, user, use_prefetched=True):
         """Get the amount of all a user's money, including reserved.
 
         Arguments:
             user:
                 id of the user to get the total money for.
+            use_prefetched:
+                whether a balance prefetched up to prefetch_ttl seconds ago may be returned.
+                Pass False where changes made by other processes must be seen,
+                e.g. when reserving money shared between processes.
 
         Returns:
             total amount of money the specified user has.
         """
+        prefetched = self._prefetched.get(user) if use_prefetched else None
+        if prefetched is not None:
+            balance, expires_at = prefetched
+            if time.monotonic() < expires_at:
+                self.prefetch_stats["hits"] += 1
+                return balance
+            self._prefetched.pop(user, None)
         return self._get_stored_money_value(user)
 
     def get_available_money(self, user):
@@ -71,12 +271,28 @@ class BaseBank(object):
     def _adjust_stored_money_value(self, user, change):
         raise NotImplementedError("storage not implemented")
 
-    def _record_transaction(self, user, change):
+    def _record_transaction(self, transaction):
         raise NotImplementedError("storage not implemented")
 
+    def _record_transactions(self, transactions):
+        """Records a batch of transactions. Storages supporting bulk inserts should override this."""
+        for transaction in transactions:
+            self._record_transaction(transaction)
+
+    def _change_stored_money_value(self, user, change):
+        """Adjusts the stored balance and returns a tuple (old_balance, new_balance).
+        Storages able to do this atomically should override this."""
+        old_balance = self._get_stored_money_value(user)
+        self._adjust_stored_money_value(user, change)
+        new_balance = self._get_stored_money_value(user)
+        return old_balance, new_balance
+
     def make_transaction(self, user, change, extra):
         """Adjust a user's balance and make a record of it.
 
+        If a transaction writer was started, the record is written in the background
+        and the returned dict must not be modified.
+
         Arguments:
             user:
                 id of the user whose account is being affected.
@@ -84,9 +300,10 @@ class BaseBank(object):
                  the amount to adjust the balance by.
         """
         self.log.info("adjusting %s's balance by %+d", user, change)
-        old_balance = self._get_stored_money_value(user)
-        self._adjust_stored_money_value(user, change)
-        new_balance = self._get_stored_money_value(user)
+        try:
+            old_balance, new_balance = self._change_stored_money_value(user, change)
+        finally:
+            self._forget_prefetched(user)
         transaction = dict(
             user=user,
             change=change,
@@ -95,9 +312,76 @@ class BaseBank(object):
             new_balance=new_balance,
             **extra)
         self.log.debug("recording transaction: %r", transaction)
-        self._record_transaction(transaction)
+        if self.transaction_writer is not None:
+            self.transaction_writer.submit(transaction)
+        else:
+            self._record_transaction(transaction)
         return transaction
 
+    def get_transactions(self, user, since=None, limit=100, newest_first=False, before=None):
+        """Returns a list of up to limit recorded transactions of a user, ordered by time.
+        Transactions recorded at the same time are ordered by when they were recorded.
+        Transactions still queued in the transaction writer are not included.
+        Use get_transactions_page() to page through them.
+
+        Arguments:
+            user:
+                id of the user whose transactions to get.
+            since:
+                only get transactions after this datetime.
+            limit:
+                maximum number of transactions returned.
+            newest_first:
+                order by descending time, e.g. to get the most recent transactions.
+            before:
+                only get transactions before this datetime.
+        """
+        return [transaction for _, transaction in
+                self._iter_transactions(user, since, before, newest_first, limit)]
+
+    def iter_transactions(self, user, since=None, newest_first=False, before=None):
+        """Iterates over all recorded transactions of a user without loading them all at once.
+        See get_transactions() for the arguments."""
+        for _, transaction in self._iter_transactions(user, since, before, newest_first):
+            yield transaction
+
+    def get_transactions_page(self, user, cursor=None, limit=100, newest_first=False):
+        """Returns a tuple (transactions, cursor) with the next page of up to limit recorded
+        transactions of a user, ordered like get_transactions().
+        Pass the returned cursor to get the page after it, it is None after the last page.
+        Unlike paging by timestamps, transactions recorded at the same time are never skipped or repeated.
+
+        Arguments:
+            user:
+                id of the user whose transactions to get.
+            cursor:
+                cursor returned for the previous page, or None for the first page.
+                Cursors are specific to the storage and the order.
+            limit:
+                maximum number of transactions returned, at least 1.
+            newest_first:
+                page from the most recent transactions back.
+        """
+        after, before = (None, cursor) if newest_first else (cursor, None)
+        # one more to know whether there is a next page
+        rows = list(self._iter_transactions(user, after, before, newest_first, limit + 1))
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [transaction for _, transaction in rows[:limit]], next_cursor
+
+    def _iter_transactions(self, user, after, before, newest_first, limit=None):
+        """Iterates over tuples (cursor, transaction) of a user's recorded transactions, ordered by time
+        and then by when they were recorded. Each of after and before is None, a datetime the timestamps
+        must be after or before, or a cursor the transactions must come after or before in ascending order.
+        A cursor is a tuple (timestamp, storage-specific sequence number) uniquely identifying a transaction.
+        Storages must override this."""
+        raise NotImplementedError("storage not implemented")
+
+    def get_auction_transactions(self, auction_id):
+        """Returns a list of all recorded transactions whose extra field named by auction_id_field
+        is auction_id, ordered by time.
+        Storages must override this."""
+        raise NotImplementedError("storage not implemented")
+
 
 class DummyBank(BaseBank):
     """In-memory bank with no persistence, great for debugging."""
@@ -105,6 +389,12 @@ class DummyBank(BaseBank):
         super(DummyBank, self).__init__()
         self._storage = {}
         self._starting_amount = 50000
+        self.transactions = []
+        # user -> (cursors, transactions), and auction id -> (cursors, transactions), sorted by cursor.
+        # cursors are (timestamp, sequence number of the record)
+        self._user_transactions = defaultdict(lambda: ([], []))
+        self._auction_transactions = defaultdict(lambda: ([], []))
+        self._transaction_sequence = count()
 
     def _get_stored_money_value(self, user):
         if user not in self._storage:
@@ -117,20 +407,77 @@ class DummyBank(BaseBank):
         self._storage[user] += change
         self.log.debug("dummy storage: %r", self._storage)
 
+    def _record_transaction(self, transaction):
+        self.transactions.append(transaction)
+        cursor = (transaction["timestamp"], next(self._transaction_sequence))
+        self._insort(self._user_transactions[transaction["user"]], cursor, transaction)
+        auction_id = transaction.get(self.auction_id_field)
+        if auction_id is not None:
+            self._insort(self._auction_transactions[auction_id], cursor, transaction)
+
+    @staticmethod
+    def _insort(index, cursor, transaction):
+        cursors, transactions = index
+        position = bisect_right(cursors, cursor)
+        cursors.insert(position, cursor)
+        transactions.insert(position, transaction)
+
+    def _iter_transactions(self, user, after, before, newest_first, limit=None):
+        cursors, transactions = self._user_transactions.get(user, ((), ()))
+        # a datetime bound sorts after or before all cursors with that timestamp
+        if after is None:
+            start = 0
+        else:
+            start = bisect_right(cursors, after if isinstance(after, tuple) else (after, float("inf")))
+        if before is None:
+            end = len(cursors)
+        else:
+            end = bisect_left(cursors, before if isinstance(before, tuple) else (before, -1))
+        if newest_first:
+            positions = range(end - 1, start - 1, -1)
+        else:
+            positions = range(start, end)
+        if limit is not None:
+            positions = positions[:limit]
+        for position in positions:
+            yield cursors[position], transactions[position]
+
+    def get_auction_transactions(self, auction_id):
+        return list(self._auction_transactions.get(auction_id, ((), ()))[1])
+
     def debug(self):
         for user in self._storage.keys():
             print("%10s %d" % (user, self.get_available_money(user)))
 
 
 class MongoBank(BaseBank):
-    def __init__(self, db, users_collection_name="users", transactions_collection_name="transactions", field_name="money"):
+    def __init__(self, db, users_collection_name="users", transactions_collection_name="transactions", field_name="money",
+                 auction_id_field="auction_id"):
         super(MongoBank, self).__init__()
         self.db = db
         self.users_collection_name = users_collection_name
         self.transactions_collection_name = transactions_collection_name
-        self.users_collection = self.db[self.users_collection_name]
-        self.transactions_collection = self.db[self.transactions_collection_name]
         self.field_name = field_name
+        self.auction_id_field = auction_id_field
+        # collections are only looked up on first use, constructing the bank doesn't talk to the database
+        self._users_collection = None
+        self._transactions_collection = None
+
+    @property
+    def users_collection(self):
+        if self._users_collection is None:
+            self._users_collection = self.db[self.users_collection_name]
+        return self._users_collection
+
+    @property
+    def transactions_collection(self):
+        if self._transactions_collection is None:
+            collection = self.db[self.transactions_collection_name]
+            # indexes used by the transaction queries. creating an existing index does nothing
+            collection.create_index([("user", 1), ("timestamp", 1), ("_id", 1)])
+            collection.create_index(self.auction_id_field, sparse=True)
+            self._transactions_collection = collection
+        return self._transactions_collection
 
     def _get_stored_money_value(self, user):
         doc = self.users_collection.find_one({"_id": user})
@@ -138,12 +485,227 @@ class MongoBank(BaseBank):
             raise AccountNotFound("no account for: %s", user)
         return doc[self.field_name]
 
+    def _get_stored_money_values(self, users):
+        docs = self.users_collection.find({"_id": {"$in": users}}, {self.field_name: 1})
+        return {doc["_id"]: doc[self.field_name] for doc in docs}
+
     def _adjust_stored_money_value(self, user, change):
         self.users_collection.update({"_id": user}, {"$inc": {self.field_name: change}})
 
     def _record_transaction(self, transaction):
         self.transactions_collection.insert(transaction)
 
+    def _record_transactions(self, transactions):
+        self.transactions_collection.insert(transactions)
+
+    def _iter_transactions(self, user, after, before, newest_first, limit=None):
+        # cursors are (timestamp, _id), ObjectIds increase in the order documents were inserted
+        bounds = []
+        for bound, operator in ((after, "$gt"), (before, "$lt")):
+            if isinstance(bound, tuple):
+                timestamp, object_id = bound
+                bounds.append({"$or": [{"timestamp": {operator: timestamp}},
+                                       {"timestamp": timestamp, "_id": {operator: object_id}}]})
+            elif bound is not None:
+                bounds.append({"timestamp": {operator: bound}})
+        query = {"user": user}
+        if bounds:
+            query["$and"] = bounds
+        order = -1 if newest_first else 1
+        cursor = self.transactions_collection.find(query).sort([("timestamp", order), ("_id", order)])
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        for transaction in cursor:
+            object_id = transaction.pop("_id")
+            yield (transaction["timestamp"], object_id), transaction
+
+    def get_auction_transactions(self, auction_id):
+        return list(self.transactions_collection.find({self.auction_id_field: auction_id}, {"_id": 0})
+                    .sort("timestamp", 1))
+
+
+class SqliteBank(BaseBank):
+    """Bank persisting into a local SQLite database, no server needed.
+
+    The database runs in WAL mode, so readers in other processes don't block writes.
+    Balances are changed atomically with a single UPDATE ... RETURNING (requires SQLite 3.35+).
+    Transaction records are buffered and inserted in batches of batch_size in a single
+    database transaction, call flush() or close() to write out the remaining ones.
+    """
+    # constant statements, so the connection's statement cache keeps them prepared
+    _CREATE_ACCOUNTS = ("CREATE TABLE IF NOT EXISTS accounts "
+                        "(user_id PRIMARY KEY, balance INTEGER NOT NULL)")
+    _CREATE_TRANSACTIONS = ("CREATE TABLE IF NOT EXISTS transactions "
+                            "(id INTEGER PRIMARY KEY, user_id, change INTEGER, timestamp TEXT, "
+                            "old_balance INTEGER, new_balance INTEGER, extra TEXT)")
+    _CREATE_USER_INDEX = "CREATE INDEX IF NOT EXISTS transactions_user ON transactions (user_id, timestamp)"
+    # the auction id index and query need the same expression, which contains the field name
+    _AUCTION_ID = "json_extract(extra, '$.\"%s\"')"
+    _CREATE_AUCTION_INDEX = "CREATE INDEX IF NOT EXISTS transactions_auction ON transactions (%s)"
+    # cursors are (timestamp, id), bounded on both sides. the index on (user_id, timestamp) includes the id
+    _SELECT_TRANSACTIONS = ("SELECT id, user_id, change, timestamp, old_balance, new_balance, extra "
+                            "FROM transactions WHERE user_id = ? AND (timestamp, id) > (?, ?) "
+                            "AND (timestamp, id) < (?, ?) ORDER BY timestamp %s, id %s LIMIT ?")
+    # ids are positive 64 bit integers
+    _MAX_ID = 2 ** 63 - 1
+    _SELECT_BALANCE = "SELECT balance FROM accounts WHERE user_id = ?"
+    # bulk queries select this many users at once, staying below SQLite's parameter limit
+    _BULK_SIZE = 500
+    _CREATE_ACCOUNT = "INSERT OR IGNORE INTO accounts (user_id, balance) VALUES (?, ?)"
+    _UPDATE_BALANCE = "UPDATE accounts SET balance = balance + ? WHERE user_id = ? RETURNING balance"
+    _INSERT_TRANSACTION = ("INSERT INTO transactions "
+                           "(user_id, change, timestamp, old_balance, new_balance, extra) "
+                           "VALUES (?, ?, ?, ?, ?, ?)")
+
+    def __init__(self, path, starting_amount=None, batch_size=100, auction_id_field="auction_id"):
+        """Arguments:
+            path: path of the database file, created if it doesn't exist.
+            starting_amount: balance of accounts created on first use.
+                If None, unknown users raise AccountNotFound like in MongoBank.
+            batch_size: how many transaction records are buffered before inserting them.
+                Buffered records are inserted at the latest when close() is called or the interpreter exits.
+            auction_id_field: name of the extra transaction field to index the auction id of.
+                Must not contain double quotes, and must stay the same for a database."""
+        super(SqliteBank, self).__init__()
+        import sqlite3
+        self.path = path
+        self.starting_amount = starting_amount
+        self.batch_size = batch_size
+        self.auction_id_field = auction_id_field
+        self._auction_id = self._AUCTION_ID % auction_id_field
+        # autocommit mode, transactions are started explicitly where needed
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(self._CREATE_ACCOUNTS)
+        self.connection.execute(self._CREATE_TRANSACTIONS)
+        self.connection.execute(self._CREATE_USER_INDEX)
+        self.connection.execute(self._CREATE_AUCTION_INDEX % self._auction_id)
+        self._lock = threading.RLock()
+        self._pending_transactions = []
+        atexit.register(self.flush)
+
+    def create_account(self, user, balance):
+        """Creates an account with the given balance, if it doesn't exist yet."""
+        with self._lock:
+            self.connection.execute(self._CREATE_ACCOUNT, (user, balance))
+
+    def _get_stored_money_value(self, user):
+        with self._lock:
+            row = self.connection.execute(self._SELECT_BALANCE, (user,)).fetchone()
+            if row is None:
+                if self.starting_amount is None:
+                    raise AccountNotFound("no account for: %s", user)
+                self.create_account(user, self.starting_amount)
+                return self.starting_amount
+            return row[0]
+
+    def _get_stored_money_values(self, users):
+        balances = {}
+        with self._lock:
+            for start in range(0, len(users), self._BULK_SIZE):
+                chunk = users[start:start + self._BULK_SIZE]
+                query = "SELECT user_id, balance FROM accounts WHERE user_id IN (%s)" % ",".join("?" * len(chunk))
+                balances.update(self.connection.execute(query, chunk).fetchall())
+        return balances
+
+    def _change_stored_money_value(self, user, change):
+        with self._lock:
+            rows = self.connection.execute(self._UPDATE_BALANCE, (change, user)).fetchall()
+            if not rows:
+                if self.starting_amount is None:
+                    raise AccountNotFound("no account for: %s", user)
+                self.create_account(user, self.starting_amount)
+                rows = self.connection.execute(self._UPDATE_BALANCE, (change, user)).fetchall()
+            new_balance = rows[0][0]
+            return new_balance - change, new_balance
+
+    def _adjust_stored_money_value(self, user, change):
+        self._change_stored_money_value(user, change)
+
+    def _record_transaction(self, transaction):
+        with self._lock:
+            self._pending_transactions.append(transaction)
+            if len(self._pending_transactions) >= self.batch_size:
+                self.flush()
+
+    def _record_transactions(self, transactions):
+        with self._lock:
+            self._pending_transactions.extend(transactions)
+            self.flush()
+
+    def flush(self):
+        """Inserts all buffered transaction records in a single database transaction."""
+        with self._lock:
+            if not self._pending_transactions:
+                return
+            rows = [self._transaction_row(transaction) for transaction in self._pending_transactions]
+            with self.connection:
+                self.connection.execute("BEGIN")
+                self.connection.executemany(self._INSERT_TRANSACTION, rows)
+            self._pending_transactions = []
+
+    def _iter_transactions(self, user, after, before, newest_first, limit=None):
+        order = "DESC" if newest_first else "ASC"
+        # an empty string is before all timestamps, and a datetime bound sorts after or before
+        # all ids with that timestamp
+        if after is None:
+            after = ("", 0)
+        elif not isinstance(after, tuple):
+            after = (after.isoformat(), self._MAX_ID)
+        if before is None:
+            before = ("~", 0)
+        elif not isinstance(before, tuple):
+            before = (before.isoformat(), 0)
+        with self._lock:
+            self.flush()
+            # a negative limit means no limit
+            cursor = self.connection.execute(self._SELECT_TRANSACTIONS % (order, order),
+                                             (user,) + after + before + (-1 if limit is None else limit,))
+        while True:
+            # fetched in chunks, not holding the lock while the caller processes them
+            with self._lock:
+                rows = cursor.fetchmany(100)
+            if not rows:
+                return
+            for row in rows:
+                yield (row[3], row[0]), self._transaction_from_row(row[1:])
+
+    def get_auction_transactions(self, auction_id):
+        with self._lock:
+            self.flush()
+            rows = self.connection.execute(
+                "SELECT user_id, change, timestamp, old_balance, new_balance, extra FROM transactions "
+                "WHERE %s = ? ORDER BY timestamp, id" % self._auction_id, (auction_id,)).fetchall()
+        return [self._transaction_from_row(row) for row in rows]
+
+    def close(self):
+        """Writes out buffered transaction records and closes the database."""
+        self.stop_transaction_writer()
+        with self._lock:
+            self.flush()
+            atexit.unregister(self.flush)
+            self.connection.close()
+
+    @staticmethod
+    def _transaction_row(transaction):
+        extra = {key: value for key, value in transaction.items()
+                 if key not in ("user", "change", "timestamp", "old_balance", "new_balance")}
+        return (transaction["user"], transaction["change"], transaction["timestamp"].isoformat(),
+                transaction["old_balance"], transaction["new_balance"],
+                json.dumps(extra, default=str))
+
+    @staticmethod
+    def _transaction_from_row(row):
+        user, change, timestamp, old_balance, new_balance, extra = row
+        return dict(
+            user=user,
+            change=change,
+            timestamp=datetime.fromisoformat(timestamp),
+            old_balance=old_balance,
+            new_balance=new_balance,
+            **json.loads(extra))
+
 
 def main():
     bank = DummyBank()
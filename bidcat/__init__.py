@@ -13,10 +13,14 @@ What is bidded on are called "items" and are any hashable objects.
 The bidding entities called "users" are any hashable objects.
 """
 
-from contextlib import suppress
-from collections import OrderedDict
+import time
+from bisect import bisect_left, insort
+from heapq import nsmallest
+from collections import OrderedDict, deque, namedtuple
+from itertools import count
 from math import ceil
 from operator import itemgetter
+from types import MappingProxyType
 
 
 class BiddingError(Exception):
@@ -44,19 +48,404 @@ class VisiblyLoweredError(BiddingError):
     pass
 
 
+class TooManyItemsError(BiddingError):
+    """Is raised when a bid fails because the user already bid on the
+    maximum number of items."""
+    pass
+
+
+class BidTooHighError(BiddingError):
+    """Is raised when a bid fails because it is above the maximum amount
+    a user may bid on a single item."""
+    pass
+
+
+class RateLimitedError(BiddingError):
+    """Is raised when a bid fails because the user changed too many bids
+    recently."""
+    pass
+
+
+# frozen state of a single item inside an AuctionSnapshot
+_ItemEntry = namedtuple("_ItemEntry", ["last_change", "total", "bids"])
+
+
+class _PersistentMap:
+    """Immutable hash map, stored as a hash array mapped trie.
+    set() and delete() return a new map sharing all nodes with this one,
+    except for the few nodes on the path to the changed key, which are copied.
+
+    Nodes are lists of 32 slots, indexed by 5 bits of the keys' hashes per level. A slot is None,
+    a tuple(hash, key, value), a nested node, or once all hash bits are used up, a dict(key:value)."""
+    __slots__ = ("_root", "_len")
+
+    def __init__(self, root=None, length=0):
+        self._root = root
+        self._len = length
+
+    def __len__(self):
+        return self._len
+
+    def get(self, key, default=None):
+        h = hash(key) & _HASH_MASK
+        node = self._root
+        shift = 0
+        while node is not None:
+            slot = node[(h >> shift) & 31]
+            if type(slot) is tuple:
+                return slot[2] if slot[0] == h and (slot[1] is key or slot[1] == key) else default
+            if type(slot) is dict:
+                return slot.get(key, default)
+            node = slot
+            shift += 5
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def items(self):
+        """Yields all tuple(key, value), in no particular order."""
+        if self._root is not None:
+            yield from _trie_items(self._root)
+
+    def set(self, key, value):
+        """Returns a copy of this map, with key mapped to value."""
+        root, added = _trie_set(self._root, 0, hash(key) & _HASH_MASK, key, value)
+        return _PersistentMap(root, self._len + added)
+
+    def delete(self, key):
+        """Returns a copy of this map without key, or this map if key isn't in it."""
+        if self._root is None:
+            return self
+        root = _trie_delete(self._root, 0, hash(key) & _HASH_MASK, key)
+        if root is self._root:
+            return self
+        return _PersistentMap(root, self._len - 1)
+
+
+_HASH_MASK = (1 << 64) - 1
+_MISSING = object()
+
+
+def _trie_items(node):
+    for slot in node:
+        if slot is None:
+            continue
+        if type(slot) is tuple:
+            yield slot[1], slot[2]
+        elif type(slot) is dict:
+            yield from slot.items()
+        else:
+            yield from _trie_items(slot)
+
+
+def _trie_set(node, shift, h, key, value):
+    """Returns a copy of node with key set to value, and whether the key was added."""
+    new = [None] * 32 if node is None else list(node)
+    index = (h >> shift) & 31
+    slot = new[index]
+    added = True
+    if slot is None:
+        new[index] = (h, key, value)
+    elif type(slot) is tuple:
+        if slot[0] == h and (slot[1] is key or slot[1] == key):
+            new[index] = (h, key, value)
+            added = False
+        elif shift + 5 >= 64:
+            new[index] = {slot[1]: slot[2], key: value}
+        else:
+            # both keys go one level deeper
+            nested, _ = _trie_set(None, shift + 5, slot[0], slot[1], slot[2])
+            new[index], _ = _trie_set(nested, shift + 5, h, key, value)
+    elif type(slot) is dict:
+        added = key not in slot
+        new[index] = dict(slot)
+        new[index][key] = value
+    else:
+        new[index], added = _trie_set(slot, shift + 5, h, key, value)
+    return new, added
+
+
+def _trie_delete(node, shift, h, key):
+    """Returns a copy of node without key, None if that is empty, or node itself if key isn't in it."""
+    index = (h >> shift) & 31
+    slot = node[index]
+    if slot is None:
+        return node
+    if type(slot) is tuple:
+        if slot[0] != h or not (slot[1] is key or slot[1] == key):
+            return node
+        replacement = None
+    elif type(slot) is dict:
+        if key not in slot:
+            return node
+        replacement = dict(slot)
+        del replacement[key]
+    else:
+        replacement = _trie_delete(slot, shift + 5, h, key)
+        if replacement is slot:
+            return node
+    new = list(node)
+    new[index] = replacement or None
+    return None if new.count(None) == 32 else new
+
+
+def allocate_proportional(bids, total_charge, discount_latter=False):
+    """Allocation strategy splitting the charge proportionally to the amounts bid, rounded up.
+    Because of rounding up, the higher, and if tied the earlier bidders get discounted
+    the money paid too much, or the later bidders if discount_latter is True.
+
+    Allocation strategies take the bids on the winning item as dict(user:amount) in the order
+    they were placed, and the total charge for that item, and return an OrderedDict(user:money)
+    whose sum is the total charge."""
+    total_bid = sum(bids.values())
+    # Step 1: calculate the paid price based on the percentage of the full price, ceiled!
+    money_owed = OrderedDict()
+    for user, amount in sorted(bids.items(), key=itemgetter(1), reverse=True):
+        percentage = amount / total_bid
+        money_owed[user] = ceil(total_charge * percentage)
+    # Note the above iteration order: highest bidders first, then ordered of winning_bids,
+    # which is insertion ordered.
+    # This ensures earlier bids are visited first, and favored for following price discounts:
+    # Step 2: because of ceiling the prices, the sum might be too high.
+    # => calculate how much was overpaid, and discount the higher, and if tied the earlier bidders
+    overpaid = sum(money_owed.values()) - total_charge
+    # if discount_latter is True, actually discounts the later bidders, the oppisite as described above
+    if discount_latter:
+        user_iter = iter(reversed(money_owed))
+    else:
+        user_iter = iter(money_owed)
+    for _ in range(overpaid):
+        money_owed[next(user_iter)] -= 1
+    return money_owed
+
+
+def allocate_equal_split(bids, total_charge, discount_latter=False):
+    """Allocation strategy splitting the charge equally between all bidders ("water-filling"),
+    with nobody paying more than they bid. This is what bidcat_legacy does, e.g. a charge of 5
+    on bids of 1, 4, 2 and 2 is split into 1, 2, 1 and 1.
+    The money that can't be split equally is paid by the higher, and if tied the earlier bidders,
+    or the later bidders if discount_latter is True.
+    See allocate_proportional() for the arguments and return value."""
+    # highest bidders first, then in insertion order
+    ordered = sorted(bids.items(), key=itemgetter(1), reverse=True)
+    # find the level everybody pays up to, by raising it from the smallest bid upwards
+    level = 0
+    remaining = total_charge
+    users_left = len(ordered)
+    for _, amount in reversed(ordered):
+        step = amount - level
+        if step * users_left > remaining:
+            level += remaining // users_left
+            break
+        remaining -= step * users_left
+        level = amount
+        users_left -= 1
+    money_owed = OrderedDict((user, min(amount, level)) for user, amount in ordered)
+    # the rest is paid by one more each by those who bid more than the level
+    rest = total_charge - sum(money_owed.values())
+    candidates = [user for user, amount in ordered if amount > level]
+    if discount_latter:
+        candidates.reverse()
+    for user in candidates[:rest]:
+        money_owed[user] += 1
+    return money_owed
+
+
+def _winners_from_ordered(bids, count, discount_latter=False, allocation=allocate_proportional):
+    """Computes the get_winners() result for count winners from bids ordered by ranking,
+    as returned by get_all_bids_ordered(), using the given allocation strategy.
+    Only the top count+1 items of bids are needed."""
+    results = []
+    totals = [sum(itembids.values()) for _, itembids in bids[:count + 1]]
+    for rank, (item, winning_bids) in enumerate(bids[:count]):
+        # determine the next highest bet amount
+        next_bid = totals[rank + 1] if rank + 1 < len(totals) else 0
+        # determine what will actually be paid.
+        # e.g. if the next highest bid was 5, only pay 6
+        total_bid = totals[rank]
+        overpaid = max(0, total_bid-next_bid-1)
+        total_charge = total_bid - overpaid
+        # allot the actual price between the bidders
+        money_owed = allocation(winning_bids, total_charge, discount_latter)
+        results.append({
+            "item": item,
+            "total_bid": total_bid,
+            "total_charge": total_charge,
+            "money_owed": money_owed,
+        })
+    return results
+
+
+def _winner_from_ordered(bids, discount_latter=False, allocation=allocate_proportional):
+    """Computes the get_winner() result from the top two items of bids ordered by ranking."""
+    winners = _winners_from_ordered(bids, 1, discount_latter, allocation)
+    return winners[0] if winners else None
+
+
+def _what_if(top, itembids, totals, user, item, amount, discount_latter=False, allocation=allocate_proportional):
+    """Computes the get_winner() result if user's bid on item was amount (0=removed),
+    from the top three ranking keys (-total, last change, item), bids as dict(item:dict(user:amount))
+    and totals as dict(item:total), without changing any of those."""
+    bids = dict(itembids.get(item, {}))
+    previous = bids.pop(user, 0)
+    ordered = [(other, itembids[other]) for _, _, other in top[:2]]
+    if amount == previous:
+        # nothing would change
+        return _winner_from_ordered(ordered, discount_latter, allocation)
+    # the changed bid moves to the end, and the item becomes the most recently changed one,
+    # ranking it after all other items with the same total
+    ordered = [(other, itembids[other]) for _, _, other in top if other != item][:2]
+    if amount:
+        bids[user] = amount
+    if bids:
+        total = totals.get(item, 0) - previous + amount
+        rank = sum(1 for other, _ in ordered if totals[other] >= total)
+        ordered.insert(rank, (item, bids))
+    return _winner_from_ordered(ordered[:2], discount_latter, allocation)
+
+
+class AuctionSnapshot:
+    """Immutable view of an auction's bids at one point in time.
+
+    Every change to an Auction publishes a new snapshot with a higher version number.
+    Snapshots keep their items in a persistent hash trie sharing all unchanged items with their
+    predecessor, so publishing one only copies the changed item's bids and O(log n) trie nodes.
+    Reading from a snapshot never blocks or observes the auction's writers,
+    which makes e.g. a winner and a leaderboard read from the same snapshot consistent.
+    """
+    __slots__ = ("version", "_entries", "_ordered", "_allocation")
+
+    def __init__(self, version, entries, allocation=allocate_proportional):
+        """Arguments:
+            version: monotonically increasing version number of the auction state.
+            entries: _PersistentMap(item:_ItemEntry).
+            allocation: the auction's allocation strategy."""
+        self.version = version
+        self._entries = entries
+        self._ordered = None
+        self._allocation = allocation
+
+    def get_bids_for_item(self, item):
+        """Returns a read-only dict(user:amount) of bids on that item."""
+        entry = self._entries.get(item)
+        return entry.bids if entry else MappingProxyType({})
+
+    def get_all_bids(self):
+        """Returns all bids as dict(item:read-only dict(user:amount))"""
+        return {item: entry.bids for item, entry in self._entries.items()}
+
+    @staticmethod
+    def _ranking_key(entry):
+        # same order as the auction's ranking
+        _, (last_change, total, _) = entry
+        return -total, last_change
+
+    def get_all_bids_ordered(self):
+        """Returns all bids as [tuple(item, read-only dict(user:amount))...], ordered by
+        ranking (first=winner). See Auction.get_all_bids_ordered()"""
+        if self._ordered is None:
+            # computing this twice in a race is harmless, the result is the same
+            ordered = sorted(self._entries.items(), key=self._ranking_key)
+            self._ordered = [(item, entry.bids) for item, entry in ordered]
+        return list(self._ordered)
+
+    def iter_bids_ordered(self, offset=0, limit=None):
+        """Yields the tuple(item, read-only dict(user:amount)) of items ranked offset to offset+limit-1.
+        See Auction.iter_bids_ordered().
+        Unless the full ranking was computed already, only the top offset+limit items are sorted."""
+        if self._ordered is not None or limit is None:
+            yield from self.get_all_bids_ordered()[offset:None if limit is None else offset + limit]
+            return
+        top = nsmallest(offset + limit, self._entries.items(), key=self._ranking_key)
+        for item, entry in top[offset:]:
+            yield item, entry.bids
+
+    def get_winner(self, discount_latter=False):
+        """Calculates the item winning in this snapshot. See Auction.get_winner()"""
+        return _winner_from_ordered(list(self.iter_bids_ordered(limit=2)), discount_latter, self._allocation)
+
+    def get_winners(self, count, discount_latter=False):
+        """Calculates the top count items winning in this snapshot. See Auction.get_winners()"""
+        if count < 0:
+            raise ValueError("count must not be negative.")
+        return _winners_from_ordered(list(self.iter_bids_ordered(limit=count + 1)), count,
+                                     discount_latter, self._allocation)
+
+
 class Auction:
     """Handles multiple users bidding on multiple items, only one item can win.
-    All provided items and users must be hashable."""
-    def __init__(self, bank):
+    All provided items and users must be hashable.
+
+    Bids must be changed from one thread at a time.
+    Other threads may read consistent state concurrently through snapshot()."""
+    def __init__(self, bank, max_items_per_user=None, max_bid=None, rate_limit=None, clock=time.monotonic,
+                 allocation=allocate_proportional, max_operation_ids=10000, operation_id_ttl=600.0,
+                 winner_max_age=None, winner_max_mutations=None):
         """Arguments:
-            bank: the bank object the auction checks and reserves users' money in."""
+            bank: the bank object the auction checks and reserves users' money in.
+            max_items_per_user: maximum number of items a user may bid on at the same time,
+                further bids raise TooManyItemsError.
+            max_bid: maximum amount a user may bid on a single item, higher bids raise BidTooHighError.
+            rate_limit: tuple (count, seconds), a user may place, replace or increase bids at most
+                count times within any seconds long period, further bids raise RateLimitedError.
+                Removing bids is never limited.
+            clock: function returning the current time in seconds, used for the rate limit.
+            allocation: strategy splitting the winning item's charge between its bidders,
+                allocate_proportional or allocate_equal_split.
+            max_operation_ids: maximum number of operation ids remembered to recognize
+                redelivered bid operations, the oldest ones are forgotten first.
+            operation_id_ttl: seconds an operation id is remembered for at most.
+            winner_max_age: if set, get_winner() may return a result computed up to this many seconds ago.
+            winner_max_mutations: if set, get_winner() may return a result computed up to this many
+                bid changes ago. With both set, a result is recomputed once either limit is reached."""
+        if rate_limit is not None and rate_limit[0] < 1:
+            raise ValueError("rate_limit must allow at least 1 bid change.")
         self.bank = bank
         self.bank.reserved_money_checker_functions.add(self.get_reserved_money)
-        # item -> user -> amount
+        self.max_items_per_user = max_items_per_user
+        self.max_bid = max_bid
+        self.rate_limit = rate_limit
+        self._clock = clock
+        # see the allocation property
+        self._allocation = allocation
+        # item -> user -> amount, users in the order their bids last changed
         self._itembids = {}
-        # keep an order of when items got updated.
+        # user -> item -> amount, and user -> total amount reserved
+        self._userbids = {}
+        self._user_totals = {}
+        # user -> times of the latest bid changes, for the rate limit
+        self._recent_changes = {}
+        # keep an order of when items got updated: item -> change number.
         # if 2 items tie in price, the one least recently updates wins.
-        self._changes_tracker = []
+        self._last_change = {}
+        self._change_counter = count()
+        # item -> total amount bid on it
+        self._totals = {}
+        # ranking keys (-total, last change, item) kept sorted, first=winner.
+        # change numbers are unique, so items themselves are never compared.
+        self._ranking = []
+        self._ranking_keys = {}
+        # latest published immutable state, replaced on every change
+        self._snapshot = AuctionSnapshot(0, _PersistentMap(), allocation)
+        # functions called with (user, item) after a bid changed, and with (None, None) after clear()
+        self.change_listeners = set()
+        # if set, function called with (user, needed money) instead of checking the bank's available money.
+        # it must either reserve that money atomically or raise InsufficientMoneyError,
+        # see bidcat.shared.SharedReservedTable
+        self.money_reserver = None
+        self.max_operation_ids = max_operation_ids
+        self.operation_id_ttl = operation_id_ttl
+        # operation id -> (expiry time, result) of successful operations, oldest first
+        self._operations = OrderedDict()
+        self.duplicate_operations = 0
+        self.winner_max_age = winner_max_age
+        self.winner_max_mutations = winner_max_mutations
+        # discount_latter -> (version, time, get_winner() result) of the latest computed winners
+        self._winner_cache = {}
 
     def register_reserved_money_checker(self):
         """Adds the reserved money checker function to the bank.
@@ -73,18 +462,100 @@ class Auction:
 
     def get_reserved_money(self, user):
         """Returns the amount of money the user has reserved in this auction."""
-        return sum(self.get_bids_for_user(user).values())
+        return self._user_totals.get(user, 0)
 
     def clear(self):
         """Removes all bids."""
         self._itembids.clear()
+        self._userbids.clear()
+        self._user_totals.clear()
+        self._recent_changes.clear()
+        self._last_change.clear()
+        self._totals.clear()
+        self._ranking.clear()
+        self._ranking_keys.clear()
+        self._snapshot = AuctionSnapshot(self._snapshot.version + 1, _PersistentMap(), self.allocation)
+        # a cached winner of the cleared bids is never served
+        self._winner_cache.clear()
+        for listener in list(self.change_listeners):
+            listener(None, None)
+
+    def _item_changed(self, user, item):
+        """Call when the money that user bid on an item changed.
+        Marks that item as the most recently changed one, or forgets it if it has no bids left,
+        updates its position in the ranking, publishes a new snapshot and notifies the change listeners."""
+        old_key = self._ranking_keys.pop(item, None)
+        if old_key is not None:
+            del self._ranking[bisect_left(self._ranking, old_key)]
+        userbids = self._itembids.get(item)
+        itembids = self._userbids.setdefault(user, {})
+        amount = userbids.get(user) if userbids else None
+        previous_amount = itembids.pop(item, 0)
+        self._user_totals[user] = self._user_totals.get(user, 0) - previous_amount
+        if amount is not None:
+            itembids[item] = amount
+            self._user_totals[user] += amount
+        elif not itembids:
+            del self._userbids[user]
+            del self._user_totals[user]
+        if userbids:
+            total = self._totals.get(item, 0) - previous_amount + (amount or 0)
+            self._last_change[item] = next(self._change_counter)
+            self._totals[item] = total
+            key = (-total, self._last_change[item], item)
+            self._ranking_keys[item] = key
+            insort(self._ranking, key)
+        else:
+            self._last_change.pop(item, None)
+            self._totals.pop(item, None)
+        self._publish(item)
+        for listener in list(self.change_listeners):
+            listener(user, item)
+
+    def _publish(self, item):
+        """Publishes a new snapshot after the bids on an item changed,
+        sharing all other items with the previous one."""
+        previous = self._snapshot
+        userbids = self._itembids.get(item)
+        if userbids:
+            entries = previous._entries.set(item, _ItemEntry(self._last_change[item], self._totals[item],
+                                                             MappingProxyType(userbids.copy())))
+        else:
+            entries = previous._entries.delete(item)
+        self._snapshot = AuctionSnapshot(previous.version + 1, entries, self.allocation)
+
+    @property
+    def allocation(self):
+        """The allocation strategy, see __init__(). Changing it also changes the current snapshot's."""
+        return self._allocation
+
+    @allocation.setter
+    def allocation(self, allocation):
+        self._allocation = allocation
+        previous = self._snapshot
+        self._snapshot = AuctionSnapshot(previous.version, previous._entries, allocation)
+        # cached winners were allocated by the previous strategy
+        self._winner_cache.clear()
+
+    @property
+    def version(self):
+        """Number of changes made to the bids, increases with every change."""
+        return self._snapshot.version
+
+    def get_headroom(self):
+        """Returns by how much the winning item's total bid currently exceeds what it would
+        be charged, which is how much its bidders can lower their bids without visibly lowering it.
+        Returns 0 if there are no bids."""
+        if not self._ranking:
+            return 0
+        total = -self._ranking[0][0]
+        runner_up_total = -self._ranking[1][0] if len(self._ranking) > 1 else 0
+        return max(0, total - runner_up_total - 1)
 
-    def _update_last_change(self, item):
-        """Call when the money bid on an item changed.
-        Moves that item to the end of the change tracker list."""
-        with suppress(ValueError):
-            self._changes_tracker.remove(item)
-        self._changes_tracker.append(item)
+    def snapshot(self):
+        """Returns an immutable AuctionSnapshot of the current bids.
+        This is safe to call and to read from while another thread changes bids."""
+        return self._snapshot
 
     def _handle_bid(self, user, item, amount, replace=False, allow_visible_lowering=True):
         """For that user, bids the given amount on the given item.
@@ -102,69 +573,130 @@ class Auction:
         if replace and previous_bid == amount:
             # no change
             return
+        self._check_limits(user, amount, already_bid)
         needed_money = amount
         if replace:
             needed_money -= previous_bid
-        available_money = self.bank.get_available_money(user)
-        if needed_money > available_money:
-            raise InsufficientMoneyError("Can't affort to bid {}, only {} available."
-                                         .format(needed_money, available_money))
+        if self.money_reserver is not None:
+            self.money_reserver(user, needed_money)
+        else:
+            available_money = self.bank.get_available_money(user)
+            if needed_money > available_money:
+                raise InsufficientMoneyError("Can't affort to bid {}, only {} available."
+                                             .format(needed_money, available_money))
         if replace and amount < previous_bid and not allow_visible_lowering:
             # check if replacement lowers the visible bid
-            winner = self.get_winner()
-            if winner["item"] != item:
+            _, _, leading_item = self._ranking[0]
+            if leading_item != item:
                 # not first place, therefore lowering is never possible
                 raise VisiblyLoweredError
-            headroom = winner["total_bid"] - winner["total_charge"]
             decrease = previous_bid - amount
-            if decrease > headroom:
+            if decrease > self.get_headroom():
                 raise VisiblyLoweredError
-        self._update_last_change(item)
-        if item not in self._itembids:
-            self._itembids[item] = OrderedDict()
-        self._itembids[item][user] = amount
-        self._itembids[item].move_to_end(user)
+        # insertion ordered, a changed bid moves to the end
+        userbids = self._itembids.setdefault(item, {})
+        userbids.pop(user, None)
+        userbids[user] = amount
+        if self.rate_limit is not None:
+            self._recent_changes[user].append(self._clock())
+        self._item_changed(user, item)
+
+    def _check_limits(self, user, amount, already_bid):
+        """Raises a BiddingError if the bid violates any of the configured per-user limits."""
+        if self.max_bid is not None and amount > self.max_bid:
+            raise BidTooHighError("Can't bid more than {} on a single item.".format(self.max_bid))
+        if self.max_items_per_user is not None and not already_bid \
+                and len(self._userbids.get(user, ())) >= self.max_items_per_user:
+            raise TooManyItemsError("Can't bid on more than {} items at the same time."
+                                    .format(self.max_items_per_user))
+        if self.rate_limit is not None:
+            max_changes, seconds = self.rate_limit
+            recent = self._recent_changes.get(user)
+            if recent is None:
+                recent = self._recent_changes[user] = deque(maxlen=max_changes)
+            # the deque only keeps the latest max_changes times,
+            # so the limit is hit if the oldest of those is still within the period
+            if len(recent) == max_changes and self._clock() - recent[0] < seconds:
+                raise RateLimitedError("Can't change bids more than {} times within {} seconds."
+                                       .format(max_changes, seconds))
+
+    def _once(self, op_id, operation, *args, **kwargs):
+        """Calls operation, unless an operation with the same op_id succeeded before.
+        Returns the result of the operation, or of the earlier one if it is a duplicate."""
+        if op_id is None:
+            return operation(*args, **kwargs)
+        now = self._clock()
+        operations = self._operations
+        # all ids are remembered for the same time, so the oldest ones expire first
+        while operations and next(iter(operations.values()))[0] <= now:
+            operations.popitem(last=False)
+        if op_id in operations:
+            self.duplicate_operations += 1
+            return operations[op_id][1]
+        result = operation(*args, **kwargs)
+        # only successful operations are remembered, failed ones may be retried
+        operations[op_id] = (now + self.operation_id_ttl, result)
+        if len(operations) > self.max_operation_ids:
+            operations.popitem(last=False)
+        return result
 
-    def place_bid(self, user, item, amount):
+    def place_bid(self, user, item, amount, op_id=None):
         """For that user, bids the given amount on the given item.
         Throws AlreadyBidError if there already is a bid from that user on that item.
+        If op_id is given and an operation with that id succeeded within the last operation_id_ttl
+        seconds, the bid is not placed again. This applies to all bid operations, making
+        redelivered operations safe to apply. Operation ids are kept when the bids are cleared.
         """
-        self._handle_bid(user, item, amount, replace=False)
+        self._once(op_id, self._handle_bid, user, item, amount, replace=False)
 
-    def replace_bid(self, user, item, amount, allow_visible_lowering=True):
+    def replace_bid(self, user, item, amount, allow_visible_lowering=True, op_id=None):
         """For that user, bids the given amount on the given item, replacing an old bid.
         Throws NoExistingBidError if there was no bid from that user on that item to replace.
+        See place_bid() for op_id.
         """
-        self._handle_bid(user, item, amount, replace=True, allow_visible_lowering=allow_visible_lowering)
+        self._once(op_id, self._handle_bid, user, item, amount, replace=True,
+                   allow_visible_lowering=allow_visible_lowering)
 
-    def increase_bid(self, user, item, amount):
+    def increase_bid(self, user, item, amount, op_id=None):
         """Does the same as replace_bid, but instead adds the new amount onto the old one.
+        See place_bid() for op_id.
         """
+        self._once(op_id, self._increase_bid, user, item, amount)
+
+    def _increase_bid(self, user, item, amount):
         # Checking for existence is done by replace_bid()
         previous_bid = self._itembids.get(item, {}).get(user, 0)
         self.replace_bid(user, item, amount+previous_bid)
 
-    def remove_bid(self, user, item):
+    def remove_bid(self, user, item, op_id=None):
         """For that user, removes his bid on that item.
-        Returns True if a bid was removed, or False if there was no bid."""
+        Returns True if a bid was removed, or False if there was no bid.
+        See place_bid() for op_id, duplicates return the result of the first operation."""
+        return self._once(op_id, self._remove_bid, user, item)
+
+    def _remove_bid(self, user, item):
         if item not in self._itembids or user not in self._itembids[item]:
             return False
         del self._itembids[item][user]
         # remove if now empty
-        if self._itembids[item]: 
-            self._update_last_change(item)
-        else:
+        if not self._itembids[item]:
             del self._itembids[item]
-            self._changes_tracker.remove(item)
+        self._item_changed(user, item)
         return True
 
+    def renew_bid(self, user, item):
+        """For that user, moves his bid on that item behind the item's other bids and makes the item
+        the most recently changed one, like replacing it with a different amount would, but keeps
+        the amount. No money is checked, because none is needed. Raises NoExistingBidError if there is no bid."""
+        userbids = self._itembids.get(item)
+        if not userbids or user not in userbids:
+            raise NoExistingBidError("There is no bid from that user on that item which could be renewed.")
+        userbids[user] = userbids.pop(user)
+        self._item_changed(user, item)
+
     def get_bids_for_user(self, user):
         """Returns a dict(item:amount) of that user's bids."""
-        bids = {}
-        for item, userbids in self._itembids.items():
-            with suppress(KeyError):
-                bids[item] = userbids[user]
-        return bids
+        return dict(self._userbids.get(user, {}))
 
     def get_bids_for_item(self, item):
         """Returns a dict(user:amount) of bids on that item."""
@@ -177,16 +709,21 @@ class Auction:
     def get_all_bids_ordered(self):
         """Returns all bids as [tuple(item, dict(user:amount))...], ordered by
         ranking (first=winner)"""
-        # get items sorted by total money first, and then by least recently updated
-        # (~= first bid wins if tied)
-        def by_amount_and_last_update(dictitem):
-            item, bids = dictitem
-            # smaller = first, therefore sum is negated.
-            # but index of recent updates is not, because smaller = ealier, as desired
-            return -sum(bids.values()), self._changes_tracker.index(item)
-        return sorted(self._itembids.items(), key=by_amount_and_last_update)
+        return list(self.iter_bids_ordered())
 
-    def get_winner(self, discount_latter=False):
+    def iter_bids_ordered(self, offset=0, limit=None):
+        """Yields bids as tuple(item, dict(user:amount)) ordered by ranking (first=winner),
+        starting at the item ranked offset (0=winner), and stopping after limit items if given.
+        e.g. page p (starting at 0) of a leaderboard with s items per page is
+        iter_bids_ordered(offset=p*s, limit=s).
+        Items are taken from the maintained ranking, which is sorted by total money first,
+        and then by least recently updated (~= first bid wins if tied), so nothing gets sorted.
+        The bids must not be changed while iterating, iterate a snapshot() for that."""
+        stop = None if limit is None else offset + limit
+        for _, _, item in self._ranking[offset:stop]:
+            yield item, self._itembids[item]
+
+    def get_winner(self, discount_latter=False, fresh=False):
         """Calculated the item currently winning.
         Returns None if no bids, or a dict structured like this:
         {
@@ -195,47 +732,71 @@ class Auction:
             "total_charge": actual sum of money that would currently be paid.
                 This can be less than total_bid if there is a gap to the 2nd highest bid.
             "money_owed": dict(user:money) containing the amount of money to pay
-                allotted between all bidders. It's sum is total_charge
-        }"""
-        bids = self.get_all_bids_ordered()
-        if not bids:
-            # no bids
-            return None
-        # extract the winner, save the rest
-        (winning_item, winning_bids), *rest = bids
-        # determine the second highest bet amount
-        second_bid = 0
-        if rest:
-            _, second_item_bids = rest[0]
-            second_bid = sum(second_item_bids.values())
-        # determine what will actually be paid.
-        # e.g. if the 2nd highest bid was 5, only pay 6
-        total_bid = sum(winning_bids.values())
-        overpaid = max(0, total_bid-second_bid-1)
-        total_charge = total_bid - overpaid
-        # allot the actual price between the bidders
-        # Step 1: calculate the paid price based on the percentage of the full price, ceiled!
-        money_owed = OrderedDict()
-        for user, amount in sorted(winning_bids.items(), key=itemgetter(1), reverse=True):
-            percentage = amount / total_bid
-            money_owed[user] = ceil(total_charge * percentage)
-        # Note the above iteration order: highest bidders first, then ordered of winning_bids,
-        # which is a OrderedDict too, and therefore insertion order.
-        # This ensures earlier bids are visited first, and favored for following price discounts:
-        # Step 2: because of ceiling the prices, the sum might be too high.
-        # => calculate how much was overpaid, and discount the higher, and if tied the earlier bidders
-        overpaid = sum(money_owed.values()) - total_charge
-        # if discount_latter is True, actually discounts the later bidders, the oppisite as described above
-        if discount_latter:
-            user_iter = iter(reversed(money_owed))
-        else:
-            user_iter = iter(money_owed)
-        for _ in range(overpaid):
-            money_owed[next(user_iter)] -= 1
-        # return all results as dict
-        return {
-            "item": winning_item,
-            "total_bid": total_bid,
-            "total_charge": total_charge,
-            "money_owed": money_owed,
+                allotted between all bidders by the allocation strategy. It's sum is total_charge
+        }
+        If winner_max_age or winner_max_mutations is set, the result may be a cached one
+        within those limits, e.g. for overlays polling during many bid changes, and has the keys:
+        {
+            "version": the auction's version the result was computed at
+            "staleness": how many bid changes the result is behind the current version
+            "age": seconds since the result was computed
         }
+        Pass fresh=True to always compute the current result, e.g. for settling the auction."""
+        if self.winner_max_age is None and self.winner_max_mutations is None:
+            return _winner_from_ordered(list(self.iter_bids_ordered(limit=2)), discount_latter, self.allocation)
+        # computed from one snapshot, so the cached result always matches the version it is cached for
+        snapshot = self._snapshot
+        version = snapshot.version
+        now = self._clock()
+        cached = self._winner_cache.get(discount_latter)
+        if cached is not None and not fresh:
+            cached_version, computed_at, winner = cached
+            mutations = version - cached_version
+            age = now - computed_at
+            if mutations == 0 or not ((self.winner_max_age is not None and age >= self.winner_max_age) or
+                                      (self.winner_max_mutations is not None
+                                       and mutations >= self.winner_max_mutations)):
+                return self._mark_winner(winner, cached_version, age)
+        winner = snapshot.get_winner(discount_latter)
+        self._winner_cache[discount_latter] = (version, now, winner)
+        return self._mark_winner(winner, version, 0)
+
+    def _mark_winner(self, winner, version, age):
+        """Returns a copy of a cached winner with the staleness keys, see get_winner()"""
+        if winner is None:
+            return None
+        return dict(winner, version=version, staleness=self.version - version, age=age)
+
+    def get_winners(self, count, discount_latter=False):
+        """Calculates the top count items currently winning, for events awarding multiple items.
+        Returns a list of up to count dicts structured like the get_winner() result, ordered by ranking.
+        Each winner is charged like the single winner of get_winner(), but relative to the total bid
+        on the item ranked right after it, e.g. with totals of 10, 7 and 3 for the top two,
+        the first item pays 8 and the second one pays 4.
+        Only the top count+1 items of the maintained ranking are looked at, and the auction isn't changed.
+        Raises a ValueError if count is negative."""
+        if count < 0:
+            raise ValueError("count must not be negative.")
+        return _winners_from_ordered(list(self.iter_bids_ordered(limit=count + 1)), count,
+                                     discount_latter, self.allocation)
+
+    def amount_to_lead(self, item):
+        """Returns how much more money in total has to be bid on an item for it to take the lead,
+        0 if it is winning already. An item tied with the winner still needs 1 more,
+        because of the least recently updated item winning ties."""
+        if not self._ranking:
+            return 1
+        leader_total, _, leader = self._ranking[0]
+        if leader == item:
+            return 0
+        return -leader_total - self._totals.get(item, 0) + 1
+
+    def what_if(self, user, item, amount, discount_latter=False):
+        """Calculates what get_winner() would return if that user's bid on that item was amount,
+        e.g. to tell the user what they would pay, without changing any bids or checking the bank.
+        An amount of 0 means the bid was removed. Only the top three items are looked at.
+        Use bidcat.whatif.what_ifs() for large batches of hypothetical bids."""
+        if amount < 0:
+            raise ValueError("amount must not be negative.")
+        return _what_if(self._ranking[:3], self._itembids, self._totals, user, item, amount,
+                        discount_latter, self.allocation)
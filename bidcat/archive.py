@@ -0,0 +1,164 @@
+"""Archive of settled auction results.
+
+Keeping the results of all finished auctions in memory for "last match" style commands doesn't scale.
+An AuctionArchive stores them on disk instead, in a SQLite database holding every auction's result
+as a zlib-compressed columnar record, plus an index of the users that took part in each auction.
+Looking up an auction by its ID or the latest auctions of a user uses the database's indexes.
+Only the most recently used results are kept in memory.
+
+Auction IDs, users and items must be strings or integers.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+def _encode(winner, bids):
+    """Packs a winner and bids into a compressed columnar record."""
+    items, bid_counts, users, amounts = [], [], [], []
+    for item, itembids in bids.items():
+        items.append(item)
+        bid_counts.append(len(itembids))
+        users.extend(itembids.keys())
+        amounts.extend(itembids.values())
+    record = {
+        "items": items,
+        "bid_counts": bid_counts,
+        "users": users,
+        "amounts": amounts,
+    }
+    if winner is not None:
+        record["winner"] = [winner["item"], winner["total_bid"], winner["total_charge"],
+                            list(winner["money_owed"].keys()), list(winner["money_owed"].values())]
+    return zlib.compress(json.dumps(record, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode(data):
+    """Unpacks a compressed columnar record into a tuple (winner, bids)."""
+    record = json.loads(zlib.decompress(data).decode("utf-8"))
+    bids = {}
+    users = iter(zip(record["users"], record["amounts"]))
+    for item, bid_count in zip(record["items"], record["bid_counts"]):
+        bids[item] = dict(next(users) for _ in range(bid_count))
+    winner = None
+    if "winner" in record:
+        item, total_bid, total_charge, owing_users, owed = record["winner"]
+        winner = {
+            "item": item,
+            "total_bid": total_bid,
+            "total_charge": total_charge,
+            "money_owed": OrderedDict(zip(owing_users, owed)),
+        }
+    return winner, bids
+
+
+class AuctionArchive:
+    """Stores settled auction results on disk, keeping only the most recently used ones in memory."""
+    def __init__(self, path, cache_size=128):
+        """Arguments:
+            path: path of the database file, created if it doesn't exist.
+            cache_size: how many results to keep in memory at most."""
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS auctions "
+                                "(seq INTEGER PRIMARY KEY, auction_id UNIQUE NOT NULL, "
+                                "settled_at REAL NOT NULL, data BLOB NOT NULL)")
+        # one row per user taking part in an auction, newest first per user via the primary key
+        self.connection.execute("CREATE TABLE IF NOT EXISTS participants "
+                                "(user_id NOT NULL, seq INTEGER NOT NULL, bid INTEGER NOT NULL, "
+                                "paid INTEGER NOT NULL, PRIMARY KEY (user_id, seq)) WITHOUT ROWID")
+
+    def store(self, auction_id, winner, bids, settled_at=None):
+        """Archives the result of a settled auction.
+
+        Arguments:
+            auction_id: unique ID of the auction.
+            winner: the auction's get_winner() result, may be None.
+            bids: the auction's get_all_bids() result.
+            settled_at: time the auction was settled at in seconds since the epoch, defaults to now."""
+        if settled_at is None:
+            settled_at = time.time()
+        # keep plain copies, so cached results look just like ones read back from disk
+        bids = {item: dict(itembids) for item, itembids in bids.items()}
+        money_owed = winner["money_owed"] if winner is not None else {}
+        user_bids = {}
+        for itembids in bids.values():
+            for user, amount in itembids.items():
+                user_bids[user] = user_bids.get(user, 0) + amount
+        with self._lock:
+            with self.connection:
+                self.connection.execute("BEGIN")
+                seq = self.connection.execute(
+                    "INSERT INTO auctions (auction_id, settled_at, data) VALUES (?, ?, ?)",
+                    (auction_id, settled_at, _encode(winner, bids))).lastrowid
+                self.connection.executemany(
+                    "INSERT INTO participants (user_id, seq, bid, paid) VALUES (?, ?, ?, ?)",
+                    [(user, seq, bid, money_owed.get(user, 0)) for user, bid in user_bids.items()])
+            self._remember(auction_id, {
+                "auction_id": auction_id,
+                "settled_at": settled_at,
+                "winner": winner,
+                "bids": bids,
+            })
+
+    def get(self, auction_id):
+        """Returns the archived result of an auction as a dict with the keys
+        "auction_id", "settled_at", "winner" and "bids", or None if it isn't archived.
+        The returned dict must not be modified."""
+        with self._lock:
+            result = self._cache.get(auction_id)
+            if result is not None:
+                self._cache.move_to_end(auction_id)
+                return result
+            row = self.connection.execute("SELECT settled_at, data FROM auctions WHERE auction_id = ?",
+                                          (auction_id,)).fetchone()
+            if row is None:
+                return None
+            settled_at, data = row
+            winner, bids = _decode(data)
+            result = {
+                "auction_id": auction_id,
+                "settled_at": settled_at,
+                "winner": winner,
+                "bids": bids,
+            }
+            self._remember(auction_id, result)
+            return result
+
+    def get_user_history(self, user, limit=50):
+        """Returns what a user bid and paid in the latest auctions they took part in,
+        as a list of dicts with the keys "auction_id", "settled_at", "bid" (total of the user's bids)
+        and "paid", newest first."""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT auctions.auction_id, auctions.settled_at, participants.bid, participants.paid "
+                "FROM participants JOIN auctions ON auctions.seq = participants.seq "
+                "WHERE participants.user_id = ? ORDER BY participants.seq DESC LIMIT ?",
+                (user, limit)).fetchall()
+        return [{"auction_id": auction_id, "settled_at": settled_at, "bid": bid, "paid": paid}
+                for auction_id, settled_at, bid, paid in rows]
+
+    def get_latest(self, limit=1):
+        """Returns the results of the latest archived auctions, newest first."""
+        with self._lock:
+            rows = self.connection.execute("SELECT auction_id FROM auctions ORDER BY seq DESC LIMIT ?",
+                                           (limit,)).fetchall()
+        return [self.get(auction_id) for auction_id, in rows]
+
+    def close(self):
+        """Closes the database."""
+        with self._lock:
+            self.connection.close()
+
+    def _remember(self, auction_id, result):
+        self._cache[auction_id] = result
+        self._cache.move_to_end(auction_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
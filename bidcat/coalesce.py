@@ -0,0 +1,255 @@
+"""Coalescing of bursts of bid operations in front of an Auction.
+
+During hype moments single users send many bid commands per second, and each one
+checks the user's money at the bank and reorders the auction's ranking.
+A BidCoalescer queues operations instead and applies them in batches: all consecutive
+operations of a user on the same item are merged and only their net result is applied
+to the auction, with a single money check.
+
+The outcome of every submitted operation, including any BiddingError or ValueError
+it would have raised if applied on its own, is reported through the CoalescedOperation
+returned on submission.
+Auctions with per-user limits (max_bid, max_items_per_user or rate_limit) get every
+operation applied on its own, because merged operations would be checked against those limits differently.
+Operations changing a bid and then changing it back are applied on their own too, because the item
+counts as recently changed for breaking ties.
+"""
+
+import time
+from collections import OrderedDict
+
+from . import AlreadyBidError, InsufficientMoneyError, NoExistingBidError
+
+
+class CoalescedOperation:
+    """Handle for a bid operation submitted to a BidCoalescer.
+    Its outcome is known once done is True, which happens when the coalescer flushed it."""
+    __slots__ = ("method", "user", "item", "amount", "done", "_result", "_exception")
+
+    def __init__(self, method, user, item, amount):
+        self.method = method
+        self.user = user
+        self.item = item
+        self.amount = amount
+        self.done = False
+        self._result = None
+        self._exception = None
+
+    def _set_result(self, result):
+        self.done = True
+        self._result = result
+
+    def _set_exception(self, exception):
+        self.done = True
+        self._exception = exception
+
+    def exception(self):
+        """Returns the exception the operation failed with, or None if it succeeded."""
+        self._ensure_done()
+        return self._exception
+
+    def result(self):
+        """Returns what the auction method would have returned,
+        or raises the exception the operation failed with."""
+        self._ensure_done()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def _ensure_done(self):
+        if not self.done:
+            raise RuntimeError("operation was not applied yet, flush the coalescer first.")
+
+
+class BidCoalescer:
+    """Queues bid operations and applies the net result of each user's consecutive
+    operations on the same item to an auction.
+
+    Operations of a user are applied in the order they were submitted,
+    operations of different users may be reordered relative to each other.
+    Pending operations are flushed when the oldest one is older than window seconds,
+    when max_depth operations are pending, or when flush() is called.
+    Like the auction itself, a coalescer must be used from one thread at a time.
+    """
+    def __init__(self, auction, window=0.1, max_depth=1000, clock=time.monotonic):
+        """Arguments:
+            auction: the auction the operations are applied to.
+            window: how many seconds operations may be held back at most.
+            max_depth: how many operations may be pending before they are flushed.
+            clock: function returning the current time in seconds."""
+        self.auction = auction
+        self.window = window
+        self.max_depth = max_depth
+        self._clock = clock
+        # user -> list of [item, [operations...]], in order of submission
+        self._pending = OrderedDict()
+        self._pending_count = 0
+        self._oldest = None
+        # number of operations submitted, and of operations actually applied to the auction
+        self.submitted = 0
+        self.applied = 0
+
+    @property
+    def coalescing_ratio(self):
+        """How many submitted operations were handled per operation applied to the auction."""
+        if not self.applied:
+            return 1.0
+        return self.submitted / self.applied
+
+    def get_stats(self):
+        """Returns a dict with the submitted, applied and pending operation counts
+        and the coalescing ratio."""
+        return {
+            "submitted": self.submitted,
+            "applied": self.applied,
+            "pending": self._pending_count,
+            "coalescing_ratio": self.coalescing_ratio,
+        }
+
+    def place_bid(self, user, item, amount):
+        """Queues Auction.place_bid(). Returns a CoalescedOperation."""
+        return self._submit("place_bid", user, item, amount)
+
+    def replace_bid(self, user, item, amount, allow_visible_lowering=True):
+        """Queues Auction.replace_bid(). Returns a CoalescedOperation.
+        Replacements not allowing visible lowering are never merged with other operations,
+        because they depend on the other items' bids at the time they are applied."""
+        if not allow_visible_lowering:
+            return self._submit("replace_bid_not_lowering", user, item, amount)
+        return self._submit("replace_bid", user, item, amount)
+
+    def increase_bid(self, user, item, amount):
+        """Queues Auction.increase_bid(). Returns a CoalescedOperation."""
+        return self._submit("increase_bid", user, item, amount)
+
+    def remove_bid(self, user, item):
+        """Queues Auction.remove_bid(). Returns a CoalescedOperation."""
+        return self._submit("remove_bid", user, item, None)
+
+    def poll(self):
+        """Flushes if the oldest pending operation has been waiting for longer than the window.
+        Call this regularly if operations may stop coming in."""
+        if self._oldest is not None and self._clock() - self._oldest >= self.window:
+            self.flush()
+
+    def flush(self):
+        """Applies all pending operations to the auction."""
+        pending = self._pending
+        self._pending = OrderedDict()
+        self._pending_count = 0
+        self._oldest = None
+        for user, groups in pending.items():
+            for item, operations in groups:
+                self._apply(user, item, operations)
+
+    def _submit(self, method, user, item, amount):
+        operation = CoalescedOperation(method, user, item, amount)
+        self.submitted += 1
+        groups = self._pending.setdefault(user, [])
+        # only merge with the user's latest operations to keep the user's order intact
+        if groups and groups[-1][0] == item and method != "replace_bid_not_lowering" \
+                and groups[-1][1][-1].method != "replace_bid_not_lowering":
+            groups[-1][1].append(operation)
+        else:
+            groups.append([item, [operation]])
+        self._pending_count += 1
+        if self._oldest is None:
+            self._oldest = self._clock()
+        if self._pending_count >= self.max_depth:
+            self.flush()
+        else:
+            self.poll()
+        return operation
+
+    def _has_limits(self):
+        auction = self.auction
+        return auction.max_bid is not None or auction.max_items_per_user is not None \
+            or auction.rate_limit is not None
+
+    def _apply(self, user, item, operations):
+        """Applies a group of operations of one user on one item."""
+        if len(operations) == 1 or self._has_limits():
+            # the simulation below only knows about the user's money
+            for operation in operations:
+                self._apply_single(operation)
+            return
+        start = self.auction.get_bids_for_item(item).get(user)
+        available = self.auction.bank.get_available_money(user)
+        # simulate the operations like the auction would process them,
+        # without touching the auction or the bank again
+        current = start
+        changed = False
+        results = []
+        for operation in operations:
+            result = None
+            try:
+                if operation.method == "remove_bid":
+                    result = current is not None
+                    changed = changed or result
+                    current = None
+                else:
+                    amount = operation.amount
+                    if operation.method == "increase_bid":
+                        amount += current or 0
+                    if amount < 1:
+                        raise ValueError("amount must be a number above 0.")
+                    if operation.method == "place_bid" and current is not None:
+                        raise AlreadyBidError("There already is a bid from that user on that item.")
+                    if operation.method != "place_bid" and current is None:
+                        raise NoExistingBidError("There is no bid from that user on that item which could be replaced.")
+                    needed_money = amount - (current or 0)
+                    # money reserved by this group so far is not available anymore
+                    available_money = available - ((current or 0) - (start or 0))
+                    if needed_money > available_money:
+                        raise InsufficientMoneyError("Can't affort to bid {}, only {} available."
+                                                     .format(needed_money, available_money))
+                    changed = changed or amount != current
+                    current = amount
+            except (ValueError, AlreadyBidError, NoExistingBidError, InsufficientMoneyError) as e:
+                results.append((None, e))
+            else:
+                results.append((result, None))
+        if current == start and changed:
+            # applied one by one, the item would count as recently changed for breaking ties
+            for operation in operations:
+                self._apply_single(operation)
+            return
+        try:
+            if current == start:
+                pass
+            elif current is None:
+                self.auction.remove_bid(user, item)
+                self.applied += 1
+            elif start is None:
+                self.auction.place_bid(user, item, current)
+                self.applied += 1
+            else:
+                self.auction.replace_bid(user, item, current)
+                self.applied += 1
+        except Exception:
+            # the auction disagrees with the simulation, e.g. because the user's money changed.
+            # the auction is left unchanged on errors, so apply one by one to report exact errors.
+            for operation in operations:
+                self._apply_single(operation)
+            return
+        for operation, (result, exception) in zip(operations, results):
+            if exception is not None:
+                operation._set_exception(exception)
+            else:
+                operation._set_result(result)
+
+    def _apply_single(self, operation):
+        self.applied += 1
+        try:
+            if operation.method == "remove_bid":
+                result = self.auction.remove_bid(operation.user, operation.item)
+            elif operation.method == "replace_bid_not_lowering":
+                result = self.auction.replace_bid(operation.user, operation.item, operation.amount,
+                                                  allow_visible_lowering=False)
+            else:
+                method = getattr(self.auction, operation.method)
+                result = method(operation.user, operation.item, operation.amount)
+        except Exception as e:
+            operation._set_exception(e)
+        else:
+            operation._set_result(result)
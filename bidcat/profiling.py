@@ -0,0 +1,150 @@
+"""Opt-in profiling of auctions and banks.
+
+A Profiler attached to Auction and bank objects records a span for every call of their
+public operations and of the internal steps they consist of, like ranking, publishing snapshots,
+allocating money or querying the bank's storage. Nested calls are recorded as nested spans.
+Spans are kept in a bounded buffer and can be written as a Chrome trace (open in chrome://tracing
+or https://ui.perfetto.dev) or as collapsed stacks for flame graph tools.
+
+Profiling is off unless a profiler is attached, which then wraps the methods of those objects only.
+Detaching restores the original methods, so there is no overhead at all when not profiling.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple, defaultdict
+
+# stack is a tuple of the names of all enclosing spans, ending with this span's name
+Span = namedtuple("Span", ["stack", "thread", "start", "duration", "self_duration"])
+
+# the auction's get_reserved_money is left out, because the bank identifies the registered
+# reserved money checker by it. It is recorded as part of the bank's get_reserved_money.
+AUCTION_METHODS = (
+    "place_bid", "replace_bid", "increase_bid", "remove_bid", "clear",
+    "get_winner", "get_all_bids_ordered", "get_bids_for_user", "get_headroom",
+    "_handle_bid", "_check_limits", "_item_changed", "_publish", "allocation",
+)
+
+BANK_METHODS = (
+    "get_available_money", "get_total_money", "get_reserved_money", "make_transaction",
+    "_get_stored_money_value", "_change_stored_money_value", "_record_transaction",
+)
+
+
+class Profiler:
+    """Records spans of the operations of the objects it is attached to."""
+    def __init__(self, max_spans=100000, sample_every=1, clock=time.perf_counter_ns):
+        """Arguments:
+            max_spans: maximum number of spans kept, older spans are dropped first.
+            sample_every: only record every n-th outermost operation with all its nested spans.
+            clock: function returning the current time in nanoseconds."""
+        self.spans = deque(maxlen=max_spans)
+        self.sample_every = sample_every
+        self._clock = clock
+        self._local = threading.local()
+        self._operations = 0
+        # (object, attribute name, original value to set back, or None to delete the wrapper)
+        self._attached = []
+
+    def attach(self, obj, methods=None):
+        """Starts recording calls of the given methods of obj, which default to the public
+        and internal operations of auctions and banks, whatever obj has of those."""
+        if methods is None:
+            methods = AUCTION_METHODS + BANK_METHODS
+        prefix = type(obj).__name__ + "."
+        for name in methods:
+            function = getattr(obj, name, None)
+            if not callable(function):
+                continue
+            # instance attributes and properties like Auction.allocation are set back,
+            # wrappers of methods are deleted to uncover them again
+            restore = name in obj.__dict__ or isinstance(getattr(type(obj), name, None), property)
+            self._attached.append((obj, name, function if restore else None))
+            setattr(obj, name, self._wrap(prefix + name, function))
+
+    def detach(self):
+        """Stops recording and restores all wrapped methods."""
+        for obj, name, original in reversed(self._attached):
+            if original is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+        self._attached = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.detach()
+
+    def clear(self):
+        """Drops all recorded spans."""
+        self.spans.clear()
+
+    def _wrap(self, name, function):
+        local = self._local
+        clock = self._clock
+        spans = self.spans
+
+        def wrapper(*args, **kwargs):
+            stack = getattr(local, "stack", None)
+            if stack is None:
+                stack = local.stack = []
+                local.skipped = 0
+            if not stack and not local.skipped:
+                self._operations += 1
+                local.sampled = self._operations % self.sample_every == 0
+            if not local.sampled:
+                # nested calls of operations not sampled aren't sampled either
+                local.skipped += 1
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    local.skipped -= 1
+            # frame: [name, nanoseconds spent in nested spans]
+            frame = [name, 0]
+            stack.append(frame)
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                duration = clock() - start
+                stack.pop()
+                if stack:
+                    stack[-1][1] += duration
+                names = tuple(f[0] for f in stack) + (name,)
+                spans.append(Span(names, threading.get_ident(), start, duration, duration - frame[1]))
+        wrapper.__wrapped__ = function
+        return wrapper
+
+    def write_chrome_trace(self, path):
+        """Writes all recorded spans as a Chrome trace event file."""
+        pid = os.getpid()
+        events = [{
+            "name": span.stack[-1],
+            "cat": span.stack[-1].split(".")[0],
+            "ph": "X",
+            "ts": span.start / 1000,
+            "dur": span.duration / 1000,
+            "pid": pid,
+            "tid": span.thread,
+        } for span in self.spans]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def get_collapsed(self):
+        """Returns a dict mapping semicolon-joined stacks to the microseconds spent in them,
+        not counting nested spans."""
+        totals = defaultdict(int)
+        for span in self.spans:
+            totals[";".join(span.stack)] += span.self_duration
+        return {stack: nanoseconds // 1000 for stack, nanoseconds in totals.items()}
+
+    def write_collapsed(self, path):
+        """Writes all recorded spans in the collapsed stack format of flamegraph.pl and speedscope,
+        one line per stack with the microseconds spent in it."""
+        with open(path, "w") as f:
+            for stack, microseconds in sorted(self.get_collapsed().items()):
+                f.write("%s %d\n" % (stack, microseconds))
@@ -0,0 +1,205 @@
+"""Recording and replaying of bid operation streams.
+
+A BidRecorder wraps an auction and writes every bid operation passed through it to a compact
+log file: one JSON array per line, gzip-compressed if the file name ends in ".gz".
+replay() runs such a log against any auction and bank, either at the recorded speed or as fast
+as possible, and reports throughput, operation latencies and whether the final winner matches
+the one recorded. This allows regression checks with production-shaped workloads offline.
+
+Users and items must be JSON-serializable scalars (strings or numbers) to be recorded.
+
+Log lines are [seconds since start, operation, user, item, amount], with the operations
+"p" (place_bid), "r" (replace_bid), "R" (replace_bid disallowing visible lowering),
+"i" (increase_bid) and "x" (remove_bid, without amount).
+The last line is ["winner", winner] with the winner as returned by get_winner()
+when the recorder was closed, money_owed being a list of [user, money] pairs.
+"""
+
+import gzip
+import json
+import time
+from math import ceil
+
+_METHODS = {
+    "p": "place_bid",
+    "r": "replace_bid",
+    "i": "increase_bid",
+    "x": "remove_bid",
+}
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _encode_winner(winner):
+    if winner is None:
+        return None
+    # without the staleness keys of auctions caching their winner, which depend on when it was computed
+    return {
+        "item": winner["item"],
+        "total_bid": winner["total_bid"],
+        "total_charge": winner["total_charge"],
+        "money_owed": [[user, money] for user, money in winner["money_owed"].items()],
+    }
+
+
+class BidRecorder:
+    """Passes bid operations on to an auction and records them to a log file.
+    Failed operations are recorded too, and raise just like on the auction."""
+    def __init__(self, auction, path, clock=time.monotonic):
+        """Arguments:
+            auction: the auction operations are passed on to.
+            path: file to write the log to, gzip-compressed if it ends in ".gz".
+            clock: function returning the current time in seconds."""
+        self.auction = auction
+        self._clock = clock
+        self._start = clock()
+        self._file = _open(path, "w")
+
+    def _record(self, *operation):
+        line = [round(self._clock() - self._start, 6)]
+        line.extend(operation)
+        self._file.write(json.dumps(line, separators=(",", ":")))
+        self._file.write("\n")
+
+    def place_bid(self, user, item, amount):
+        self._record("p", user, item, amount)
+        return self.auction.place_bid(user, item, amount)
+
+    def replace_bid(self, user, item, amount, allow_visible_lowering=True):
+        self._record("r" if allow_visible_lowering else "R", user, item, amount)
+        return self.auction.replace_bid(user, item, amount, allow_visible_lowering=allow_visible_lowering)
+
+    def increase_bid(self, user, item, amount):
+        self._record("i", user, item, amount)
+        return self.auction.increase_bid(user, item, amount)
+
+    def remove_bid(self, user, item):
+        self._record("x", user, item)
+        return self.auction.remove_bid(user, item)
+
+    def close(self):
+        """Records the auction's current winner and closes the log file."""
+        self._file.write(json.dumps(["winner", _encode_winner(self.auction.get_winner(fresh=True))],
+                                    separators=(",", ":")))
+        self._file.write("\n")
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load(path):
+    """Reads a bid log. Returns a tuple (operations, winner),
+    operations being a list of the log's operation lines and winner the recorded winner,
+    or None if the log has no winner line."""
+    operations = []
+    winner = None
+    with _open(path, "r") as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry[0] == "winner":
+                winner = entry[1]
+            else:
+                operations.append(entry)
+    return operations, winner
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = max(0, ceil(len(sorted_values) * percent / 100) - 1)
+    return sorted_values[index]
+
+
+def replay(path, auction, speed=None, clock=time.perf_counter, sleep=time.sleep):
+    """Replays a bid log against an auction.
+
+    Arguments:
+        path: the log file to replay.
+        auction: the auction to replay the operations on, with a bank that knows all recorded users.
+        speed: None to replay as fast as possible, or a factor of the recorded speed,
+            e.g. 1 for the recorded speed or 2 for twice as fast.
+        clock: function returning the current time in seconds, used for measuring.
+        sleep: function sleeping for the given seconds, used for waiting when replaying at speed.
+    Returns a dict structured like this:
+    {
+        "operations": number of operations replayed
+        "errors": number of operations that raised an exception
+        "duration": seconds the replay took
+        "throughput": operations per second
+        "latency": dict with the "p50", "p90", "p99" and "max" latencies of an operation in seconds
+        "winner": get_winner() result of the auction after the replay, in the log's format
+        "expected_winner": the winner recorded in the log
+        "matches": whether winner and expected_winner are equal
+    }"""
+    operations, expected_winner = load(path)
+    latencies = []
+    errors = 0
+    start = clock()
+    for offset, op, user, item, *amount in operations:
+        if speed is not None:
+            delay = offset / speed - (clock() - start)
+            if delay > 0:
+                sleep(delay)
+        if op == "R":
+            method, kwargs = auction.replace_bid, {"allow_visible_lowering": False}
+        else:
+            method, kwargs = getattr(auction, _METHODS[op]), {}
+        operation_start = clock()
+        try:
+            method(user, item, *amount, **kwargs)
+        except Exception:
+            errors += 1
+        latencies.append(clock() - operation_start)
+    duration = clock() - start
+    latencies.sort()
+    # compare in the log's format, because JSON turned tuples into lists and such
+    winner = json.loads(json.dumps(_encode_winner(auction.get_winner(fresh=True))))
+    return {
+        "operations": len(operations),
+        "errors": errors,
+        "duration": duration,
+        "throughput": len(operations) / duration if duration > 0 else float("inf"),
+        "latency": {
+            "p50": _percentile(latencies, 50),
+            "p90": _percentile(latencies, 90),
+            "p99": _percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0,
+        },
+        "winner": winner,
+        "expected_winner": expected_winner,
+        "matches": winner == expected_winner,
+    }
+
+
+def main():
+    import argparse
+    from banksys import DummyBank
+    from . import Auction
+    parser = argparse.ArgumentParser(description="Replays a recorded bid log against a fresh auction.")
+    parser.add_argument("log", help="bid log to replay")
+    parser.add_argument("--speed", type=float, default=None,
+                        help="factor of the recorded speed to replay at, default is as fast as possible")
+    parser.add_argument("--starting-amount", type=int, default=50000,
+                        help="money every user starts with in the dummy bank")
+    args = parser.parse_args()
+    bank = DummyBank()
+    bank._starting_amount = args.starting_amount
+    auction = Auction(bank=bank)
+    report = replay(args.log, auction, speed=args.speed)
+    print("%(operations)d operations (%(errors)d failed) in %(duration).3fs, %(throughput).0f ops/s" % report)
+    print("latency p50 %(p50).6fs, p90 %(p90).6fs, p99 %(p99).6fs, max %(max).6fs" % report["latency"])
+    print("winner matches" if report["matches"] else "winner MISMATCH: %r != %r"
+          % (report["winner"], report["expected_winner"]))
+    return 0 if report["matches"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,213 @@
+"""Opening and closing of many auctions at fixed times.
+
+An AuctionScheduler keeps the open and close times of all its auctions in a single heap,
+so a single timer serves any number of auctions. Bids placed shortly before an auction
+closes can extend its closing time ("anti-snipe"), which the scheduler notices through
+the auction's change listeners instead of polling.
+
+When an auction closes, its settlement callback is called with the auction and its
+get_winner() result. Charging the winners and clearing or deregistering the auction
+is left to that callback.
+"""
+
+import heapq
+import logging
+import threading
+import time
+from itertools import count
+
+
+class _Schedule:
+    """Opening and closing times and callbacks of one scheduled auction."""
+    __slots__ = ("auction", "open_at", "close_at", "on_open", "on_close",
+                 "extension", "extension_window", "max_close_at", "opened", "closed", "listener")
+
+    def __init__(self, auction, open_at, close_at, on_open, on_close,
+                 extension, extension_window, max_close_at):
+        self.auction = auction
+        self.open_at = open_at
+        self.close_at = close_at
+        self.on_open = on_open
+        self.on_close = on_close
+        self.extension = extension
+        self.extension_window = extension_window
+        self.max_close_at = max_close_at
+        self.opened = False
+        self.closed = False
+        self.listener = None
+
+
+class AuctionScheduler:
+    """Opens and closes many auctions at their scheduled times using a single heap-based timer.
+
+    Either call run_pending() regularly, e.g. from an existing event loop using time_until_next(),
+    or call run() on a dedicated thread to have the callbacks fired on time.
+    """
+    def __init__(self, clock=time.monotonic):
+        """Arguments:
+            clock: function returning the current time in seconds.
+                All open and close times are measured with this clock."""
+        self.log = logging.getLogger("auctionscheduler")
+        self._clock = clock
+        # heap of (time, sequence number, schedule). Moving a close time just pushes a new entry,
+        # outdated entries are recognized and skipped when they are popped.
+        self._heap = []
+        self._counter = count()
+        self._schedules = {}
+        self._condition = threading.Condition()
+
+    def schedule(self, auction, close_at, on_close, open_at=None, on_open=None,
+                 extension=0, extension_window=0, max_close_at=None):
+        """Schedules an auction to close at the given time.
+
+        Arguments:
+            auction: the auction to schedule. Every auction can only be scheduled once at a time.
+            close_at: time at which the auction closes.
+            on_close: function called with (auction, winner) when the auction closed,
+                winner being the get_winner() result of the auction's snapshot at that time.
+            open_at: time at which the auction opens, or None if it is already open.
+            on_open: function called with (auction) when the auction opened.
+            extension: if a bid changes less than extension_window seconds before the auction closes,
+                the closing time is moved to extension seconds after that bid.
+            extension_window: see extension.
+            max_close_at: time the auction closes at the latest, regardless of extensions."""
+        with self._condition:
+            if auction in self._schedules:
+                raise ValueError("auction is already scheduled.")
+            schedule = _Schedule(auction, open_at, close_at, on_open, on_close,
+                                 extension, extension_window, max_close_at)
+            # the closing time is only pushed once the auction opened
+            if open_at is None:
+                schedule.opened = True
+                self._push(close_at, schedule)
+            else:
+                self._push(open_at, schedule)
+            if extension and extension_window:
+                schedule.listener = lambda user, item: self._bid_changed(schedule, user)
+                auction.change_listeners.add(schedule.listener)
+            self._schedules[auction] = schedule
+            self._condition.notify_all()
+
+    def cancel(self, auction):
+        """Unschedules an auction without closing it.
+        Returns True if it was scheduled, or False if not."""
+        with self._condition:
+            schedule = self._schedules.pop(auction, None)
+            if schedule is None:
+                return False
+            self._forget(schedule)
+            return True
+
+    def reschedule(self, auction, close_at):
+        """Moves the closing time of a scheduled auction."""
+        with self._condition:
+            schedule = self._schedules[auction]
+            schedule.close_at = close_at
+            if schedule.opened:
+                self._push(close_at, schedule)
+                self._condition.notify_all()
+
+    def get_close_time(self, auction):
+        """Returns the current closing time of a scheduled auction, or None if it isn't scheduled."""
+        schedule = self._schedules.get(auction)
+        return schedule.close_at if schedule else None
+
+    def is_open(self, auction):
+        """Returns whether a scheduled auction has been opened and isn't closed yet."""
+        schedule = self._schedules.get(auction)
+        return schedule is not None and schedule.opened and not schedule.closed
+
+    def time_until_next(self):
+        """Returns the seconds until the next auction opens or closes, 0 if that is overdue,
+        or None if nothing is scheduled."""
+        with self._condition:
+            self._discard_outdated()
+            if not self._heap:
+                return None
+            return max(0, self._heap[0][0] - self._clock())
+
+    def run_pending(self):
+        """Opens and closes all auctions that are due and fires their callbacks.
+        Returns the number of auctions closed."""
+        closed = 0
+        while True:
+            with self._condition:
+                self._discard_outdated()
+                if not self._heap or self._heap[0][0] > self._clock():
+                    return closed
+                _, _, schedule = heapq.heappop(self._heap)
+                if not schedule.opened:
+                    schedule.opened = True
+                    self._push(schedule.close_at, schedule)
+                    callback, closing = schedule.on_open, False
+                else:
+                    schedule.closed = True
+                    del self._schedules[schedule.auction]
+                    self._forget(schedule)
+                    callback, closing = schedule.on_close, True
+                    closed += 1
+            if callback is not None:
+                try:
+                    if closing:
+                        # bids may change on other threads, of which only snapshots are safe to read
+                        callback(schedule.auction, schedule.auction.snapshot().get_winner())
+                    else:
+                        callback(schedule.auction)
+                except Exception:
+                    self.log.exception("auction callback %r failed", callback)
+
+    def run(self, stop_event):
+        """Fires the callbacks of all scheduled auctions on time, until stop_event is set.
+        Meant to be run on a dedicated thread. The clock must be real time for this."""
+        while not stop_event.is_set():
+            self.run_pending()
+            with self._condition:
+                timeout = self.time_until_next()
+                # wake up regularly to check for the stop event
+                self._condition.wait(1.0 if timeout is None else min(timeout, 1.0))
+
+    def stop(self, stop_event):
+        """Sets the stop event and wakes up run()."""
+        stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def _push(self, at, schedule):
+        heapq.heappush(self._heap, (at, next(self._counter), schedule))
+
+    def _discard_outdated(self):
+        """Removes heap entries that don't match their schedule's current state anymore."""
+        heap = self._heap
+        while heap:
+            at, _, schedule = heap[0]
+            if schedule.closed or (schedule.opened and at != schedule.close_at) \
+                    or (not schedule.opened and at != schedule.open_at):
+                heapq.heappop(heap)
+            else:
+                return
+
+    def _forget(self, schedule):
+        schedule.closed = True
+        if schedule.listener is not None:
+            schedule.auction.change_listeners.discard(schedule.listener)
+            schedule.listener = None
+
+    def _bid_changed(self, schedule, user):
+        if user is None:
+            # bids were cleared, not placed
+            return
+        with self._condition:
+            if schedule.closed or not schedule.opened:
+                return
+            now = self._clock()
+            if now >= schedule.close_at:
+                # too late, the auction closes on the next run_pending()
+                return
+            if schedule.close_at - now >= schedule.extension_window:
+                return
+            close_at = now + schedule.extension
+            if schedule.max_close_at is not None:
+                close_at = min(close_at, schedule.max_close_at)
+            if close_at > schedule.close_at:
+                schedule.close_at = close_at
+                self._push(close_at, schedule)
@@ -0,0 +1,235 @@
+"""Reserved money shared between processes.
+
+An auction's reserved money is only known to the bank of its own process, so with several
+worker processes sharing one bank storage, a user could bid the same money in each of them.
+A SharedReservedTable keeps every user's reserved money in a memory-mapped file all processes
+open. Attached auctions reserve money for raised bids in it atomically before applying them,
+and banks read every user's total in O(1).
+
+The table has a fixed capacity of users, set when the file is created. It is an open-addressing
+hash table of (blake2b hash of repr(user), amount) slots with linear probing.
+Updates are atomic across processes by locking the file with flock(), so this is Unix only.
+flock() can't exclude processes sharing a file descriptor, so a table opened before fork()
+reopens its file by path in the child. The file must not be moved or replaced while in use.
+Users are never removed from the table, reset() empties it while no auctions are attached.
+Reservations of a process that crashed stay in the table until it is reset.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import weakref
+from hashlib import blake2b
+
+from . import InsufficientMoneyError
+
+
+class SharedReservedTable:
+    """Per-user reserved money in a file shared between processes."""
+    _MAGIC = b"bidcatRM"
+    # magic, capacity, used slots
+    _HEADER = struct.Struct("<8sQQ")
+    # user hash, reserved amount. an all-zero hash marks an empty slot
+    _SLOT = struct.Struct("<16sq")
+    _EMPTY = bytes(16)
+    # users that may be stored per slot, keeping probe sequences short
+    MAX_LOAD = 0.75
+
+    def __init__(self, path, capacity=65536):
+        """Arguments:
+            path: path of the table file, created if it doesn't exist, e.g. in /dev/shm.
+            capacity: number of slots if the file is created, rounded up to a power of two.
+                At most MAX_LOAD of them can hold users. Existing files keep their capacity."""
+        self.path = path
+        # within a process, flock() doesn't exclude threads sharing the file
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                self.capacity = 1 << max(0, capacity - 1).bit_length()
+                os.ftruncate(self._fd, self._HEADER.size + self.capacity * self._SLOT.size)
+                os.pwrite(self._fd, self._HEADER.pack(self._MAGIC, self.capacity, 0), 0)
+            else:
+                magic, self.capacity, _ = self._HEADER.unpack(os.pread(self._fd, self._HEADER.size, 0))
+                if magic != self._MAGIC:
+                    raise ValueError("%s is not a reserved money table" % path)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mmap = mmap.mmap(self._fd, self._HEADER.size + self.capacity * self._SLOT.size)
+        # auction -> (change listener, dict(user:amount written to the table), whether its checker was registered)
+        self._attached = {}
+        # the hook can't be removed again, so it must not keep the table alive
+        table = weakref.ref(self)
+
+        def reopen_in_child():
+            alive = table()
+            if alive is not None:
+                alive._reopen()
+        os.register_at_fork(after_in_child=reopen_in_child)
+
+    def _reopen(self):
+        """Gives a forked child its own lock and file descriptor. The inherited descriptor shares
+        its flock() with the parent, and the inherited lock may have been held by another thread."""
+        if self._mmap.closed:
+            return
+        self._lock = threading.Lock()
+        inherited = self._fd
+        self._fd = os.open(self.path, os.O_RDWR)
+        # the mmap stays valid, it maps the same file shared with the parent
+        os.close(inherited)
+
+    def _key(self, user):
+        return blake2b(repr(user).encode("utf-8"), digest_size=16).digest()
+
+    def _find(self, key):
+        """Returns the offset of the slot of key, or of the empty slot it would go into."""
+        mask = self.capacity - 1
+        index = int.from_bytes(key[:8], "little") & mask
+        while True:
+            offset = self._HEADER.size + index * self._SLOT.size
+            slot_key = self._mmap[offset:offset + 16]
+            if slot_key == key or slot_key == self._EMPTY:
+                return offset
+            index = (index + 1) & mask
+
+    def get_reserved_money(self, user):
+        """Returns the money reserved by that user in all attached auctions of all processes."""
+        key = self._key(user)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                slot_key, amount = self._SLOT.unpack_from(self._mmap, self._find(key))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return amount if slot_key == key else 0
+
+    def add(self, user, change):
+        """Atomically adds change to the money reserved by that user."""
+        key = self._key(user)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                offset = self._find(key)
+                slot_key, amount = self._SLOT.unpack_from(self._mmap, offset)
+                self._write(offset, key, slot_key, (amount if slot_key == key else 0) + change)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _write(self, offset, key, slot_key, amount):
+        """Writes a user's amount into its slot found by _find(), taking the slot if it was empty.
+        Must be called while holding the exclusive lock."""
+        if slot_key != key:
+            magic, capacity, used = self._HEADER.unpack_from(self._mmap, 0)
+            if used + 1 > capacity * self.MAX_LOAD:
+                raise RuntimeError("reserved money table is full, it holds {} users at most."
+                                   .format(int(capacity * self.MAX_LOAD)))
+            self._HEADER.pack_into(self._mmap, 0, magic, capacity, used + 1)
+        self._SLOT.pack_into(self._mmap, offset, key, amount)
+
+    def reserve(self, user, amount, limit):
+        """Atomically adds amount to the money reserved by that user, unless that makes it exceed limit.
+        Returns whether the money was reserved."""
+        key = self._key(user)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                offset = self._find(key)
+                slot_key, reserved = self._SLOT.unpack_from(self._mmap, offset)
+                if slot_key != key:
+                    reserved = 0
+                if reserved + amount > limit:
+                    return False
+                self._write(offset, key, slot_key, reserved + amount)
+                return True
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reset(self):
+        """Removes all users from the table. Only call this while no auction is attached in any process."""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._mmap[self._HEADER.size:] = bytes(self.capacity * self._SLOT.size)
+                self._HEADER.pack_into(self._mmap, 0, self._MAGIC, self.capacity, 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def register(self, bank):
+        """Makes the bank count the money reserved in the table. Needed in every process using the bank."""
+        bank.reserved_money_checker_functions.add(self.get_reserved_money)
+
+    def deregister(self, bank):
+        """Stops the bank from counting the money reserved in the table."""
+        bank.reserved_money_checker_functions.discard(self.get_reserved_money)
+
+    def attach(self, auction):
+        """Writes all reserved money of an auction to the table from now on, and registers the table
+        at the auction's bank instead of the auction's own reserved money checker.
+        Money for raised bids is reserved in the table before the bid is applied, in the same atomic
+        step as checking that it is available, so processes bidding at the same time can't both
+        spend it. Lowered and removed bids are written after they were applied."""
+        written = {}
+        bank = auction.bank
+
+        def reserver(user, needed_money):
+            if needed_money <= 0:
+                return
+            # money reserved outside of the table, e.g. by auctions not attached to it
+            reserved_elsewhere = sum(checker(user) for checker in list(bank.reserved_money_checker_functions)
+                                     if checker != self.get_reserved_money)
+            # a prefetched balance may miss money spent by other processes
+            limit = bank.get_total_money(user, use_prefetched=False) - reserved_elsewhere
+            if not self.reserve(user, needed_money, limit):
+                raise InsufficientMoneyError("Can't afford to bid {}, only {} available."
+                                             .format(needed_money, limit - self.get_reserved_money(user)))
+            written[user] = written.get(user, 0) + needed_money
+
+        def listener(user, item):
+            if user is None:
+                # all bids were cleared
+                for cleared_user, amount in written.items():
+                    self.add(cleared_user, -amount)
+                written.clear()
+                return
+            amount = auction.get_reserved_money(user)
+            change = amount - written.get(user, 0)
+            if change:
+                self.add(user, change)
+                if amount:
+                    written[user] = amount
+                else:
+                    del written[user]
+        checkers = auction.bank.reserved_money_checker_functions
+        checker_registered = auction.get_reserved_money in checkers
+        checkers.discard(auction.get_reserved_money)
+        self._attached[auction] = (listener, written, checker_registered)
+        auction.change_listeners.add(listener)
+        auction.money_reserver = reserver
+        # money already reserved before attaching
+        users = {user for itembids in auction.get_all_bids().values() for user in itembids}
+        for user in users:
+            amount = auction.get_reserved_money(user)
+            self.add(user, amount)
+            written[user] = amount
+        self.register(auction.bank)
+
+    def detach(self, auction):
+        """Removes the auction's reserved money from the table and stops writing it.
+        The auction's own reserved money checker is registered again if it was before attaching."""
+        listener, written, checker_registered = self._attached.pop(auction)
+        auction.change_listeners.discard(listener)
+        auction.money_reserver = None
+        for user, amount in written.items():
+            self.add(user, -amount)
+        if checker_registered:
+            auction.register_reserved_money_checker()
+
+    def close(self):
+        """Detaches all auctions and closes the table file."""
+        for auction in list(self._attached):
+            self.detach(auction)
+        self._mmap.close()
+        os.close(self._fd)
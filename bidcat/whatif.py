@@ -0,0 +1,100 @@
+"""Batch evaluation of hypothetical bids.
+
+Auction.what_if() answers a single "what if this user bid that much" question quickly.
+what_ifs() answers many of them at once, e.g. for every user and item shown on an overlay.
+Small batches are evaluated right on a snapshot(). Large batches are spread over a process pool.
+Every worker process receives one compact copy of the auction's bids when it starts,
+and then only the questions and answers are sent around.
+The live auction isn't changed and the bank isn't asked, only a snapshot() is read.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from heapq import nsmallest
+
+from . import _what_if
+
+# state of the worker process: (top ranking keys, bids, totals, allocation)
+_state = None
+
+
+class _EntryField:
+    """Read-only view of one field of a snapshot's item entries, by item."""
+    __slots__ = ("_entries", "_field")
+
+    def __init__(self, entries, field):
+        self._entries = entries
+        self._field = field
+
+    def __getitem__(self, item):
+        return getattr(self._entries[item], self._field)
+
+    def get(self, item, default=None):
+        entry = self._entries.get(item)
+        return default if entry is None else getattr(entry, self._field)
+
+
+def _top(snapshot):
+    """Returns the top three ranking keys (-total, last change, item) of a snapshot."""
+    return nsmallest(3, ((-entry.total, entry.last_change, item) for item, entry in snapshot._entries.items()))
+
+
+def _view(snapshot):
+    """Returns the state needed to evaluate hypothetical bids against a snapshot, without copying it:
+    (top three ranking keys, bids by item, totals by item)"""
+    entries = snapshot._entries
+    return _top(snapshot), _EntryField(entries, "bids"), _EntryField(entries, "total")
+
+
+def _compact(snapshot):
+    """Returns a picklable copy of the state needed to evaluate hypothetical bids against a snapshot:
+    (top three ranking keys, dict(item:dict(user:amount)), dict(item:total))"""
+    entries = snapshot._entries
+    bids = {item: dict(entry.bids) for item, entry in entries.items()}
+    totals = {item: entry.total for item, entry in entries.items()}
+    return _top(snapshot), bids, totals
+
+
+def _init_worker(state):
+    global _state
+    _state = state
+
+
+def _evaluate(state, queries, discount_latter):
+    top, bids, totals, allocation = state
+    return [_what_if(top, bids, totals, user, item, amount, discount_latter, allocation)
+            for user, item, amount in queries]
+
+
+def _evaluate_in_worker(queries, discount_latter):
+    return _evaluate(_state, queries, discount_latter)
+
+
+def what_ifs(auction, queries, discount_latter=False, max_workers=None, inline_below=1000):
+    """Calculates what get_winner() would return for each of many hypothetical bids.
+    See Auction.what_if().
+
+    Arguments:
+        auction: the Auction or AuctionSnapshot to evaluate the bids against.
+        queries: list of tuple(user, item, amount), each evaluated on its own.
+        discount_latter: see Auction.get_winner().
+        max_workers: number of worker processes, defaults to the number of CPUs.
+        inline_below: batches with fewer queries are evaluated in this process,
+            because starting the pool costs more than it saves for them.
+    Returns a list of the results in the order of queries.
+    Users, items and the allocation strategy must be picklable for batches evaluated on the pool."""
+    snapshot = auction.snapshot() if hasattr(auction, "snapshot") else auction
+    queries = list(queries)
+    if len(queries) < inline_below:
+        return _evaluate(_view(snapshot) + (snapshot._allocation,), queries, discount_latter)
+    state = _compact(snapshot) + (snapshot._allocation,)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    # a few chunks per worker, so that uneven chunks even out
+    chunk_size = max(1, len(queries) // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(state,)) as pool:
+        chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+        results = []
+        for chunk_results in pool.map(_evaluate_in_worker, chunks, [discount_latter] * len(chunks)):
+            results.extend(chunk_results)
+    return results
@@ -16,7 +16,7 @@ User IDs are strings or integers.
 
 import logging
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 Bid = namedtuple("Bid", ["user_id", "item_id", "max_bid"])
 ItemTotal = namedtuple("Bid", ["item_id", "total_bidded"])
@@ -36,12 +36,35 @@ class Auction(object):
         self.bank = bank
         # set up logging
         self.log = logging.getLogger("auctionsys")
-        #list to keep track of bids
-        self.bids = []
+        #keep track of bids by (user_id, item_id), in chronological order
+        self._bids = OrderedDict()
+        #user_id -> sum of that user's bids
+        self._user_totals = {}
+
+    @property
+    def bids(self):
+        """List of all bids, in chronological order.
+
+        This is a copy, changing it doesn't change the auction. Assign a list of bids to replace all bids
+        without checking anyone's money; of several bids by the same user on the same item the last one is kept.
+        """
+        return list(self._bids.values())
+
+    @bids.setter
+    def bids(self, bids):
+        self.clear()
+        for bid in bids:
+            bid = Bid(*bid)
+            previous = self._bids.pop((bid.user_id, bid.item_id), None)
+            if previous is not None:
+                self._user_totals[bid.user_id] -= previous.max_bid
+            self._bids[(bid.user_id, bid.item_id)] = bid
+            self._user_totals[bid.user_id] = self._user_totals.get(bid.user_id, 0) + bid.max_bid
 
     def clear(self):
         """Clear all stored bids. After calling this, self.get_reserved_money() will also be reset to 0 for every user"""
-        self.bids = []
+        self._bids.clear()
+        self._user_totals.clear()
 
     def register_reserved_money_checker(self):
         """Adds the reserved money checker function at the bank.
@@ -65,11 +88,7 @@ class Auction(object):
         It is guaranteed that no more than this amount will be taken from the
         user's account without further action from this user.
         """
-        total=0
-        for bid in self.bids:
-            if bid.user_id == user_id:
-                total += bid.max_bid
-        return total
+        return self._user_totals.get(user_id, 0)
 
     def place_bid(self, user_id, item_id, max_bid):
         """Place a bid for the given item_id, max_bid, and user_id.
@@ -80,26 +99,26 @@ class Auction(object):
             raise ValueError("'max_bid' must be a value above 0")
         
         available_money = self.bank.get_available_money(user_id)
-        reserved_money = self.bank.get_reserved_money(user_id)
 
         #check if we're replacing a bid
-        for bid in self.bids:
-            user,item,prev_bid_amt = bid
-            if (bid.user_id == user_id) and (bid.item_id == item_id):
-                new_amt_needed = max_bid - bid.max_bid
-                if new_amt_needed > available_money:
-                    self.log.info((max_bid,available_money,reserved_money))
-                    raise InsufficientMoneyError("can't afford to make bid")
-
-                #remove the old bid; adding the replacement bid happens at the same .append() as if the bid was new
-                self.bids.remove(bid)
-                break
+        key = (user_id, item_id)
+        bid = self._bids.get(key)
+        if bid is not None:
+            new_amt_needed = max_bid - bid.max_bid
+            if new_amt_needed > available_money:
+                self.log.info((max_bid,available_money,self.bank.get_reserved_money(user_id)))
+                raise InsufficientMoneyError("can't afford to make bid")
+
+            #remove the old bid; adding the replacement bid happens at the end as if the bid was new
+            del self._bids[key]
+            self._user_totals[user_id] -= bid.max_bid
         else:
             # It's a new bid
             if max_bid > available_money:
                 raise InsufficientMoneyError("can't afford to make bid")
 
-        self.bids.append(Bid(user_id, item_id, max_bid))
+        self._bids[key] = Bid(user_id, item_id, max_bid)
+        self._user_totals[user_id] = self._user_totals.get(user_id, 0) + max_bid
         self.log.debug(str(user_id)+" placed bid for "+str(item_id)+": "+str(max_bid))
 
     def process_bids(self):
@@ -126,8 +145,10 @@ class Auction(object):
         bids_for_item = {} # dict of {item_id: [bid_for_item_id, another_bid_for_item_id...]}
         item_cost = {} # dict of {item_id: total_money_bidded_for_item} 
 
+        all_bids = self.bids
+
         #Sum up the bids for each item to figure out the total amount of money spent on each item
-        for bid in self.bids:
+        for bid in all_bids:
             if bid.item_id not in bids_for_item:
                 bids_for_item[bid.item_id] = []
                 item_cost[bid.item_id] = 0
@@ -161,7 +182,7 @@ class Auction(object):
         if winning_item == None:
             return {
                 "winning_bid": None,
-                "all_bids":self.bids,
+                "all_bids":all_bids,
             }
 
         #Now, compute who pays what using everyone-owes-equally
@@ -193,7 +214,7 @@ class Auction(object):
             "bids":bids_for_item[winning_item],
             "amounts_owed":alloting
             },
-        "all_bids":self.bids,
+        "all_bids":all_bids,
         }
 
 
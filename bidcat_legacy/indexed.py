@@ -0,0 +1,121 @@
+"""Drop-in replacement for bidcat_legacy.Auction running on the indexed bidcat engine.
+
+IndexedAuction behaves like bidcat_legacy.Auction, including the equal-split allocation and
+the process_bids() result format, but keeps its bids in a bidcat.Auction, so placing bids and
+checking reserved money don't scan all bids anymore.
+"""
+
+import logging
+from collections import OrderedDict
+
+import bidcat
+from bidcat_legacy import Bid, InsufficientMoneyError
+
+
+class IndexedAuction(object):
+    """Handles multiple users bidding on multiple items, only one item can win.
+
+    All provided item IDs and user IDs are assumed to be valid.
+    """
+    def __init__(self, bank):
+        """
+        Arguments:
+            bank: bank object to access to reserve currency
+        """
+        self.bank = bank
+        self.log = logging.getLogger("auctionsys")
+        self.auction = bidcat.Auction(bank, allocation=bidcat.allocate_equal_split)
+        # like the legacy auction, only reserve money once registered
+        self.auction.deregister_reserved_money_checker()
+        # (user_id, item_id) -> Bid, in the chronological order bids were last placed
+        self._chronological = OrderedDict()
+
+    @property
+    def bids(self):
+        """List of all Bid namedtuples in the order they were last placed."""
+        return list(self._chronological.values())
+
+    def clear(self):
+        """Clear all stored bids. After calling this, self.get_reserved_money() will also be reset to 0 for every user"""
+        self.auction.clear()
+        self._chronological.clear()
+
+    def register_reserved_money_checker(self):
+        """Adds the reserved money checker function at the bank.
+
+        If this is used the function MUST be removed before the auction object is deleted!
+        """
+        self.log.info("registering reserved money checker")
+        self.auction.register_reserved_money_checker()
+
+    def deregister_reserved_money_checker(self):
+        """Removes the reserved money checker function from the bank.
+
+        This MUST be called when the auction has been finished and fulfilled.
+        """
+        self.log.info("deregistering reserved money checker")
+        self.auction.deregister_reserved_money_checker()
+
+    def get_reserved_money(self, user_id):
+        """Calculate the amount of money a user has tied up in the auction system.
+
+        It is guaranteed that no more than this amount will be taken from the
+        user's account without further action from this user.
+        """
+        return self.auction.get_reserved_money(user_id)
+
+    def place_bid(self, user_id, item_id, max_bid):
+        """Place a bid for the given item_id, max_bid, and user_id.
+
+        Will raise an InsufficientMoneyError if the user_id does not have enough bank balance to make that bid.
+        """
+        if max_bid <= 0:
+            raise ValueError("'max_bid' must be a value above 0")
+        previous_bid = self.auction.get_bids_for_item(item_id).get(user_id, 0)
+        available_money = self.bank.get_available_money(user_id)
+        if max_bid - previous_bid > available_money:
+            raise InsufficientMoneyError("can't afford to make bid")
+        # replaced bids count as new, making the item the most recently changed one
+        # and moving the bid behind the item's other bids, just like in the legacy auction.
+        # the engine's own money checks match the one above, so they don't fail after it.
+        try:
+            if not previous_bid:
+                self.auction.place_bid(user_id, item_id, max_bid)
+            elif previous_bid != max_bid:
+                self.auction.replace_bid(user_id, item_id, max_bid)
+            else:
+                # replacing with the same amount changes nothing in the engine otherwise
+                self.auction.renew_bid(user_id, item_id)
+        except bidcat.InsufficientMoneyError:
+            raise InsufficientMoneyError("can't afford to make bid")
+        self._chronological.pop((user_id, item_id), None)
+        self._chronological[(user_id, item_id)] = Bid(user_id, item_id, max_bid)
+        self.log.debug(str(user_id)+" placed bid for "+str(item_id)+": "+str(max_bid))
+
+    def process_bids(self):
+        """Process everyone's bids and make any changes.
+
+        Returns:
+            the same dict as bidcat_legacy.Auction.process_bids()
+        """
+        all_bids = self.bids
+        winner = self.auction.get_winner()
+        if winner is None:
+            return {
+                "winning_bid": None,
+                "all_bids": all_bids,
+            }
+        winning_item = winner["item"]
+        self.log.debug("Processed bids; winning item is "+str(winning_item)+", total cost is "
+                       +str(winner["total_bid"])+", total charge is "+str(winner["total_charge"]))
+        return {
+            "winning_bid": {
+                "winning_item": winning_item,
+                "total_charge": winner["total_charge"],
+                "total_cost": winner["total_bid"],
+                "bids": [Bid(user_id, winning_item, max_bid) for user_id, max_bid
+                         in self.auction.get_bids_for_item(winning_item).items()],
+                "amounts_owed": dict(winner["money_owed"]),
+            },
+            "all_bids": all_bids,
+        }
@@ -0,0 +1,435 @@
+import unittest
+import logging
+import os
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from banksys import DummyBank, SqliteBank, AccountNotFound, TransactionWriter
+from bidcat import Auction, InsufficientMoneyError
+
+
+class SqliteBankTester(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "bank.sqlite")
+        self.bank = SqliteBank(self.path, starting_amount=1000, batch_size=10)
+
+    def tearDown(self):
+        self.bank.close()
+        shutil.rmtree(self.directory)
+
+    def test_starting_amount(self):
+        self.assertEqual(self.bank.get_total_money("alice"), 1000)
+        self.assertEqual(self.bank.get_available_money("alice"), 1000)
+
+    def test_account_not_found(self):
+        bank = SqliteBank(os.path.join(self.directory, "strict.sqlite"))
+        self.assertRaises(AccountNotFound, bank.get_total_money, "alice")
+        self.assertRaises(AccountNotFound, bank.make_transaction, "alice", 10, {})
+        bank.create_account("alice", 30)
+        self.assertEqual(bank.get_total_money("alice"), 30)
+        bank.close()
+
+    def test_transaction(self):
+        transaction = self.bank.make_transaction("alice", -100, {"reason": "test"})
+        self.assertEqual(transaction["old_balance"], 1000)
+        self.assertEqual(transaction["new_balance"], 900)
+        self.assertEqual(transaction["reason"], "test")
+        self.assertEqual(self.bank.get_total_money("alice"), 900)
+
+    def test_user_types_kept(self):
+        self.bank.make_transaction(1, 5, {})
+        self.assertEqual(self.bank.get_total_money(1), 1005)
+        self.assertEqual(self.bank.get_total_money("1"), 1000)
+
+    def test_persistence(self):
+        self.bank.make_transaction("alice", 234, {})
+        for _ in range(15):
+            self.bank.make_transaction("bob", 1, {"item": "pepsiman"})
+        self.bank.close()
+        self.bank = SqliteBank(self.path)
+        self.assertEqual(self.bank.get_total_money("alice"), 1234)
+        self.assertEqual(self.bank.get_total_money("bob"), 1015)
+        count, = self.bank.connection.execute("SELECT COUNT(*) FROM transactions").fetchone()
+        self.assertEqual(count, 16)
+
+    def test_batched_inserts(self):
+        for _ in range(9):
+            self.bank.make_transaction("alice", 1, {})
+        count_sql = "SELECT COUNT(*) FROM transactions"
+        self.assertEqual(self.bank.connection.execute(count_sql).fetchone(), (0,))
+        self.bank.make_transaction("alice", 1, {})
+        self.assertEqual(self.bank.connection.execute(count_sql).fetchone(), (10,))
+        self.bank.make_transaction("alice", 1, {})
+        self.bank.flush()
+        self.assertEqual(self.bank.connection.execute(count_sql).fetchone(), (11,))
+
+    def test_flush_at_exit(self):
+        # a process exiting without closing the bank
+        code = ("from banksys import SqliteBank\n"
+                "bank = SqliteBank(%r, starting_amount=1000, batch_size=10)\n"
+                "bank.make_transaction('alice', 1, {})\n" % self.path)
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(self.bank.get_total_money("alice"), 1001)
+        count, = self.bank.connection.execute("SELECT COUNT(*) FROM transactions").fetchone()
+        self.assertEqual(count, 1)
+
+    def test_wal_mode(self):
+        mode, = self.bank.connection.execute("PRAGMA journal_mode").fetchone()
+        self.assertEqual(mode, "wal")
+
+    def test_auction(self):
+        auction = Auction(bank=self.bank)
+        auction.place_bid("alice", "pepsiman", 600)
+        self.assertEqual(self.bank.get_available_money("alice"), 400)
+        self.assertRaises(InsufficientMoneyError, auction.place_bid, "alice", "katamari", 401)
+        auction.deregister_reserved_money_checker()
+
+
+class TransactionWriterTester(unittest.TestCase):
+    def setUp(self):
+        self.bank = DummyBank()
+        self.batches = []
+        self.bank._record_transactions = self.batches.append
+
+    def test_batches(self):
+        self.bank.start_transaction_writer(batch_size=5, interval=60)
+        for _ in range(10):
+            self.bank.make_transaction("alice", 1, {})
+        self.bank.transaction_writer.flush()
+        self.assertEqual([len(batch) for batch in self.batches], [5, 5])
+        self.assertEqual([t["new_balance"] for t in self.batches[1]], list(range(50006, 50011)))
+        self.bank.stop_transaction_writer()
+
+    def test_interval(self):
+        self.bank.start_transaction_writer(batch_size=100, interval=0.01)
+        self.bank.make_transaction("alice", 1, {})
+        self.bank.transaction_writer.flush()
+        self.assertEqual(len(self.batches), 1)
+        self.bank.stop_transaction_writer()
+
+    def test_flush_on_close(self):
+        self.bank.start_transaction_writer(batch_size=100, interval=60)
+        for _ in range(3):
+            self.bank.make_transaction("alice", 1, {})
+        self.bank.stop_transaction_writer()
+        self.assertEqual(sum(len(batch) for batch in self.batches), 3)
+        # records synchronously again
+        self.bank._record_transaction = lambda t: self.batches.append([t])
+        self.bank.make_transaction("alice", 1, {})
+        self.assertEqual(len(self.batches[-1]), 1)
+
+    def test_backpressure(self):
+        release = threading.Event()
+        written = []
+
+        def slow_write(batch):
+            release.wait()
+            written.extend(batch)
+        writer = TransactionWriter(slow_write, batch_size=1, max_pending=2)
+        writer.submit(1)
+        writer.submit(2)
+        writer.submit(3)
+        # the first record is being written, two are waiting, so the queue is full
+        self.assertRaises(queue.Full, writer.submit, 4, timeout=0.01)
+        release.set()
+        writer.close()
+        self.assertEqual(written, [1, 2, 3])
+        self.assertRaises(RuntimeError, writer.submit, 5)
+
+    def test_error_callback(self):
+        errors = []
+
+        def failing_write(batch):
+            raise IOError("disk full")
+        writer = TransactionWriter(failing_write, batch_size=2, on_error=lambda e, batch: errors.append((e, batch)))
+        writer.submit(1)
+        writer.submit(2)
+        writer.close()
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0][0], IOError)
+        self.assertEqual(errors[0][1], [1, 2])
+
+    def test_failing_error_callback(self):
+        written = []
+
+        def failing_callback(e, batch):
+            raise ValueError("callback bug")
+
+        def write(batch):
+            if batch == [1]:
+                raise IOError("disk full")
+            written.extend(batch)
+        writer = TransactionWriter(write, batch_size=1, on_error=failing_callback)
+        with self.assertLogs("bank", logging.ERROR):
+            writer.submit(1)
+            writer.flush()
+        # the writer keeps running
+        writer.submit(2)
+        writer.close()
+        self.assertEqual(written, [2])
+
+    def test_sqlite(self):
+        directory = tempfile.mkdtemp()
+        bank = SqliteBank(os.path.join(directory, "bank.sqlite"), starting_amount=10, batch_size=1000)
+        bank.start_transaction_writer(batch_size=10, interval=0.01)
+        for _ in range(25):
+            bank.make_transaction("alice", 1, {})
+        bank.transaction_writer.flush()
+        count, = bank.connection.execute("SELECT COUNT(*) FROM transactions").fetchone()
+        self.assertEqual(count, 25)
+        bank.close()
+        shutil.rmtree(directory)
+
+
+class CountingBank(DummyBank):
+    """DummyBank counting single and bulk storage queries."""
+    def __init__(self):
+        super(CountingBank, self).__init__()
+        self.single_queries = 0
+        self.bulk_queries = 0
+
+    def _get_stored_money_value(self, user):
+        self.single_queries += 1
+        return super(CountingBank, self)._get_stored_money_value(user)
+
+    def _get_stored_money_values(self, users):
+        self.bulk_queries += 1
+        return {user: self._storage.get(user, self._starting_amount) for user in users}
+
+
+class PrefetchTester(unittest.TestCase):
+    def setUp(self):
+        self.bank = CountingBank()
+        self.auction = Auction(bank=self.bank)
+
+    def tearDown(self):
+        self.auction.deregister_reserved_money_checker()
+
+    def test_prefetch(self):
+        self.bank.prefetch(["alice", "bob", "charlie", "deku"]).join()
+        self.assertEqual(self.bank.bulk_queries, 1)
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.auction.place_bid("bob", "pepsiman", 10)
+        self.auction.increase_bid("alice", "pepsiman", 10)
+        self.assertEqual(self.bank.single_queries, 0)
+        self.assertEqual(self.bank.get_available_money("alice"), 50000 - 20)
+        self.assertEqual(self.bank.prefetch_stats, {"prefetched": 4, "hits": 4})
+        self.assertEqual(self.bank.get_prefetch_effectiveness(), 1.0)
+        # not prefetched
+        self.auction.place_bid("eve", "pepsiman", 10)
+        self.assertEqual(self.bank.single_queries, 1)
+
+    def test_transaction_invalidates(self):
+        self.bank.prefetch(["alice"]).join()
+        self.bank.make_transaction("alice", -100, {})
+        self.assertEqual(self.bank.get_total_money("alice"), 50000 - 100)
+        self.assertEqual(self.bank.prefetch_stats["hits"], 0)
+
+    def test_change_during_prefetch(self):
+        started = threading.Event()
+        release = threading.Event()
+        bulk = self.bank._get_stored_money_values
+
+        def slow_bulk(users):
+            balances = bulk(users)
+            started.set()
+            release.wait()
+            return balances
+        self.bank._get_stored_money_values = slow_bulk
+        thread = self.bank.prefetch(["alice", "bob"])
+        started.wait()
+        self.bank.make_transaction("alice", -100, {})
+        release.set()
+        thread.join()
+        # the outdated balance of alice was not kept
+        self.assertEqual(self.bank.get_total_money("alice"), 50000 - 100)
+        self.assertEqual(self.bank.get_total_money("bob"), 50000)
+        self.assertEqual(self.bank.prefetch_stats["hits"], 1)
+
+    def test_change_while_storing(self):
+        bank = self.bank
+
+        class ChangingDict(dict):
+            # the other user's balance changes right after the first prefetched one was stored
+            def __setitem__(self, user, value):
+                super().__setitem__(user, value)
+                if len(self) == 1:
+                    bank.make_transaction("bob" if user == "alice" else "alice", -100, {})
+        bank._prefetched = ChangingDict()
+        bank.prefetch(["alice", "bob"]).join()
+        self.assertEqual(len(bank._prefetched), 1)
+        self.assertEqual(bank.get_total_money("alice") + bank.get_total_money("bob"), 2 * 50000 - 100)
+
+    def test_expiry(self):
+        self.bank.prefetch_ttl = 0
+        self.bank.prefetch(["alice"]).join()
+        self.bank.get_total_money("alice")
+        self.assertEqual(self.bank.single_queries, 1)
+        self.assertEqual(self.bank.get_prefetch_effectiveness(), 0)
+
+    def test_changed_by_other_process(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "bank.sqlite")
+        bank, other = SqliteBank(path), SqliteBank(path)
+        bank.create_account("alice", 100)
+        bank.prefetch(["alice"]).join()
+        other.make_transaction("alice", -60, {})
+        # not seen for up to prefetch_ttl seconds, unless asked for the stored balance
+        self.assertEqual(bank.get_total_money("alice"), 100)
+        self.assertEqual(bank.get_total_money("alice", use_prefetched=False), 40)
+        bank.close()
+        other.close()
+        shutil.rmtree(directory)
+
+    def test_sqlite_bulk(self):
+        directory = tempfile.mkdtemp()
+        bank = SqliteBank(os.path.join(directory, "bank.sqlite"))
+        users = ["user%d" % i for i in range(1200)]
+        for i, user in enumerate(users):
+            bank.create_account(user, i)
+        bank.prefetch(users + ["unknown"]).join()
+        self.assertEqual(bank.prefetch_stats["prefetched"], 1200)
+        self.assertEqual(bank.get_total_money("user1000"), 1000)
+        self.assertEqual(bank.prefetch_stats["hits"], 1)
+        self.assertRaises(AccountNotFound, bank.get_total_money, "unknown")
+        bank.close()
+        shutil.rmtree(directory)
+
+
+class BankParityTester(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dummy = DummyBank()
+        self.dummy._starting_amount = 1000
+        self.sqlite = SqliteBank(os.path.join(self.directory, "bank.sqlite"), starting_amount=1000)
+
+    def tearDown(self):
+        self.sqlite.close()
+        shutil.rmtree(self.directory)
+
+    def _run(self, bank, operations):
+        transactions = []
+        for user, change in operations:
+            transaction = bank.make_transaction(user, change, {"note": "parity"})
+            transactions.append({key: value for key, value in transaction.items() if key != "timestamp"})
+        return transactions
+
+    def test_parity(self):
+        rng = random.Random(42)
+        operations = [(rng.choice(["alice", "bob", "charlie", 7]), rng.randint(-50, 50))
+                      for _ in range(500)]
+        self.assertEqual(self._run(self.dummy, operations), self._run(self.sqlite, operations))
+        for user in ["alice", "bob", "charlie", 7, "deku"]:
+            self.assertEqual(self.dummy.get_total_money(user), self.sqlite.get_total_money(user))
+
+    def test_benchmark(self):
+        operations = [("user%d" % (i % 50), 1) for i in range(2000)]
+        start = time.perf_counter()
+        self._run(self.dummy, operations)
+        dummy_time = time.perf_counter() - start
+        start = time.perf_counter()
+        self._run(self.sqlite, operations)
+        self.sqlite.flush()
+        sqlite_time = time.perf_counter() - start
+        # only logged, wall-clock time depends too much on the machine to assert it
+        logging.getLogger("bank").info("2000 transactions: dummy %.3fs, sqlite %.3fs",
+                                       dummy_time, sqlite_time)
+        self.assertEqual(self.dummy.get_total_money("user0"), self.sqlite.get_total_money("user0"))
+
+
+class TransactionQueryTester(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.banks = [DummyBank(), SqliteBank(os.path.join(self.directory, "bank.sqlite"), starting_amount=1000)]
+        start = datetime(2020, 1, 1)
+        # out of order, to check the banks order by time
+        for i in [3, 0, 4, 1, 2, 5, 6, 7, 8, 9]:
+            for bank in self.banks:
+                bank._record_transaction(dict(user="alice" if i % 3 else "bob", change=i,
+                                              timestamp=start + timedelta(seconds=i),
+                                              old_balance=1000, new_balance=1000 + i, auction_id=i // 4))
+
+    def tearDown(self):
+        self.banks[1].close()
+        shutil.rmtree(self.directory)
+
+    def test_get_transactions(self):
+        for bank in self.banks:
+            self.assertEqual([t["change"] for t in bank.get_transactions("alice")], [1, 2, 4, 5, 7, 8])
+            self.assertEqual([t["change"] for t in bank.get_transactions("bob", newest_first=True)], [9, 6, 3, 0])
+            self.assertEqual(bank.get_transactions("charlie"), [])
+
+    def test_pagination(self):
+        for bank in self.banks:
+            pages = []
+            since = None
+            while True:
+                page = bank.get_transactions("alice", since=since, limit=4)
+                if not page:
+                    break
+                pages.append([t["change"] for t in page])
+                since = page[-1]["timestamp"]
+            self.assertEqual(pages, [[1, 2, 4, 5], [7, 8]])
+            since = bank.get_transactions("alice")[2]["timestamp"]
+            self.assertEqual([t["change"] for t in bank.get_transactions("alice", since=since, newest_first=True)],
+                             [8, 7, 5])
+            self.assertEqual(next(bank.iter_transactions("alice", since=since))["change"], 5)
+            before = bank.get_transactions("alice")[4]["timestamp"]
+            self.assertEqual([t["change"] for t in bank.get_transactions("alice", since=since, before=before)], [5])
+            self.assertEqual([t["change"] for t in bank.iter_transactions("alice", newest_first=True, before=before)],
+                             [5, 4, 2, 1])
+
+    def test_pages(self):
+        for bank in self.banks:
+            # several transactions at the same time, which paging by timestamps would skip
+            for change in range(10, 15):
+                bank._record_transaction(dict(user="alice", change=change, timestamp=datetime(2020, 1, 1, 0, 1),
+                                              old_balance=1000, new_balance=1000 + change))
+            for newest_first in (False, True):
+                pages = []
+                cursor = None
+                while True:
+                    page, cursor = bank.get_transactions_page("alice", cursor, limit=4, newest_first=newest_first)
+                    pages.append([t["change"] for t in page])
+                    if cursor is None:
+                        break
+                expected = [[1, 2, 4, 5], [7, 8, 10, 11], [12, 13, 14]]
+                if newest_first:
+                    expected = [[14, 13, 12, 11], [10, 8, 7, 5], [4, 2, 1]]
+                self.assertEqual(pages, expected)
+            self.assertEqual(bank.get_transactions_page("charlie"), ([], None))
+
+    def test_transactions_match(self):
+        transactions = [bank.get_transactions("alice") + bank.get_transactions("bob") for bank in self.banks]
+        self.assertEqual(transactions[0], transactions[1])
+        self.banks[0]._starting_amount = 1000
+        for bank in self.banks:
+            bank.make_transaction("charlie", -10, {"auction_id": "match1", "item": "pepsiman"})
+        charlie = [{key: value for key, value in bank.get_transactions("charlie")[0].items() if key != "timestamp"}
+                   for bank in self.banks]
+        self.assertEqual(charlie[0], charlie[1])
+        self.assertEqual(charlie[1]["item"], "pepsiman")
+
+    def test_auction_transactions(self):
+        for bank in self.banks:
+            self.assertEqual([t["change"] for t in bank.get_auction_transactions(1)], [4, 5, 6, 7])
+            self.assertEqual(bank.get_auction_transactions(3), [])
+
+    def test_sqlite_uses_indexes(self):
+        bank = self.banks[1]
+        for query, args in [(bank._SELECT_TRANSACTIONS % ("DESC", "DESC"), ("alice", "", 0, "~", 0, -1)),
+                            ("SELECT * FROM transactions WHERE %s = ?" % bank._auction_id, (1,))]:
+            plan = bank.connection.execute("EXPLAIN QUERY PLAN " + query, args).fetchall()
+            self.assertIn("USING INDEX", " ".join(row[-1] for row in plan))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
 import logging
 from bidcat import Auction, InsufficientMoneyError, AlreadyBidError, NoExistingBidError, VisiblyLoweredError
+from bidcat import TooManyItemsError, BidTooHighError, RateLimitedError
+from bidcat import allocate_equal_split
 
 
 class AuctionsysTester(unittest.TestCase):
@@ -215,6 +217,18 @@ class AuctionsysTester(unittest.TestCase):
         bids = self.auction.get_all_bids()
         self.assertEqual(bids, {"katamari": {"bob": 1}})
 
+    def test_renew(self):
+        self.auction.place_bid("alice", "pepsiman", 5)
+        self.auction.place_bid("bob", "pepsiman", 5)
+        self.auction.place_bid("charlie", "katamari", 10)
+        self.assertEqual(self.auction.get_winner()["item"], "pepsiman")
+        # spending everything doesn't matter, no money is needed
+        self.bank._storage["alice"] = 0
+        self.auction.renew_bid("alice", "pepsiman")
+        self.assertEqual(list(self.auction.get_bids_for_item("pepsiman").items()), [("bob", 5), ("alice", 5)])
+        self.assertEqual(self.auction.get_winner()["item"], "katamari")
+        self.assertRaises(NoExistingBidError, self.auction.renew_bid, "charlie", "pepsiman")
+
     def test_remove_from_empty_auction(self):
         bids = self.auction.get_all_bids()
         self.assertEqual(bids, {})
@@ -296,6 +310,23 @@ class AuctionsysTester(unittest.TestCase):
             ("pepsiman", {"alice": 1}),
         ])
 
+    def test_iter_bids_ordered(self):
+        for i in range(10):
+            self.auction.place_bid("alice", "item%d" % i, 10 - i)
+        self.auction.place_bid("bob", "item9", 5)
+        self.auction.place_bid("bob", "item3", 3)
+        ordered = self.auction.get_all_bids_ordered()
+        self.assertEqual([item for item, _ in ordered[:4]], ["item0", "item3", "item1", "item2"])
+        self.assertEqual(list(self.auction.iter_bids_ordered()), ordered)
+        self.assertEqual(list(self.auction.iter_bids_ordered(offset=4, limit=3)), ordered[4:7])
+        self.assertEqual(list(self.auction.iter_bids_ordered(offset=9, limit=3)), ordered[9:])
+        self.assertEqual(list(self.auction.iter_bids_ordered(offset=3)), ordered[3:])
+        self.assertEqual(list(self.auction.iter_bids_ordered(offset=20, limit=3)), [])
+        snapshot = self.auction.snapshot()
+        self.assertEqual(list(snapshot.iter_bids_ordered(offset=4, limit=3)), ordered[4:7])
+        self.assertEqual(list(snapshot.iter_bids_ordered(offset=2)), ordered[2:])
+        self.assertEqual(list(snapshot.iter_bids_ordered(offset=4, limit=3)), ordered[4:7])
+
     def test_favor_earlier_after_replace(self):
         self.auction.place_bid("alice", "pepsiman", 3)
         self.auction.place_bid("bob", "pepsiman", 2)
@@ -329,6 +360,374 @@ class AuctionsysTester(unittest.TestCase):
                           self.auction.replace_bid,
                           "bob", "katamari", 1, allow_visible_lowering=False)
 
+    def test_headroom(self):
+        self.assertEqual(self.auction.get_headroom(), 0)
+        self.auction.place_bid("alice", "pepsiman", 10)
+        # a single bid would only be charged 1
+        self.assertEqual(self.auction.get_headroom(), 9)
+        self.auction.place_bid("bob", "katamari", 5)
+        self.assertEqual(self.auction.get_headroom(), 4)
+        self.auction.place_bid("charlie", "katamari", 5)
+        # 10 vs 10 is a tie, which pepsiman wins by being first
+        self.assertEqual(self.auction.get_winner()["item"], "pepsiman")
+        self.assertEqual(self.auction.get_headroom(), 0)
+        self.auction.increase_bid("charlie", "katamari", 3)
+        self.assertEqual(self.auction.get_headroom(), 2)
+        self.auction.remove_bid("alice", "pepsiman")
+        self.assertEqual(self.auction.get_headroom(), 12)
+        winner = self.auction.get_winner()
+        self.assertEqual(self.auction.get_headroom(), winner["total_bid"] - winner["total_charge"])
+        self.auction.clear()
+        self.assertEqual(self.auction.get_headroom(), 0)
+
+    def test_visibly_lowering_within_headroom(self):
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.auction.place_bid("bob", "pepsiman", 10)
+        self.auction.place_bid("charlie", "katamari", 12)
+        # headroom is 20 - 13 = 7, spread across any of pepsiman's bidders
+        self.auction.replace_bid("alice", "pepsiman", 5, allow_visible_lowering=False)
+        self.auction.replace_bid("bob", "pepsiman", 8, allow_visible_lowering=False)
+        self.assertEqual(self.auction.get_headroom(), 0)
+        self.assertRaises(VisiblyLoweredError,
+                          self.auction.replace_bid,
+                          "bob", "pepsiman", 7, allow_visible_lowering=False)
+        self.assertEqual(self.auction.get_bids_for_item("pepsiman"), {"alice": 5, "bob": 8})
+
+    def test_change_listeners(self):
+        changes = []
+        self.auction.change_listeners.add(lambda user, item: changes.append((user, item)))
+        self.auction.place_bid("alice", "pepsiman", 1)
+        self.auction.replace_bid("alice", "pepsiman", 1)  # no change
+        self.auction.increase_bid("alice", "pepsiman", 1)
+        self.auction.remove_bid("alice", "pepsiman")
+        self.auction.remove_bid("alice", "pepsiman")  # no change
+        self.auction.clear()
+        self.assertEqual(changes, [("alice", "pepsiman")] * 3 + [(None, None)])
+
+    def test_get_winners(self):
+        self.assertEqual(self.auction.get_winners(3), [])
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.auction.place_bid("bob", "katamari", 4)
+        self.auction.place_bid("charlie", "katamari", 3)
+        self.auction.place_bid("deku", "catz", 3)
+        self.auction.place_bid("ennopp", "unfinished_battle", 1)
+        version = self.auction.version
+        winners = self.auction.get_winners(3)
+        self.assertEqual(self.auction.version, version)
+        self.assertEqual([winner["item"] for winner in winners], ["pepsiman", "katamari", "catz"])
+        self.assertEqual([winner["total_bid"] for winner in winners], [10, 7, 3])
+        self.assertEqual([winner["total_charge"] for winner in winners], [8, 4, 2])
+        self.assertEqual(winners[1]["money_owed"], {"bob": 2, "charlie": 2})
+        self.assertEqual(winners[0], self.auction.get_winner())
+        self.assertEqual(self.auction.get_winners(1), [self.auction.get_winner()])
+        # fewer items than winners, the last one pays as if there was no next bid
+        winners = self.auction.get_winners(10)
+        self.assertEqual(len(winners), 4)
+        self.assertEqual(winners[-1]["total_charge"], 1)
+        self.assertEqual(self.auction.snapshot().get_winners(10), winners)
+        self.assertEqual(self.auction.get_winners(0), [])
+        self.assertRaises(ValueError, self.auction.get_winners, -1)
+        self.assertRaises(ValueError, self.auction.snapshot().get_winners, -1)
+
+    def test_amount_to_lead(self):
+        self.assertEqual(self.auction.amount_to_lead("pepsiman"), 1)
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.auction.place_bid("bob", "katamari", 4)
+        self.assertEqual(self.auction.amount_to_lead("pepsiman"), 0)
+        self.assertEqual(self.auction.amount_to_lead("katamari"), 7)
+        self.assertEqual(self.auction.amount_to_lead("catz"), 11)
+        self.auction.increase_bid("bob", "katamari", 6)
+        # tied, but pepsiman was first
+        self.assertEqual(self.auction.get_winner()["item"], "pepsiman")
+        self.assertEqual(self.auction.amount_to_lead("katamari"), 1)
+
+    def test_what_if(self):
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.auction.place_bid("bob", "katamari", 4)
+        self.auction.place_bid("charlie", "katamari", 3)
+        version = self.auction.version
+        self.assertEqual(self.auction.what_if("alice", "pepsiman", 10), self.auction.get_winner())
+        winner = self.auction.what_if("deku", "katamari", 4)
+        self.assertEqual(winner["item"], "katamari")
+        self.assertEqual(winner["total_charge"], 11)
+        self.assertEqual(winner["money_owed"], {"bob": 4, "deku": 4, "charlie": 3})
+        # a tie is won by pepsiman, which changed less recently
+        self.assertEqual(self.auction.what_if("deku", "katamari", 3)["item"], "pepsiman")
+        self.assertEqual(self.auction.what_if("alice", "pepsiman", 0)["item"], "katamari")
+        self.assertEqual(self.auction.what_if("alice", "pepsiman", 5)["total_charge"], 6)
+        self.assertEqual(self.auction.what_if("deku", "catz", 20)["money_owed"], {"deku": 11})
+        self.assertEqual(self.auction.version, version)
+        self.assertEqual(self.auction.get_bids_for_item("katamari"), {"bob": 4, "charlie": 3})
+        self.assertRaises(ValueError, self.auction.what_if, "alice", "pepsiman", -1)
+        self.auction.clear()
+        self.assertIsNone(self.auction.what_if("alice", "pepsiman", 0))
+        self.assertEqual(self.auction.what_if("alice", "pepsiman", 3)["money_owed"], {"alice": 1})
+
+    def test_equal_split_allocation(self):
+        auction = Auction(self.bank, allocation=allocate_equal_split)
+        auction.place_bid("alice", "pepsiman", 1)
+        auction.place_bid("bob", "pepsiman", 4)
+        auction.place_bid("charlie", "pepsiman", 2)
+        auction.place_bid("deku", "pepsiman", 2)
+        auction.place_bid("ennopp", "katamari", 4)
+        winner = auction.get_winner()
+        self.assertEqual(winner["total_charge"], 5)
+        self.assertEqual(winner["money_owed"], {"alice": 1, "bob": 2, "charlie": 1, "deku": 1})
+        winner = auction.get_winner(discount_latter=True)
+        self.assertEqual(winner["money_owed"], {"alice": 1, "bob": 1, "charlie": 1, "deku": 2})
+        self.assertEqual(auction.snapshot().get_winner(), auction.get_winner())
+        auction.deregister_reserved_money_checker()
+
+    def test_reserved_money(self):
+        self.auction.place_bid("alice", "pepsiman", 5)
+        self.auction.place_bid("alice", "katamari", 7)
+        self.auction.place_bid("bob", "katamari", 3)
+        self.assertEqual(self.auction.get_reserved_money("alice"), 12)
+        self.auction.increase_bid("alice", "pepsiman", 2)
+        self.auction.remove_bid("alice", "katamari")
+        self.assertEqual(self.auction.get_reserved_money("alice"), 7)
+        self.assertEqual(self.bank.get_available_money("alice"), self.max_money - 7)
+        self.assertEqual(self.auction.get_reserved_money("charlie"), 0)
+        self.auction.clear()
+        self.assertEqual(self.auction.get_reserved_money("bob"), 0)
+        self.assertEqual(self.auction.get_bids_for_user("bob"), {})
+
+    def test_max_items_per_user(self):
+        self.auction.max_items_per_user = 2
+        self.auction.place_bid("alice", "pepsiman", 1)
+        self.auction.place_bid("alice", "katamari", 1)
+        self.assertRaises(TooManyItemsError, self.auction.place_bid, "alice", "catz", 1)
+        # changing existing bids is fine
+        self.auction.increase_bid("alice", "katamari", 1)
+        self.auction.place_bid("bob", "catz", 1)
+        self.auction.remove_bid("alice", "pepsiman")
+        self.auction.place_bid("alice", "catz", 1)
+
+    def test_max_bid(self):
+        self.auction.max_bid = 10
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.assertRaises(BidTooHighError, self.auction.place_bid, "bob", "pepsiman", 11)
+        self.assertRaises(BidTooHighError, self.auction.increase_bid, "alice", "pepsiman", 1)
+        self.assertEqual(self.auction.get_bids_for_item("pepsiman"), {"alice": 10})
+
+    def test_rate_limit(self):
+        now = [0]
+        auction = Auction(self.bank, rate_limit=(3, 60), clock=lambda: now[0])
+        auction.place_bid("alice", "pepsiman", 1)
+        now[0] = 10
+        auction.increase_bid("alice", "pepsiman", 1)
+        auction.place_bid("alice", "katamari", 1)
+        self.assertRaises(RateLimitedError, auction.increase_bid, "alice", "pepsiman", 1)
+        # other users are not affected, and removing is always possible
+        auction.place_bid("bob", "pepsiman", 1)
+        self.assertTrue(auction.remove_bid("alice", "katamari"))
+        now[0] = 60
+        auction.increase_bid("alice", "pepsiman", 1)
+        self.assertRaises(RateLimitedError, auction.increase_bid, "alice", "pepsiman", 1)
+        now[0] = 70
+        auction.increase_bid("alice", "pepsiman", 1)
+        self.assertEqual(auction.get_bids_for_item("pepsiman"), {"alice": 4, "bob": 1})
+        auction.deregister_reserved_money_checker()
+        self.assertRaises(ValueError, Auction, self.bank, rate_limit=(0, 60))
+
+    def test_operation_ids(self):
+        now = [0]
+        auction = Auction(self.bank, clock=lambda: now[0], max_operation_ids=3, operation_id_ttl=60)
+        auction.place_bid("alice", "pepsiman", 5, op_id="msg1")
+        auction.increase_bid("alice", "pepsiman", 5, op_id="msg2")
+        # redelivered
+        auction.increase_bid("alice", "pepsiman", 5, op_id="msg2")
+        auction.place_bid("alice", "pepsiman", 5, op_id="msg1")
+        self.assertEqual(auction.get_bids_for_item("pepsiman"), {"alice": 10})
+        self.assertEqual(auction.duplicate_operations, 2)
+        # failed operations are not remembered, so they can be retried
+        self.assertRaises(InsufficientMoneyError, auction.increase_bid, "alice", "pepsiman", 1000, op_id="msg3")
+        auction.increase_bid("alice", "pepsiman", 1, op_id="msg3")
+        self.assertTrue(auction.remove_bid("alice", "pepsiman", op_id="msg4"))
+        self.assertTrue(auction.remove_bid("alice", "pepsiman", op_id="msg4"))
+        self.assertFalse(auction.remove_bid("alice", "pepsiman", op_id="msg5"))
+        # only the latest 3 ids are remembered
+        self.assertEqual(list(auction._operations), ["msg3", "msg4", "msg5"])
+        auction.place_bid("alice", "pepsiman", 5, op_id="msg1")
+        self.assertEqual(auction.get_bids_for_item("pepsiman"), {"alice": 5})
+        # and only for 60 seconds
+        now[0] = 60
+        auction.remove_bid("alice", "pepsiman", op_id="msg4")
+        self.assertEqual(auction.get_bids_for_item("pepsiman"), {})
+        self.assertEqual(list(auction._operations), ["msg4"])
+        self.assertEqual(auction.duplicate_operations, 3)
+        auction.deregister_reserved_money_checker()
+
+    def test_winner_max_mutations(self):
+        auction = Auction(self.bank, winner_max_mutations=3)
+        auction.place_bid("alice", "pepsiman", 5)
+        winner = auction.get_winner()
+        self.assertEqual((winner["version"], winner["staleness"]), (1, 0))
+        auction.place_bid("bob", "katamari", 10)
+        auction.place_bid("charlie", "catz", 1)
+        winner = auction.get_winner()
+        self.assertEqual((winner["item"], winner["version"], winner["staleness"]), ("pepsiman", 1, 2))
+        # the latest result is always served without the limits
+        fresh = auction.get_winner(fresh=True)
+        self.assertEqual((fresh["item"], fresh["version"], fresh["staleness"]), ("katamari", 3, 0))
+        self.assertEqual(auction.get_winner()["version"], 3)
+        for amount in range(3):
+            auction.place_bid("deku", amount, 20)
+        self.assertEqual(auction.get_winner()["item"], 0)
+        # each discount_latter result is cached separately
+        self.assertEqual(auction.get_winner(discount_latter=True)["staleness"], 0)
+        auction.clear()
+        self.assertIsNone(auction.get_winner())
+        auction.deregister_reserved_money_checker()
+
+    def test_winner_max_age(self):
+        now = [0]
+        auction = Auction(self.bank, clock=lambda: now[0], winner_max_age=0.5)
+        auction.place_bid("alice", "pepsiman", 5)
+        self.assertEqual(auction.get_winner()["item"], "pepsiman")
+        for i in range(10):
+            auction.place_bid("bob", i, 10 + i)
+        now[0] = 0.4
+        winner = auction.get_winner()
+        self.assertEqual((winner["item"], winner["staleness"], winner["age"]), ("pepsiman", 10, 0.4))
+        now[0] = 0.5
+        winner = auction.get_winner()
+        self.assertEqual((winner["item"], winner["staleness"], winner["age"]), (9, 0, 0))
+        # an unchanged auction's result doesn't get outdated
+        now[0] = 10
+        self.assertEqual(auction.get_winner()["version"], winner["version"])
+        self.assertNotIn("version", self.auction.get_winner() or {})
+        auction.deregister_reserved_money_checker()
+
+    def test_snapshot_versions(self):
+        first = self.auction.snapshot()
+        self.auction.place_bid("alice", "pepsiman", 3)
+        second = self.auction.snapshot()
+        self.auction.place_bid("bob", "katamari", 5)
+        self.auction.remove_bid("alice", "pepsiman")
+        third = self.auction.snapshot()
+        self.assertLess(first.version, second.version)
+        self.assertLess(second.version, third.version)
+        self.assertEqual(third.version, self.auction.version)
+        # old snapshots are unaffected by later changes
+        self.assertEqual(first.get_all_bids(), {})
+        self.assertEqual(second.get_all_bids(), {"pepsiman": {"alice": 3}})
+        self.assertEqual(third.get_all_bids(), {"katamari": {"bob": 5}})
+        # unchanged items are shared between versions
+        self.auction.place_bid("charlie", "catz", 1)
+        self.assertIs(self.auction.snapshot().get_bids_for_item("katamari"),
+                      third.get_bids_for_item("katamari"))
+
+    def test_snapshot_unchanged_on_noop(self):
+        self.auction.place_bid("alice", "pepsiman", 3)
+        snapshot = self.auction.snapshot()
+        self.auction.replace_bid("alice", "pepsiman", 3)
+        self.auction.remove_bid("bob", "pepsiman")
+        self.assertIs(self.auction.snapshot(), snapshot)
+
+    def test_snapshot_matches_auction(self):
+        self.auction.place_bid("alice", "pepsiman", 5)
+        self.auction.place_bid("bob", "pepsiman", 10)
+        self.auction.place_bid("charlie", "katamari", 5)
+        self.auction.place_bid("deku", "catz", 15)
+        self.auction.replace_bid("alice", "pepsiman", 1)
+        snapshot = self.auction.snapshot()
+        self.assertEqual(snapshot.get_all_bids_ordered(), self.auction.get_all_bids_ordered())
+        self.assertEqual(snapshot.get_winner(), self.auction.get_winner())
+        self.assertEqual(snapshot.get_winner(discount_latter=True),
+                         self.auction.get_winner(discount_latter=True))
+        self.auction.clear()
+        self.assertEqual(snapshot.get_winner()["item"], "catz")
+        self.assertEqual(self.auction.snapshot().get_winner(), None)
+
+    def test_persistent_map(self):
+        import random
+        from bidcat import _PersistentMap
+
+        class Colliding:
+            # equal hashes, so all bits of the hashes are used up
+            def __init__(self, value):
+                self.value = value
+
+            def __hash__(self):
+                return 12345
+
+            def __eq__(self, other):
+                return isinstance(other, Colliding) and other.value == self.value
+        rng = random.Random(3)
+        keys = list(range(300)) + [str(i) for i in range(50)] + [Colliding(i) for i in range(5)] + [-1, 2 ** 70]
+        expected = {}
+        persistent = _PersistentMap()
+        for _ in range(3000):
+            key = rng.choice(keys)
+            previous, previous_items = persistent, dict(persistent.items())
+            if rng.random() < 0.4:
+                expected.pop(key, None)
+                persistent = persistent.delete(key)
+            else:
+                expected[key] = rng.random()
+                persistent = persistent.set(key, expected[key])
+            self.assertEqual(dict(persistent.items()), expected)
+            self.assertEqual(len(persistent), len(expected))
+            self.assertEqual(persistent.get(key), expected.get(key))
+            # older versions stay unchanged
+            self.assertEqual(dict(previous.items()), previous_items)
+        self.assertRaises(KeyError, persistent.__getitem__, "missing")
+
+    def test_snapshot_is_read_only(self):
+        self.auction.place_bid("alice", "pepsiman", 5)
+        bids = self.auction.snapshot().get_bids_for_item("pepsiman")
+        with self.assertRaises(TypeError):
+            bids["alice"] = 1
+
+    def test_snapshot_concurrent_reads(self):
+        import threading
+        stop = threading.Event()
+        errors = []
+
+        def read():
+            while not stop.is_set():
+                snapshot = self.auction.snapshot()
+                ordered = snapshot.get_all_bids_ordered()
+                winner = snapshot.get_winner()
+                if ordered and winner["item"] != ordered[0][0]:
+                    errors.append((snapshot.version, winner, ordered))
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            for i in range(2000):
+                self.auction.place_bid("alice", i % 7, 1 + i % 3)
+                self.auction.remove_bid("alice", (i + 3) % 7)
+        finally:
+            stop.set()
+            reader.join()
+        self.assertEqual(errors, [])
+
+    def test_cached_winner_concurrent_reads(self):
+        import threading
+        auction = Auction(self.bank, winner_max_mutations=5)
+        stop = threading.Event()
+        errors = []
+
+        def read():
+            while not stop.is_set():
+                winner = auction.get_winner()
+                # every bid change raises the total by 1, so it always matches the version
+                if winner is not None and winner["total_bid"] != winner["version"]:
+                    errors.append(winner)
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            auction.place_bid("alice", "pepsiman", 1)
+            for _ in range(self.max_money - 1):
+                auction.increase_bid("alice", "pepsiman", 1)
+        finally:
+            stop.set()
+            reader.join()
+        self.assertEqual(errors, [])
+        auction.deregister_reserved_money_checker()
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     unittest.main()
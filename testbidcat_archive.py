@@ -0,0 +1,89 @@
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+from bidcat import Auction
+from bidcat.archive import AuctionArchive
+
+
+class ArchiveTester(unittest.TestCase):
+    def setUp(self):
+        from banksys import DummyBank
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "archive.sqlite")
+        self.archive = AuctionArchive(self.path, cache_size=3)
+        self.bank = DummyBank()
+        self.auction = Auction(bank=self.bank)
+
+    def tearDown(self):
+        self.auction.deregister_reserved_money_checker()
+        self.archive.close()
+        shutil.rmtree(self.directory)
+
+    def settle(self, auction_id, settled_at):
+        self.archive.store(auction_id, self.auction.get_winner(), self.auction.get_all_bids(),
+                           settled_at=settled_at)
+        self.auction.clear()
+
+    def test_roundtrip(self):
+        self.auction.place_bid("alice", "pepsiman", 5)
+        self.auction.place_bid("bob", "pepsiman", 10)
+        self.auction.place_bid(7, "katamari", 5)
+        winner = self.auction.get_winner()
+        bids = {item: dict(itembids) for item, itembids in self.auction.get_all_bids().items()}
+        self.settle("match1", 1000)
+        # read back from disk, not from the cache
+        self.archive.close()
+        self.archive = AuctionArchive(self.path)
+        result = self.archive.get("match1")
+        self.assertEqual(result["winner"], winner)
+        self.assertEqual(list(result["winner"]["money_owed"]), list(winner["money_owed"]))
+        self.assertEqual(result["bids"], bids)
+        self.assertEqual(result["settled_at"], 1000)
+        self.assertIsNone(self.archive.get("match2"))
+
+    def test_no_winner(self):
+        self.settle("empty", 1000)
+        self.assertEqual(self.archive.get("empty")["winner"], None)
+        self.assertEqual(self.archive.get("empty")["bids"], {})
+
+    def test_duplicate_id(self):
+        self.settle("match1", 1000)
+        import sqlite3
+        self.assertRaises(sqlite3.IntegrityError, self.settle, "match1", 1001)
+
+    def test_user_history(self):
+        for i in range(10):
+            self.auction.place_bid("alice", "pepsiman", 10)
+            if i % 2:
+                self.auction.place_bid("bob", "katamari", 4)
+            self.settle(i, 1000 + i)
+        history = self.archive.get_user_history("alice", limit=3)
+        self.assertEqual([entry["auction_id"] for entry in history], [9, 8, 7])
+        self.assertEqual([entry["paid"] for entry in history], [5, 1, 5])
+        self.assertEqual(history[0]["bid"], 10)
+        history = self.archive.get_user_history("bob")
+        self.assertEqual(len(history), 5)
+        self.assertEqual({entry["paid"] for entry in history}, {0})
+        self.assertEqual(self.archive.get_user_history("charlie"), [])
+
+    def test_bounded_cache(self):
+        for i in range(10):
+            self.auction.place_bid("alice", "pepsiman", i + 1)
+            self.settle(i, 1000 + i)
+        self.assertEqual(list(self.archive._cache), [7, 8, 9])
+        self.assertEqual(self.archive.get(0)["bids"], {"pepsiman": {"alice": 1}})
+        self.assertEqual(list(self.archive._cache), [8, 9, 0])
+        self.assertEqual([result["auction_id"] for result in self.archive.get_latest(2)], [9, 8])
+
+    def test_index_used(self):
+        plan = self.archive.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT seq FROM participants WHERE user_id = ? ORDER BY seq DESC LIMIT 50",
+            ("alice",)).fetchall()
+        self.assertNotIn("SCAN", " ".join(row[-1] for row in plan))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()
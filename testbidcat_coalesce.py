@@ -0,0 +1,168 @@
+import unittest
+import logging
+from bidcat import Auction, InsufficientMoneyError, AlreadyBidError, NoExistingBidError, VisiblyLoweredError, \
+    BidTooHighError, TooManyItemsError
+from bidcat.coalesce import BidCoalescer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CoalescerTester(unittest.TestCase):
+    def setUp(self):
+        from banksys import DummyBank
+        self.max_money = 1000
+        self.bank = DummyBank()
+        self.bank._starting_amount = self.max_money
+        self.auction = Auction(bank=self.bank)
+        self.clock = FakeClock()
+        self.coalescer = BidCoalescer(self.auction, window=1.0, max_depth=100, clock=self.clock)
+
+    def tearDown(self):
+        self.auction.deregister_reserved_money_checker()
+
+    def test_merges_increases(self):
+        self.coalescer.place_bid("alice", "pepsiman", 1)
+        for _ in range(9):
+            self.coalescer.increase_bid("alice", "pepsiman", 1)
+        # nothing applied yet
+        self.assertEqual(self.auction.get_all_bids(), {})
+        self.coalescer.flush()
+        self.assertEqual(self.auction.get_all_bids(), {"pepsiman": {"alice": 10}})
+        self.assertEqual(self.coalescer.applied, 1)
+        self.assertEqual(self.coalescer.coalescing_ratio, 10)
+
+    def test_window(self):
+        self.coalescer.place_bid("alice", "pepsiman", 1)
+        self.clock.now = 0.5
+        self.coalescer.increase_bid("alice", "pepsiman", 1)
+        self.coalescer.poll()
+        self.assertEqual(self.auction.get_all_bids(), {})
+        self.clock.now = 1.0
+        self.coalescer.poll()
+        self.assertEqual(self.auction.get_all_bids(), {"pepsiman": {"alice": 2}})
+
+    def test_max_depth(self):
+        self.coalescer.max_depth = 3
+        self.coalescer.place_bid("alice", "pepsiman", 1)
+        self.coalescer.increase_bid("alice", "pepsiman", 1)
+        self.assertEqual(self.auction.get_all_bids(), {})
+        operation = self.coalescer.increase_bid("alice", "pepsiman", 1)
+        self.assertTrue(operation.done)
+        self.assertEqual(self.auction.get_all_bids(), {"pepsiman": {"alice": 3}})
+
+    def test_net_noop(self):
+        self.auction.place_bid("alice", "pepsiman", 5)
+        self.coalescer.replace_bid("alice", "pepsiman", 5)
+        self.coalescer.replace_bid("alice", "pepsiman", 5)
+        version = self.auction.version
+        self.coalescer.flush()
+        self.assertEqual(self.auction.version, version)
+        self.assertEqual(self.coalescer.applied, 0)
+
+    def test_net_noop_breaks_ties(self):
+        self.auction.place_bid("alice", "pepsiman", 5)
+        self.auction.place_bid("bob", "katamari", 5)
+        self.assertEqual(self.auction.get_winner()["item"], "pepsiman")
+        self.coalescer.increase_bid("alice", "pepsiman", 5)
+        self.coalescer.replace_bid("alice", "pepsiman", 5)
+        self.coalescer.flush()
+        # pepsiman changed more recently, like without the coalescer
+        self.assertEqual(self.auction.get_bids_for_item("pepsiman"), {"alice": 5})
+        self.assertEqual(self.auction.get_winner()["item"], "katamari")
+
+    def test_remove_and_place(self):
+        self.auction.place_bid("alice", "pepsiman", 5)
+        removed = self.coalescer.remove_bid("alice", "pepsiman")
+        removed_again = self.coalescer.remove_bid("alice", "pepsiman")
+        self.coalescer.flush()
+        self.assertIs(removed.result(), True)
+        self.assertIs(removed_again.result(), False)
+        self.assertEqual(self.auction.get_all_bids(), {})
+
+    def test_errors_reach_caller(self):
+        too_much = self.coalescer.place_bid("alice", "pepsiman", self.max_money + 1)
+        replace = self.coalescer.replace_bid("alice", "pepsiman", 5)
+        place = self.coalescer.place_bid("alice", "pepsiman", self.max_money)
+        twice = self.coalescer.place_bid("alice", "pepsiman", 1)
+        increase = self.coalescer.increase_bid("alice", "pepsiman", 1)
+        lower = self.coalescer.replace_bid("alice", "pepsiman", 10)
+        zero = self.coalescer.increase_bid("alice", "pepsiman", -10)
+        self.assertRaises(RuntimeError, place.result)
+        self.coalescer.flush()
+        self.assertIsInstance(too_much.exception(), InsufficientMoneyError)
+        self.assertIsInstance(replace.exception(), NoExistingBidError)
+        self.assertIsNone(place.exception())
+        self.assertIsInstance(twice.exception(), AlreadyBidError)
+        self.assertIsInstance(increase.exception(), InsufficientMoneyError)
+        self.assertIsNone(lower.exception())
+        self.assertRaises(ValueError, zero.result)
+        self.assertEqual(self.auction.get_all_bids(), {"pepsiman": {"alice": 10}})
+
+    def test_user_order_kept(self):
+        # alice can afford both bids on their own, but not the increase afterwards
+        self.coalescer.place_bid("alice", "pepsiman", self.max_money - 10)
+        self.coalescer.place_bid("alice", "katamari", 10)
+        increase = self.coalescer.increase_bid("alice", "pepsiman", 5)
+        self.coalescer.flush()
+        self.assertIsInstance(increase.exception(), InsufficientMoneyError)
+        self.assertEqual(self.auction.get_bids_for_user("alice"),
+                         {"pepsiman": self.max_money - 10, "katamari": 10})
+
+    def test_money_changed_falls_back(self):
+        # alice spends money elsewhere right after the coalescer checked it
+        get_available_money = self.bank.get_available_money
+
+        def spend_after_check(user):
+            available = get_available_money(user)
+            self.bank.get_available_money = get_available_money
+            self.bank._storage["alice"] = 15
+            return available
+        self.bank.get_available_money = spend_after_check
+        first = self.coalescer.place_bid("alice", "pepsiman", 10)
+        second = self.coalescer.increase_bid("alice", "pepsiman", 10)
+        self.coalescer.flush()
+        self.assertIsNone(first.exception())
+        self.assertIsInstance(second.exception(), InsufficientMoneyError)
+        self.assertEqual(self.auction.get_all_bids(), {"pepsiman": {"alice": 10}})
+
+    def test_not_lowering_is_not_merged(self):
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.auction.place_bid("bob", "katamari", 5)
+        self.coalescer.increase_bid("alice", "pepsiman", 1)
+        lower = self.coalescer.replace_bid("alice", "pepsiman", 3, allow_visible_lowering=False)
+        self.coalescer.flush()
+        self.assertIsInstance(lower.exception(), VisiblyLoweredError)
+        self.assertEqual(self.auction.get_bids_for_item("pepsiman"), {"alice": 11})
+        self.assertEqual(self.coalescer.get_stats()["applied"], 2)
+
+    def test_limits_not_merged(self):
+        self.auction.max_bid = 80
+        place = self.coalescer.place_bid("alice", "pepsiman", 50)
+        increase = self.coalescer.increase_bid("alice", "pepsiman", 100)
+        replace = self.coalescer.replace_bid("alice", "pepsiman", 60)
+        self.coalescer.flush()
+        self.assertIsNone(place.exception())
+        self.assertIsInstance(increase.exception(), BidTooHighError)
+        self.assertIsNone(replace.exception())
+        self.assertEqual(self.auction.get_bids_for_item("pepsiman"), {"alice": 60})
+
+    def test_max_items_not_merged(self):
+        self.auction.max_items_per_user = 1
+        self.auction.place_bid("alice", "katamari", 10)
+        place = self.coalescer.place_bid("alice", "pepsiman", 10)
+        remove = self.coalescer.remove_bid("alice", "pepsiman")
+        self.coalescer.flush()
+        self.assertIsInstance(place.exception(), TooManyItemsError)
+        self.assertFalse(remove.result())
+        self.assertEqual(self.auction.get_bids_for_user("alice"), {"katamari": 10})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()
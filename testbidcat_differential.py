@@ -0,0 +1,373 @@
+import unittest
+import logging
+import random
+from bidcat import Auction
+from bidcat.coalesce import BidCoalescer
+from referenceauction import Auction as ReferenceAuction
+
+USERS = ["alice", "bob", "cirno", 7]
+ITEMS = ["pepsiman", "katamari", "catz", 42]
+
+
+def make_bank(starting_amount=30):
+    from banksys import DummyBank
+    bank = DummyBank()
+    # little money, so that insufficient money errors happen
+    bank._starting_amount = starting_amount
+    return bank
+
+
+def random_operations(rng, count):
+    operations = []
+    for _ in range(count):
+        if rng.random() < 0.25:
+            # ends a batch for engines applying several operations at once, ignored by others
+            operations.append(("flush",))
+            continue
+        kind = rng.choice(["place", "place", "replace", "replace_not_lowering", "increase", "remove", "clear"]
+                          if rng.random() < 0.05 else
+                          ["place", "place", "replace", "replace_not_lowering", "increase", "remove"])
+        if kind == "clear":
+            operations.append(("clear",))
+        elif kind == "remove":
+            operations.append((kind, rng.choice(USERS), rng.choice(ITEMS)))
+        else:
+            operations.append((kind, rng.choice(USERS), rng.choice(ITEMS), rng.randint(0, 12)))
+    return operations
+
+
+def normalize(winner):
+    """Makes the order of money_owed part of comparisons."""
+    if winner is None:
+        return None
+    return dict(winner, money_owed=list(winner["money_owed"].items()))
+
+
+class Engine:
+    """Applies operations to an auction and reads its state through its public API."""
+    starting_amount = 30
+
+    def __init__(self):
+        self.bank = make_bank(self.starting_amount)
+        self.auction = self.make_auction(self.bank)
+
+    def make_auction(self, bank):
+        return Auction(bank)
+
+    def call(self, operation):
+        kind, *args = operation
+        if kind == "flush":
+            return None
+        if kind == "clear":
+            return self.auction.clear()
+        if kind == "replace_not_lowering":
+            return self.auction.replace_bid(*args, allow_visible_lowering=False)
+        return getattr(self.auction, kind + "_bid")(*args)
+
+    def apply(self, operation):
+        """Returns ("ok", result) or ("error", exception type name)"""
+        try:
+            return "ok", self.call(operation)
+        except Exception as e:
+            return "error", type(e).__name__
+
+    def batches(self, operations):
+        """Returns lists of the indexes of operations applied together, in the order they are applied."""
+        return [[step] for step in range(len(operations))]
+
+    def apply_batch(self, operations):
+        """Returns the outcomes of the operations, see apply()"""
+        return [self.apply(operation) for operation in operations]
+
+    def get_ordered(self):
+        return self.auction.get_all_bids_ordered()
+
+    def get_state(self):
+        winner = self.auction.get_winner()
+        return {
+            "winner": normalize(winner),
+            "headroom": winner["total_bid"] - winner["total_charge"] if winner else 0,
+            "winner_discount_latter": normalize(self.auction.get_winner(discount_latter=True)),
+            "ordered": [(item, list(bids.items())) for item, bids in self.get_ordered()],
+            "user_bids": {user: self.auction.get_bids_for_user(user) for user in USERS},
+            "reserved": {user: self.auction.get_reserved_money(user) for user in USERS},
+            "available": {user: self.bank.get_available_money(user) for user in USERS},
+        }
+
+
+class ReferenceEngine(Engine):
+    def make_auction(self, bank):
+        return ReferenceAuction(bank)
+
+
+class IndexedEngine(Engine):
+    """Also checks the results of the maintained indexes against each other."""
+    def get_state(self):
+        state = super().get_state()
+        winners = self.auction.get_winners(1)
+        state["winner"] = normalize(winners[0]) if winners else None
+        state["headroom"] = self.auction.get_headroom()
+        return state
+
+    def get_ordered(self):
+        # paged, like a leaderboard
+        ordered = []
+        while True:
+            page = list(self.auction.iter_bids_ordered(offset=len(ordered), limit=3))
+            ordered.extend(page)
+            if len(page) < 3:
+                return ordered
+
+
+class SnapshotEngine(Engine):
+    """Reads all state from a snapshot."""
+    def get_state(self):
+        state = super().get_state()
+        snapshot = self.auction.snapshot()
+        state["winner"] = normalize(snapshot.get_winner())
+        state["winner_discount_latter"] = normalize(snapshot.get_winner(discount_latter=True))
+        state["ordered"] = [(item, list(bids.items())) for item, bids in snapshot.iter_bids_ordered(limit=2)]
+        state["ordered"] += [(item, list(bids.items())) for item, bids in snapshot.get_all_bids_ordered()[2:]]
+        return state
+
+
+class OperationIdEngine(Engine):
+    """Applies every operation twice with the same operation id, the second time must be ignored."""
+    def __init__(self):
+        super().__init__()
+        self.operation_ids = iter(range(10**9))
+
+    def call(self, operation):
+        kind, *args = operation
+        if kind in ("clear", "flush"):
+            return super().call(operation)
+        op_id = next(self.operation_ids)
+        if kind == "replace_not_lowering":
+            method, kwargs = self.auction.replace_bid, {"allow_visible_lowering": False, "op_id": op_id}
+        else:
+            method, kwargs = getattr(self.auction, kind + "_bid"), {"op_id": op_id}
+        result = method(*args, **kwargs)
+        # redelivered
+        method(*args, **kwargs)
+        return result
+
+
+class CoalescerEngine(Engine):
+    """Submits the operations between flushes to a coalescer and then flushes it.
+    The coalescer keeps each user's order, but applies users one after another,
+    so the reference applies them in that order too."""
+    def __init__(self):
+        super().__init__()
+        self.coalescer = BidCoalescer(self.auction, window=10**9, clock=lambda: 0)
+
+    def batches(self, operations):
+        batches = [[]]
+        for step, operation in enumerate(operations):
+            if operation[0] == "clear":
+                # clearing isn't coalesced, it is applied on its own
+                batches += [[step], []]
+            else:
+                batches[-1].append(step)
+                if operation[0] == "flush":
+                    batches.append([])
+        return [self._coalescer_order(batch, operations) for batch in batches if batch]
+
+    @staticmethod
+    def _coalescer_order(batch, operations):
+        # users in the order of their first operation, and the flush last
+        users = []
+        for step in batch:
+            if len(operations[step]) > 1 and operations[step][1] not in users:
+                users.append(operations[step][1])
+        return sorted(batch, key=lambda step: users.index(operations[step][1])
+                      if len(operations[step]) > 1 else len(users))
+
+    def apply_batch(self, operations):
+        pending = []
+        for operation in operations:
+            kind, *args = operation
+            if kind in ("clear", "flush"):
+                pending.append(None)
+            elif kind == "replace_not_lowering":
+                pending.append(self.coalescer.replace_bid(*args, allow_visible_lowering=False))
+            else:
+                pending.append(getattr(self.coalescer, kind + "_bid")(*args))
+        self.coalescer.flush()
+        outcomes = []
+        for operation, handle in zip(operations, pending):
+            if handle is None:
+                outcomes.append(self.apply(operation))
+            elif handle.exception() is not None:
+                outcomes.append(("error", type(handle.exception()).__name__))
+            else:
+                outcomes.append(("ok", handle.result()))
+        return outcomes
+
+
+def find_mismatch(operations, engine_class, reference_class=ReferenceEngine):
+    """Runs the operations on both engines, comparing outcomes and the full state after every step.
+    Engines applying several operations at once are compared with the reference applying them one by one,
+    in the order the engine applied them, and their states are compared after each batch.
+    Returns None, or a description of the first difference."""
+    engines = (reference_class(), engine_class())
+    for batch in engines[1].batches(operations):
+        outcomes = engines[1].apply_batch([operations[step] for step in batch])
+        for step, outcome in zip(batch, outcomes):
+            expected = engines[0].apply(operations[step])
+            if expected != outcome:
+                return "step %d %r: expected outcome %r, got %r" % (step, operations[step], expected, outcome)
+        step = batch[-1]
+        operation = operations[step]
+        states = [engine.get_state() for engine in engines]
+        if states[0] != states[1]:
+            differences = {key: (states[0].get(key), states[1].get(key))
+                           for key in states[0].keys() | states[1].keys() if states[0].get(key) != states[1].get(key)}
+            return "step %d %r: expected != got: %r" % (step, operation, differences)
+    return None
+
+
+def shrink(operations, fails):
+    """Returns a sublist of operations for which fails() is still true, but not anymore
+    if any single operation is removed or any single amount is lowered."""
+    while True:
+        shrunk = _lower_amounts(_remove_operations(operations, fails), fails)
+        if shrunk == operations:
+            return operations
+        operations = shrunk
+
+
+def _remove_operations(operations, fails):
+    # delta debugging: remove chunks of operations, halving the chunk size when nothing can be removed
+    chunk = max(1, len(operations) // 2)
+    while True:
+        position = 0
+        while position < len(operations):
+            candidate = operations[:position] + operations[position + chunk:]
+            if fails(candidate):
+                operations = candidate
+            else:
+                position += chunk
+        if chunk == 1:
+            return operations
+        chunk //= 2
+
+
+def _lower_amounts(operations, fails):
+    for index, operation in enumerate(operations):
+        if len(operation) < 4:
+            continue
+        for amount in range(operation[3]):
+            candidate = list(operations)
+            candidate[index] = operation[:3] + (amount,)
+            if fails(candidate):
+                operations = candidate
+                break
+    return operations
+
+
+class DifferentialTestCase(unittest.TestCase):
+    runs = 150
+    operations_per_run = 40
+
+    def check(self, engine_class, reference_class=ReferenceEngine):
+        rng = random.Random(engine_class.__name__)
+        for _ in range(self.runs):
+            operations = random_operations(rng, self.operations_per_run)
+            if find_mismatch(operations, engine_class, reference_class) is None:
+                continue
+            operations = shrink(operations, lambda ops: find_mismatch(ops, engine_class, reference_class) is not None)
+            self.fail("%s differs from the reference after %d operations:\n%s\n%s" % (
+                engine_class.__name__, len(operations), "\n".join(map(repr, operations)),
+                find_mismatch(operations, engine_class, reference_class)))
+
+
+class DifferentialTester(DifferentialTestCase):
+    def test_auction(self):
+        self.check(IndexedEngine)
+
+    def test_snapshot(self):
+        self.check(SnapshotEngine)
+
+    def test_operation_ids(self):
+        self.check(OperationIdEngine)
+
+    def test_coalescer(self):
+        self.check(CoalescerEngine)
+
+    def test_shrinking(self):
+        class BrokenEngine(IndexedEngine):
+            # forgets that the least recently changed item wins ties
+            def get_ordered(self):
+                return sorted(super().get_ordered(), key=lambda entry: (-sum(entry[1].values()), str(entry[0])))
+        rng = random.Random(1)
+        operations = next(ops for ops in (random_operations(rng, 40) for _ in range(100))
+                          if find_mismatch(ops, BrokenEngine))
+        fails = lambda ops: find_mismatch(ops, BrokenEngine) is not None
+        operations = shrink(operations, fails)
+        self.assertTrue(fails(operations))
+        self.assertLessEqual(len(operations), 5)
+        for index in range(len(operations)):
+            self.assertFalse(fails(operations[:index] + operations[index + 1:]))
+
+
+class LegacyEngine(Engine):
+    """Applies operations to a bidcat_legacy auction."""
+    # whether the auction's reserved money is counted by the bank
+    registered = True
+
+    def __init__(self):
+        super().__init__()
+        if self.registered:
+            self.auction.register_reserved_money_checker()
+
+    def make_auction(self, bank):
+        from bidcat_legacy import Auction as LegacyAuction
+        return LegacyAuction(bank)
+
+    def call(self, operation):
+        kind, *args = operation
+        if kind == "flush":
+            return None
+        if kind == "clear":
+            return self.auction.clear()
+        # the legacy auction only places bids, replacing existing ones.
+        # removals are turned into invalid bids of 0
+        user, item, *amount = args
+        return self.auction.place_bid(user, item, amount[0] if amount else 0)
+
+    def get_state(self):
+        return {
+            "result": self.auction.process_bids(),
+            "reserved": {user: self.auction.get_reserved_money(user) for user in USERS},
+            "available": {user: self.bank.get_available_money(user) for user in USERS},
+        }
+
+
+class IndexedLegacyEngine(LegacyEngine):
+    def make_auction(self, bank):
+        from bidcat_legacy.indexed import IndexedAuction
+        return IndexedAuction(bank)
+
+
+class UnregisteredLegacyEngine(LegacyEngine):
+    registered = False
+    # less than the highest amounts, so that bids placed again can exceed the available money
+    starting_amount = 10
+
+
+class UnregisteredIndexedLegacyEngine(IndexedLegacyEngine):
+    registered = False
+    starting_amount = 10
+
+
+class LegacyDifferentialTester(DifferentialTestCase):
+    def test_legacy_adapter(self):
+        self.check(IndexedLegacyEngine, LegacyEngine)
+
+    def test_unregistered_legacy_adapter(self):
+        self.check(UnregisteredIndexedLegacyEngine, UnregisteredLegacyEngine)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()
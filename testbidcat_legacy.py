@@ -1,6 +1,6 @@
 import unittest
 import logging
-from bidcat_legacy import Auction, InsufficientMoneyError
+from bidcat_legacy import Auction, Bid, InsufficientMoneyError
 import datetime
 
 class AuctionsysTester(unittest.TestCase):
@@ -216,6 +216,110 @@ class AuctionsysTester(unittest.TestCase):
 		# katamari should have won
 		self.assertEqual(result["winning_item"], "katamari")
 
+	def test_reserved_after_replacing(self):
+		self.auction.place_bid("alice", "katamari", 5)
+		self.auction.place_bid("alice", "pepsiman", 3)
+		self.auction.place_bid("bob", "katamari", 2)
+		self.auction.place_bid("alice", "katamari", 1)
+		self.assertEqual(self.auction.get_reserved_money("alice"), 4)
+		self.assertEqual(self.auction.process_bids()["all_bids"],
+			[("alice","pepsiman",3),("bob","katamari",2),("alice","katamari",1)])
+		self.auction.clear()
+		self.assertEqual(self.auction.get_reserved_money("alice"), 0)
+
+	def test_assign_bids(self):
+		self.auction.place_bid("alice", "pepsiman", 3)
+		self.auction.bids = [Bid("bob", "katamari", 2), ("alice", "katamari", 1), Bid("bob", "katamari", 4)]
+		self.assertEqual(self.auction.bids, [Bid("alice", "katamari", 1), Bid("bob", "katamari", 4)])
+		self.assertEqual(self.auction.get_reserved_money("alice"), 1)
+		self.assertEqual(self.auction.get_reserved_money("bob"), 4)
+		self.assertEqual(self.auction.process_bids()["winning_bid"]["winning_item"], "katamari")
+
+	def test_many_bids(self):
+		#placing and replacing bids must not slow down with the number of bids.
+		#compares chunks of 500 bids at the start and at the end instead of asserting wall-clock time,
+		#a linear scan per bid makes the last chunks 10-20 times slower than the first ones
+		chunks = []
+		for chunk in range(10):
+			start = datetime.datetime.now()
+			for i in range(chunk * 500, (chunk + 1) * 500):
+				self.auction.place_bid("user%d" % (i % 1000), "item%d" % (i % 7), 1 + i % 10)
+			chunks.append((datetime.datetime.now() - start).total_seconds())
+		logging.getLogger("legacy").info("placing 500 bids took %.1fms to %.1fms", min(chunks) * 1000, max(chunks) * 1000)
+		self.assertEqual(len(self.auction.process_bids()["all_bids"]), 5000)
+		#the best of the last chunks, so a single hiccup doesn't fail the test
+		self.assertLess(min(chunks[-3:]), 5 * chunks[0])
+
+
+class IndexedAuctionTester(AuctionsysTester):
+	"""Runs all legacy tests against the legacy adapter of the indexed engine."""
+	def setUp(self):
+		from banksys import DummyBank
+		from bidcat_legacy.indexed import IndexedAuction
+		self.bank = DummyBank()
+		self.auction = IndexedAuction(bank=self.bank)
+		self.auction.register_reserved_money_checker()
+
+	def test_assign_bids(self):
+		self.skipTest("IndexedAuction.bids is read-only")
+
+	def test_same_results_as_legacy(self):
+		import random
+		from banksys import DummyBank
+		rng = random.Random(3)
+		bank = DummyBank()
+		bank._starting_amount = 100
+		legacy = Auction(bank=bank)
+		legacy.register_reserved_money_checker()
+		indexed_bank = DummyBank()
+		indexed_bank._starting_amount = 100
+		from bidcat_legacy.indexed import IndexedAuction
+		indexed = IndexedAuction(bank=indexed_bank)
+		indexed.register_reserved_money_checker()
+		for _ in range(500):
+			user = rng.choice(["alice", "bob", "cirno", "deku", "eve"])
+			item = rng.choice(["pepsiman", "katamari", "unfinished_battle"])
+			amount = rng.randint(1, 40)
+			outcomes = []
+			for auction in (legacy, indexed):
+				try:
+					auction.place_bid(user, item, amount)
+					outcomes.append(None)
+				except InsufficientMoneyError:
+					outcomes.append("insufficient")
+			self.assertEqual(outcomes[0], outcomes[1])
+			self.assertEqual(legacy.process_bids(), indexed.process_bids())
+			self.assertEqual(legacy.get_reserved_money(user), indexed.get_reserved_money(user))
+		legacy.deregister_reserved_money_checker()
+		indexed.deregister_reserved_money_checker()
+
+	def test_unregistered(self):
+		auction = type(self.auction)(bank=self.bank)
+		auction.place_bid("alice", "pepsiman", 10)
+		self.assertEqual(self.bank.get_reserved_money("alice"), 0)
+
+	def test_unregistered_replace(self):
+		from banksys import DummyBank
+		bank = DummyBank()
+		bank._starting_amount = 100
+		auction = type(self.auction)(bank=bank)
+		auction.place_bid("alice", "pepsiman", 60)
+		auction.place_bid("bob", "katamari", 60)
+		# nothing is reserved, so only the increase has to be available
+		auction.place_bid("alice", "pepsiman", 120)
+		self.assertEqual(auction.bids, [Bid("bob", "katamari", 60), Bid("alice", "pepsiman", 120)])
+		self.assertEqual(auction.process_bids()["winning_bid"]["winning_item"], "pepsiman")
+		self.assertRaises(InsufficientMoneyError, auction.place_bid, "alice", "pepsiman", 300)
+		self.assertEqual(auction.bids, [Bid("bob", "katamari", 60), Bid("alice", "pepsiman", 120)])
+		self.assertEqual(auction.process_bids()["winning_bid"]["total_cost"], 120)
+		auction.place_bid("bob", "katamari", 60)
+		self.assertEqual(auction.bids, [Bid("alice", "pepsiman", 120), Bid("bob", "katamari", 60)])
+		auction.place_bid("carol", "katamari", 60)
+		# the same amount again, although it couldn't be afforded now, makes pepsiman lose the tie
+		auction.place_bid("alice", "pepsiman", 120)
+		self.assertEqual(auction.process_bids()["winning_bid"]["winning_item"], "katamari")
+
+
 if __name__ == "__main__":
 	logging.basicConfig(level=logging.INFO)
 	unittest.main()
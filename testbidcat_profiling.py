@@ -0,0 +1,110 @@
+import unittest
+import logging
+import json
+import os
+import shutil
+import tempfile
+from bidcat import Auction, InsufficientMoneyError
+from bidcat.profiling import Profiler
+
+
+class ProfilerTester(unittest.TestCase):
+    def setUp(self):
+        from banksys import DummyBank
+        self.bank = DummyBank()
+        self.bank._starting_amount = 100
+        self.auction = Auction(bank=self.bank)
+        self.profiler = Profiler(max_spans=1000)
+        self.profiler.attach(self.auction)
+        self.profiler.attach(self.bank)
+
+    def tearDown(self):
+        self.profiler.detach()
+        self.auction.deregister_reserved_money_checker()
+
+    def test_nested_spans(self):
+        self.auction.place_bid("alice", "pepsiman", 10)
+        stacks = [span.stack for span in self.profiler.spans]
+        self.assertIn(("Auction.place_bid", "Auction._handle_bid", "DummyBank.get_available_money",
+                       "DummyBank.get_reserved_money"), stacks)
+        self.assertIn(("Auction.place_bid", "Auction._handle_bid", "Auction._item_changed", "Auction._publish"),
+                      stacks)
+        outermost = [span for span in self.profiler.spans if len(span.stack) == 1]
+        self.assertEqual(len(outermost), 1)
+        self.assertEqual(sum(span.self_duration for span in self.profiler.spans), outermost[0].duration)
+
+    def test_allocation_and_errors(self):
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.assertRaises(InsufficientMoneyError, self.auction.place_bid, "alice", "katamari", 100)
+        self.auction.get_winner()
+        names = {span.stack[-1] for span in self.profiler.spans}
+        self.assertIn("Auction.allocation", names)
+        # failed operations are recorded too
+        self.assertEqual(len([span for span in self.profiler.spans if span.stack == ("Auction.place_bid",)]), 2)
+
+    def test_detach(self):
+        self.profiler.detach()
+        self.assertNotIn("place_bid", self.auction.__dict__)
+        self.assertNotIn("get_total_money", self.bank.__dict__)
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.assertEqual(len(self.profiler.spans), 0)
+        self.assertEqual(self.auction.get_winner()["money_owed"], {"alice": 1})
+
+    def test_detach_unwraps_snapshot(self):
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.auction.winner_max_mutations = 10
+        self.profiler.detach()
+        self.profiler.clear()
+        self.assertEqual(self.auction.snapshot().get_winner()["money_owed"], {"alice": 1})
+        self.assertEqual(self.auction.get_winner(fresh=True)["money_owed"], {"alice": 1})
+        self.assertEqual(len(self.profiler.spans), 0)
+        self.assertNotIn("allocation", self.auction.__dict__)
+
+    def test_bounded(self):
+        for i in range(200):
+            self.auction.get_headroom()
+        self.assertEqual(len(self.profiler.spans), 200)
+        for i in range(100):
+            self.auction.place_bid("alice", i, 1)
+        self.assertEqual(len(self.profiler.spans), 1000)
+
+    def test_sampling(self):
+        self.profiler.sample_every = 4
+        for i in range(8):
+            self.auction.get_headroom()
+        self.assertEqual(len(self.profiler.spans), 2)
+
+    def test_sampling_nested(self):
+        self.profiler.sample_every = 3
+        for i in range(6):
+            self.auction.place_bid("alice", i, 1)
+        # only complete operations are recorded
+        outermost = [span for span in self.profiler.spans if len(span.stack) == 1]
+        self.assertEqual([span.stack for span in outermost], [("Auction.place_bid",)] * 2)
+        self.assertTrue(all(span.stack[0] == "Auction.place_bid" for span in self.profiler.spans))
+        self.assertEqual(sum(span.self_duration for span in self.profiler.spans),
+                         sum(span.duration for span in outermost))
+
+    def test_output(self):
+        self.auction.place_bid("alice", "pepsiman", 10)
+        self.auction.get_winner()
+        directory = tempfile.mkdtemp()
+        try:
+            trace_path = os.path.join(directory, "trace.json")
+            self.profiler.write_chrome_trace(trace_path)
+            with open(trace_path) as f:
+                events = json.load(f)["traceEvents"]
+            self.assertEqual(len(events), len(self.profiler.spans))
+            self.assertEqual({event["ph"] for event in events}, {"X"})
+            collapsed_path = os.path.join(directory, "stacks.txt")
+            self.profiler.write_collapsed(collapsed_path)
+            with open(collapsed_path) as f:
+                lines = f.read().splitlines()
+            self.assertIn("Auction.get_winner;Auction.allocation", [line.rsplit(" ", 1)[0] for line in lines])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import logging
+import os
+import random
+import shutil
+import tempfile
+from bidcat import Auction, BiddingError
+from bidcat.replay import BidRecorder, load, replay
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ReplayTester(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def make_bank(self, starting_amount=100):
+        from banksys import DummyBank
+        self.bank = DummyBank()
+        self.bank._starting_amount = starting_amount
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_auction(self, **options):
+        auction = Auction(bank=self.bank, **options)
+        self.addCleanup(auction.deregister_reserved_money_checker)
+        return auction
+
+    def record(self, path, clock=None, auction_options=None):
+        rng = random.Random(7)
+        self.make_bank()
+        recorder = BidRecorder(self.make_auction(**(auction_options or {})), path, **({"clock": clock} if clock else {}))
+        with recorder:
+            for _ in range(300):
+                if clock:
+                    clock.now += 0.5
+                user = rng.choice(["alice", "bob", "charlie", 4])
+                item = rng.choice(["pepsiman", "katamari", 7])
+                method = rng.choice([recorder.place_bid, recorder.replace_bid, recorder.increase_bid])
+                try:
+                    if rng.random() < 0.1:
+                        recorder.remove_bid(user, item)
+                    elif rng.random() < 0.1:
+                        recorder.replace_bid(user, item, rng.randint(1, 20), allow_visible_lowering=False)
+                    else:
+                        method(user, item, rng.randint(1, 20))
+                except BiddingError:
+                    pass
+        return recorder.auction
+
+    def test_roundtrip(self):
+        for name in ["bids.log", "bids.log.gz"]:
+            path = os.path.join(self.directory, name)
+            recorded = self.record(path)
+            self.make_bank()
+            report = replay(path, self.make_auction())
+            self.assertEqual(report["operations"], 300)
+            self.assertGreater(report["errors"], 0)
+            self.assertTrue(report["matches"])
+            self.assertEqual(report["winner"]["item"], recorded.get_winner()["item"])
+            self.assertLessEqual(report["latency"]["p50"], report["latency"]["max"])
+
+    def test_cached_winner(self):
+        path = os.path.join(self.directory, "bids.log")
+        self.record(path, auction_options={"winner_max_mutations": 10})
+        self.make_bank()
+        report = replay(path, self.make_auction())
+        self.assertTrue(report["matches"])
+        self.assertNotIn("version", report["expected_winner"])
+
+    def test_mismatch(self):
+        path = os.path.join(self.directory, "bids.log")
+        self.record(path)
+        self.make_bank(starting_amount=10)
+        report = replay(path, self.make_auction())
+        self.assertFalse(report["matches"])
+
+    def test_recorded_speed(self):
+        path = os.path.join(self.directory, "bids.log")
+        self.record(path, clock=FakeClock())
+        operations, winner = load(path)
+        self.assertEqual(operations[-1][0], 150.0)
+        self.assertIsNotNone(winner)
+        self.make_bank()
+        clock = FakeClock()
+        report = replay(path, self.make_auction(), speed=2, clock=clock, sleep=clock.sleep)
+        self.assertEqual(report["duration"], 75.0)
+        self.assertTrue(report["matches"])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()
@@ -0,0 +1,195 @@
+import unittest
+import logging
+import threading
+from bidcat import Auction
+from bidcat.scheduler import AuctionScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulerTester(unittest.TestCase):
+    def setUp(self):
+        from banksys import DummyBank
+        self.bank = DummyBank()
+        self.clock = FakeClock()
+        self.scheduler = AuctionScheduler(clock=self.clock)
+        self.closed = []
+
+    def on_close(self, auction, winner):
+        self.closed.append((self.clock.now, auction, winner))
+
+    def make_auction(self):
+        auction = Auction(bank=self.bank)
+        self.addCleanup(auction.deregister_reserved_money_checker)
+        return auction
+
+    def test_close_order(self):
+        auctions = [self.make_auction() for _ in range(5)]
+        for i, auction in enumerate(auctions):
+            self.scheduler.schedule(auction, close_at=50 - 10 * i, on_close=self.on_close)
+        self.assertEqual(self.scheduler.time_until_next(), 10)
+        self.clock.now = 30
+        self.assertEqual(self.scheduler.run_pending(), 3)
+        self.assertEqual([auction for _, auction, _ in self.closed], auctions[:1:-1])
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.clock.now = 100
+        self.assertEqual(self.scheduler.run_pending(), 2)
+        self.assertIsNone(self.scheduler.time_until_next())
+
+    def test_winner_passed(self):
+        auction = self.make_auction()
+        auction.place_bid("alice", "pepsiman", 5)
+        self.scheduler.schedule(auction, close_at=10, on_close=self.on_close)
+        self.clock.now = 10
+        self.scheduler.run_pending()
+        _, _, winner = self.closed[0]
+        self.assertEqual(winner["item"], "pepsiman")
+        self.assertFalse(self.scheduler.is_open(auction))
+
+    def test_open(self):
+        auction = self.make_auction()
+        opened = []
+        self.scheduler.schedule(auction, open_at=5, close_at=10,
+                                on_open=opened.append, on_close=self.on_close)
+        self.assertFalse(self.scheduler.is_open(auction))
+        self.assertEqual(self.scheduler.time_until_next(), 5)
+        self.clock.now = 5
+        self.scheduler.run_pending()
+        self.assertEqual(opened, [auction])
+        self.assertTrue(self.scheduler.is_open(auction))
+        self.assertEqual(self.scheduler.time_until_next(), 5)
+        self.clock.now = 10
+        self.assertEqual(self.scheduler.run_pending(), 1)
+
+    def test_anti_snipe_extension(self):
+        auction = self.make_auction()
+        self.scheduler.schedule(auction, close_at=60, on_close=self.on_close,
+                                extension=10, extension_window=10, max_close_at=72)
+        self.clock.now = 40
+        auction.place_bid("alice", "pepsiman", 1)
+        # not within the last 10 seconds
+        self.assertEqual(self.scheduler.get_close_time(auction), 60)
+        self.clock.now = 55
+        auction.place_bid("bob", "pepsiman", 1)
+        self.assertEqual(self.scheduler.get_close_time(auction), 65)
+        self.clock.now = 60
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.clock.now = 64
+        auction.increase_bid("bob", "pepsiman", 1)
+        # capped by max_close_at
+        self.assertEqual(self.scheduler.get_close_time(auction), 72)
+        self.clock.now = 71
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.clock.now = 72
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.assertEqual(self.closed[0][0], 72)
+        # closed auctions aren't listened to anymore
+        self.assertEqual(auction.change_listeners, set())
+
+    def test_late_bid_not_extending(self):
+        auction = self.make_auction()
+        self.scheduler.schedule(auction, close_at=60, on_close=self.on_close, extension=10, extension_window=10)
+        # past the deadline, but run_pending() wasn't polled yet
+        self.clock.now = 61
+        auction.place_bid("alice", "pepsiman", 1)
+        self.assertEqual(self.scheduler.get_close_time(auction), 60)
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.assertEqual(self.closed[0][2]["item"], "pepsiman")
+
+    def test_cancel_and_reschedule(self):
+        first, second = self.make_auction(), self.make_auction()
+        self.scheduler.schedule(first, close_at=10, on_close=self.on_close)
+        self.scheduler.schedule(second, close_at=10, on_close=self.on_close)
+        self.assertRaises(ValueError, self.scheduler.schedule, first, 20, self.on_close)
+        self.assertTrue(self.scheduler.cancel(first))
+        self.assertFalse(self.scheduler.cancel(first))
+        self.scheduler.reschedule(second, 30)
+        self.clock.now = 20
+        self.assertEqual(self.scheduler.run_pending(), 0)
+        self.clock.now = 30
+        self.assertEqual(self.scheduler.run_pending(), 1)
+        self.assertEqual([auction for _, auction, _ in self.closed], [second])
+
+    def test_failing_callback(self):
+        def fail(auction, winner):
+            raise RuntimeError("settlement failed")
+        self.scheduler.schedule(self.make_auction(), close_at=1, on_close=fail)
+        self.scheduler.schedule(self.make_auction(), close_at=2, on_close=self.on_close)
+        self.clock.now = 2
+        logging.disable(logging.ERROR)
+        try:
+            self.assertEqual(self.scheduler.run_pending(), 2)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(len(self.closed), 1)
+
+    def test_failing_winner(self):
+        class BrokenAuction(Auction):
+            def snapshot(self):
+                raise RuntimeError("broken snapshot")
+        broken = BrokenAuction(bank=self.bank)
+        self.addCleanup(broken.deregister_reserved_money_checker)
+        self.scheduler.schedule(broken, close_at=1, on_close=self.on_close)
+        self.scheduler.schedule(self.make_auction(), close_at=2, on_close=self.on_close)
+        self.clock.now = 2
+        logging.disable(logging.ERROR)
+        try:
+            self.assertEqual(self.scheduler.run_pending(), 2)
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(len(self.closed), 1)
+
+    def test_close_while_bidding(self):
+        import time
+        from banksys import DummyBank
+        bank = DummyBank()
+        auction = Auction(bank=bank)
+        self.addCleanup(auction.deregister_reserved_money_checker)
+        scheduler = AuctionScheduler()
+        winners = []
+        done = threading.Event()
+
+        def on_close(auction, winner):
+            winners.append(winner)
+            done.set()
+        scheduler.schedule(auction, close_at=time.monotonic() + 0.05, on_close=on_close)
+        stop = threading.Event()
+        thread = threading.Thread(target=scheduler.run, args=(stop,))
+        thread.start()
+        try:
+            i = 0
+            while not done.is_set() and i < 10**6:
+                auction.place_bid("alice", i % 50, 1 + i % 3)
+                auction.remove_bid("alice", (i + 25) % 50)
+                i += 1
+            self.assertTrue(done.wait(2))
+        finally:
+            scheduler.stop(stop)
+            thread.join()
+        self.assertEqual(len(winners), 1)
+
+    def test_run_thread(self):
+        import time
+        scheduler = AuctionScheduler()
+        done = threading.Event()
+        scheduler.schedule(self.make_auction(), close_at=time.monotonic() + 0.05,
+                           on_close=lambda auction, winner: done.set())
+        stop = threading.Event()
+        thread = threading.Thread(target=scheduler.run, args=(stop,))
+        thread.start()
+        try:
+            self.assertTrue(done.wait(2))
+        finally:
+            scheduler.stop(stop)
+            thread.join()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()
@@ -0,0 +1,226 @@
+import unittest
+import logging
+import fcntl
+import multiprocessing
+import os
+import shutil
+import tempfile
+from bidcat import Auction, InsufficientMoneyError
+from bidcat.shared import SharedReservedTable
+
+
+def make_bank():
+    from banksys import DummyBank
+    bank = DummyBank()
+    bank._starting_amount = 1000
+    return bank
+
+
+def try_bidding(path, amount, results):
+    """Bids in another process, reporting whether the bid was accepted."""
+    table = SharedReservedTable(path)
+    auction = Auction(make_bank())
+    table.attach(auction)
+    try:
+        auction.place_bid("alice", "katamari", amount)
+        results.put(True)
+    except InsufficientMoneyError:
+        results.put(False)
+    table.close()
+
+
+def race(path, barrier, results):
+    """Bids 600 in another process at the same moment as other processes do."""
+    table = SharedReservedTable(path)
+    auction = Auction(make_bank())
+    table.attach(auction)
+    barrier.wait()
+    try:
+        auction.place_bid("alice", "katamari", 600)
+        results.put(True)
+    except InsufficientMoneyError:
+        results.put(False)
+    # keep the reservation until every process bid
+    barrier.wait()
+    table.close()
+
+
+def churn(path, worker, rounds):
+    """Changes bids in another process, leaving worker+1 reserved for each of two users."""
+    table = SharedReservedTable(path)
+    auction = Auction(make_bank())
+    table.attach(auction)
+    for i in range(rounds):
+        auction.place_bid("alice", worker, 1 + i % 5)
+        auction.increase_bid("alice", worker, 1)
+        auction.place_bid(worker, "pepsiman", 3)
+        auction.remove_bid("alice", worker)
+        auction.remove_bid(worker, "pepsiman")
+    auction.place_bid("alice", worker, worker + 1)
+    auction.place_bid("bob", worker, worker + 1)
+    # exit without detaching, the reservations stay like for a running auction
+    os._exit(0)
+
+
+def try_locking(table, results):
+    """Reports whether a forked process can lock the table its parent has locked."""
+    try:
+        fcntl.flock(table._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        results.put(True)
+    except BlockingIOError:
+        results.put(False)
+
+
+def add_forked(table, results):
+    """Adds to the table inherited from the parent process."""
+    table.add("alice", 5)
+    results.put(table.get_reserved_money("alice"))
+
+
+class SharedReservedTableTester(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "reserved")
+        self.table = SharedReservedTable(self.path, capacity=100)
+        self.bank = make_bank()
+        self.auction = Auction(self.bank)
+
+    def tearDown(self):
+        self.table.close()
+        shutil.rmtree(self.directory)
+
+    def test_attached_auction(self):
+        self.auction.place_bid("alice", "pepsiman", 100)
+        self.table.attach(self.auction)
+        self.assertEqual(self.table.get_reserved_money("alice"), 100)
+        # the table replaces the auction's checker, so nothing is counted twice
+        self.assertEqual(self.bank.get_reserved_money("alice"), 100)
+        self.auction.increase_bid("alice", "pepsiman", 50)
+        self.auction.place_bid("alice", "katamari", 10)
+        self.auction.place_bid(7, "katamari", 10)
+        self.assertEqual(self.table.get_reserved_money("alice"), 160)
+        self.assertEqual(self.table.get_reserved_money(7), 10)
+        self.assertEqual(self.table.get_reserved_money("7"), 0)
+        self.auction.remove_bid("alice", "pepsiman")
+        self.assertEqual(self.bank.get_available_money("alice"), 990)
+        self.auction.clear()
+        self.assertEqual(self.table.get_reserved_money("alice"), 0)
+        self.auction.place_bid("alice", "pepsiman", 5)
+        self.table.detach(self.auction)
+        self.assertEqual(self.table.get_reserved_money("alice"), 0)
+        self.assertEqual(self.bank.get_reserved_money("alice"), 5)
+
+    def test_reopen(self):
+        self.table.add("alice", 42)
+        other = SharedReservedTable(self.path, capacity=4)
+        self.assertEqual(other.capacity, 128)
+        self.assertEqual(other.get_reserved_money("alice"), 42)
+        other.reset()
+        self.assertEqual(self.table.get_reserved_money("alice"), 0)
+        other.close()
+
+    def test_full(self):
+        for user in range(96):
+            self.table.add(user, 1)
+        self.assertRaises(RuntimeError, self.table.add, "alice", 1)
+        for user in range(96):
+            self.assertEqual(self.table.get_reserved_money(user), 1)
+
+    def test_full_rejects_bid(self):
+        for user in range(96):
+            self.table.add(user, 1)
+        self.table.attach(self.auction)
+        self.assertRaises(RuntimeError, self.auction.place_bid, "alice", "pepsiman", 10)
+        # the bid wasn't applied
+        self.assertEqual(self.auction.get_bids_for_user("alice"), {})
+        self.auction.place_bid(5, "pepsiman", 10)
+        self.assertEqual(self.table.get_reserved_money(5), 11)
+        self.auction.remove_bid(5, "pepsiman")
+        self.assertEqual(self.table.get_reserved_money(5), 1)
+
+    def test_reserve(self):
+        self.assertTrue(self.table.reserve("alice", 60, 100))
+        self.assertFalse(self.table.reserve("alice", 50, 100))
+        self.assertTrue(self.table.reserve("alice", 40, 100))
+        self.assertEqual(self.table.get_reserved_money("alice"), 100)
+        self.assertFalse(self.table.reserve("bob", 1, 0))
+        self.assertEqual(self.table.get_reserved_money("bob"), 0)
+
+    def test_other_process(self):
+        self.table.attach(self.auction)
+        self.auction.place_bid("alice", "pepsiman", 600)
+        results = multiprocessing.Queue()
+        for amount, accepted in [(500, False), (400, True)]:
+            process = multiprocessing.Process(target=try_bidding, args=(self.path, amount, results))
+            process.start()
+            self.assertEqual(results.get(timeout=30), accepted)
+            process.join()
+        # the other process detached again
+        self.assertEqual(self.bank.get_reserved_money("alice"), 600)
+
+    def test_prefetched_balance(self):
+        from banksys import SqliteBank
+        bank_path = os.path.join(self.directory, "bank.sqlite")
+        bank, other = SqliteBank(bank_path), SqliteBank(bank_path)
+        bank.create_account("alice", 100)
+        bank.prefetch(["alice"]).join()
+        auction = Auction(bank)
+        self.table.attach(auction)
+        # another worker spends money after it was prefetched
+        other.make_transaction("alice", -60, {})
+        self.assertRaises(InsufficientMoneyError, auction.place_bid, "alice", "pepsiman", 50)
+        auction.place_bid("alice", "pepsiman", 40)
+        self.assertEqual(self.table.get_reserved_money("alice"), 40)
+        self.table.detach(auction)
+        auction.deregister_reserved_money_checker()
+        bank.close()
+        other.close()
+
+    def test_fork(self):
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        # a table opened before forking must not share its flock() with the child
+        fcntl.flock(self.table._fd, fcntl.LOCK_EX)
+        try:
+            process = context.Process(target=try_locking, args=(self.table, results))
+            process.start()
+            self.assertFalse(results.get(timeout=30))
+            process.join()
+        finally:
+            fcntl.flock(self.table._fd, fcntl.LOCK_UN)
+        # nor a lock held by another thread while forking
+        with self.table._lock:
+            process = context.Process(target=add_forked, args=(self.table, results))
+            process.start()
+            self.assertEqual(results.get(timeout=30), 5)
+        process.join()
+        self.assertEqual(self.table.get_reserved_money("alice"), 5)
+
+    def test_concurrent_bids(self):
+        results = multiprocessing.Queue()
+        barrier = multiprocessing.Barrier(4)
+        workers = [multiprocessing.Process(target=race, args=(self.path, barrier, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        accepted = [results.get(timeout=30) for _ in workers]
+        for worker in workers:
+            worker.join()
+        # only one of them could afford it
+        self.assertEqual(accepted.count(True), 1)
+        self.assertEqual(self.table.get_reserved_money("alice"), 0)
+
+    def test_concurrent_processes(self):
+        workers = [multiprocessing.Process(target=churn, args=(self.path, worker, 200)) for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        self.assertEqual(self.table.get_reserved_money("alice"), 1 + 2 + 3 + 4)
+        self.assertEqual(self.table.get_reserved_money("bob"), 1 + 2 + 3 + 4)
+        self.assertEqual(self.table.get_reserved_money(0), 0)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()
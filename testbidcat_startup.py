@@ -0,0 +1,59 @@
+import unittest
+import logging
+import os
+import subprocess
+import sys
+
+# modules only needed for databases, archives or batch evaluation,
+# which importing banksys and bidcat and checking a balance must not load
+LAZY_MODULES = ("sqlite3", "zlib", "concurrent.futures", "multiprocessing", "pymongo")
+
+# prints the seconds importing took, followed by the lazy modules that got loaded
+CHECK_BALANCE = """
+import sys, time
+start = time.perf_counter()
+import banksys, bidcat
+imported = time.perf_counter() - start
+bank = banksys.DummyBank()
+auction = bidcat.Auction(bank)
+bank.get_available_money("alice")
+print(imported, *[module for module in %r if module in sys.modules])
+"""
+
+
+class StartupTester(unittest.TestCase):
+    def check_balance(self):
+        """Checks a balance in a fresh interpreter. Returns a tuple (import seconds, loaded lazy modules)"""
+        output = subprocess.check_output([sys.executable, "-c", CHECK_BALANCE % (LAZY_MODULES,)],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)), text=True)
+        seconds, *loaded = output.split()
+        return float(seconds), loaded
+
+    def test_no_heavy_imports(self):
+        _, loaded = self.check_balance()
+        self.assertEqual(loaded, [])
+
+    def test_import_time(self):
+        # best of a few runs, the first one may have to compile the modules.
+        # only logged, wall-clock time depends too much on the machine to assert it
+        seconds = min(self.check_balance()[0] for _ in range(3))
+        logging.getLogger("startup").info("importing banksys and bidcat took %.1fms", seconds * 1000)
+
+    def test_lazy_mongo_collections(self):
+        from banksys import MongoBank
+        looked_up = []
+
+        class Database(dict):
+            def __missing__(self, name):
+                looked_up.append(name)
+                return name
+        bank = MongoBank(Database())
+        self.assertEqual(looked_up, [])
+        self.assertEqual(bank.users_collection, "users")
+        self.assertEqual(bank.users_collection, "users")
+        self.assertEqual(looked_up, ["users"])
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import logging
+import random
+from bidcat import Auction, allocate_equal_split, allocate_proportional
+from bidcat.whatif import what_ifs
+
+
+class WhatIfTester(unittest.TestCase):
+    def setUp(self):
+        from banksys import DummyBank
+        self.bank = DummyBank()
+        self.bank._starting_amount = 10**9
+        self.random = random.Random(42)
+
+    def make_auction(self, operations, allocation):
+        auction = Auction(self.bank, allocation=allocation)
+        auction.deregister_reserved_money_checker()
+        for user, item, amount in operations:
+            if amount:
+                if item in auction.get_bids_for_user(user):
+                    auction.replace_bid(user, item, amount)
+                else:
+                    auction.place_bid(user, item, amount)
+            else:
+                auction.remove_bid(user, item)
+        return auction
+
+    def random_operations(self, count):
+        return [(self.random.randrange(8), self.random.randrange(5), self.random.randrange(6))
+                for _ in range(count)]
+
+    def test_matches_applying(self):
+        for allocation in (allocate_proportional, allocate_equal_split):
+            for _ in range(100):
+                operations = self.random_operations(self.random.randrange(15))
+                auction = self.make_auction(operations, allocation)
+                version = auction.version
+                for query in self.random_operations(10):
+                    changed = self.make_auction(operations + [query], allocation)
+                    self.assertEqual(auction.what_if(*query), changed.get_winner(), (operations, query))
+                    self.assertEqual(auction.what_if(*query, discount_latter=True),
+                                     changed.get_winner(discount_latter=True))
+                self.assertEqual(auction.version, version)
+
+    def test_batch(self):
+        auction = self.make_auction(self.random_operations(50), allocate_equal_split)
+        queries = self.random_operations(200)
+        expected = [auction.what_if(*query) for query in queries]
+        self.assertEqual(what_ifs(auction, queries), expected)
+        self.assertEqual(what_ifs(auction.snapshot(), queries), expected)
+
+    def test_batch_on_pool(self):
+        auction = self.make_auction(self.random_operations(50), allocate_proportional)
+        queries = self.random_operations(200)
+        expected = [auction.what_if(*query, discount_latter=True) for query in queries]
+        version = auction.version
+        results = what_ifs(auction, queries, discount_latter=True, max_workers=2, inline_below=0)
+        self.assertEqual(results, expected)
+        self.assertEqual(auction.version, version)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    unittest.main()